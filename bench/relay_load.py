@@ -0,0 +1,632 @@
+"""
+转发压力测试
+
+在本地启动模拟 Discord（REST、webhook）、QQ频道 API 与图片 CDN 的 aiohttp 服务，
+按设定的速率生成消息与删除事件，交给插件真实的 create_message / delete_message
+处理，统计每个方向的吞吐量、p50/p99 延迟与错误率。
+
+用法：
+    python bench/relay_load.py --rate 50 --duration 20 --latency-ms 30 \\
+        --rate-limit 0.01 --audit 0.05 --image 0.2 --file 0.05 --delete 0.1
+
+插件配置可以通过 --set 传入，例如 --set dcqg_relay_outbox=true
+"""
+
+import argparse
+import asyncio
+from collections import defaultdict
+from contextlib import suppress
+from datetime import datetime, timezone
+import io
+import itertools
+import json
+from pathlib import Path
+import random
+import socket
+import sys
+import tempfile
+import time
+from typing import Any, Callable
+
+from aiohttp import web
+import nonebot
+from nonebot.compat import type_validate_python
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+DC_GUILD_ID = 1000
+DC_APPLICATION_ID = 2000
+QQ_GUILD_ID = "3000"
+QQ_BOT_ID = "4000"
+
+ids = itertools.count(10**17)
+
+
+def next_id() -> int:
+    return next(ids)
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def dc_user(user_id: int, bot: bool = False) -> dict[str, Any]:
+    return {
+        "id": str(user_id),
+        "username": f"user{user_id % 1000}",
+        "discriminator": "0",
+        "global_name": f"User {user_id % 1000}",
+        "avatar": None,
+        "bot": bot,
+    }
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class FakeServer:
+    """模拟 Discord、QQ频道与 CDN 的接口"""
+
+    def __init__(self, latency: float, rate_limit: float, audit: float, file_size: int):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.audit = audit
+        self.file_size = file_size
+        self.requests: defaultdict[str, int] = defaultdict(int)
+        buffer = io.BytesIO()
+        Image.new("RGB", (1280, 960), (200, 120, 40)).save(buffer, "PNG")
+        self.image = buffer.getvalue()
+        self.app = web.Application(middlewares=[self.middleware], client_max_size=0)
+        self.app.add_routes(
+            [
+                web.get("/discord/users/@me/guilds", self.dc_guilds),
+                web.get("/discord/channels/{channel}/webhooks", self.dc_webhooks),
+                web.post(
+                    "/discord/channels/{channel}/webhooks", self.dc_create_webhook
+                ),
+                web.post("/discord/webhooks/{webhook}/{token}", self.dc_execute),
+                web.delete(
+                    "/discord/channels/{channel}/messages/{message}", self.empty
+                ),
+                web.delete(
+                    "/discord/webhooks/{webhook}/{token}/messages/{message}",
+                    self.empty,
+                ),
+                web.get("/discord/guilds/{guild}/members/{user}", self.dc_member),
+                web.post("/qq/auth", self.qq_auth),
+                web.get("/qq/users/@me", self.qq_me),
+                web.get("/qq/users/@me/guilds", self.qq_guilds),
+                web.get("/qq/guilds/{guild}/members/{user}", self.qq_member),
+                web.post("/qq/channels/{channel}/messages", self.qq_send),
+                web.delete("/qq/channels/{channel}/messages/{message}", self.empty),
+                web.get("/cdn/{name}", self.cdn),
+            ]
+        )
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler: Callable) -> Any:
+        route = request.match_info.route.resource
+        name = f"{request.method} {route.canonical if route else request.path}"
+        self.requests[name] += 1
+        if self.latency:
+            await asyncio.sleep(random.expovariate(1 / self.latency))
+        if (
+            not request.path.startswith(("/cdn", "/qq/auth"))
+            and request.method != "GET"
+            and random.random() < self.rate_limit
+        ):
+            self.requests["429"] += 1
+            return web.json_response(
+                {"message": "You are being rate limited.", "retry_after": 0.1},
+                status=429,
+            )
+        return await handler(request)
+
+    async def empty(self, request: web.Request) -> web.Response:
+        return web.Response(status=204)
+
+    async def cdn(self, request: web.Request) -> web.StreamResponse:
+        if not request.match_info["name"].endswith(".mp4"):
+            return web.Response(body=self.image, content_type="image/png")
+        # 分块返回视频，模拟大文件
+        response = web.StreamResponse()
+        response.content_type = "video/mp4"
+        response.content_length = self.file_size
+        await response.prepare(request)
+        chunk = bytes(64 * 1024)
+        for offset in range(0, self.file_size, len(chunk)):
+            await response.write(chunk[: self.file_size - offset])
+        await response.write_eof()
+        return response
+
+    async def dc_guilds(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            [
+                {
+                    "id": str(DC_GUILD_ID),
+                    "name": "bench",
+                    "icon": None,
+                    "owner": False,
+                    "permissions": "0",
+                    "features": [],
+                }
+            ]
+        )
+
+    async def dc_webhooks(self, request: web.Request) -> web.Response:
+        return web.json_response([])
+
+    async def dc_create_webhook(self, request: web.Request) -> web.Response:
+        channel = request.match_info["channel"]
+        return web.json_response(
+            {
+                "id": str(next_id()),
+                "type": 1,
+                "guild_id": str(DC_GUILD_ID),
+                "channel_id": channel,
+                "name": channel,
+                "avatar": None,
+                "token": "token",
+                "application_id": str(DC_APPLICATION_ID),
+            }
+        )
+
+    async def dc_execute(self, request: web.Request) -> web.Response:
+        async for _ in request.content.iter_any():
+            pass
+        return web.json_response(
+            {
+                "id": str(next_id()),
+                "channel_id": "0",
+                "author": dc_user(int(request.match_info["webhook"]), True),
+                "content": "",
+                "timestamp": now_iso(),
+                "edited_timestamp": None,
+                "tts": False,
+                "mention_everyone": False,
+                "mentions": [],
+                "mention_roles": [],
+                "attachments": [],
+                "embeds": [],
+                "pinned": False,
+                "type": 0,
+                "webhook_id": request.match_info["webhook"],
+            }
+        )
+
+    async def dc_member(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "user": dc_user(int(request.match_info["user"])),
+                "nick": None,
+                "roles": [],
+                "joined_at": now_iso(),
+                "deaf": False,
+                "mute": False,
+                "flags": 0,
+            }
+        )
+
+    async def qq_auth(self, request: web.Request) -> web.Response:
+        return web.json_response({"access_token": "token", "expires_in": "7200"})
+
+    async def qq_me(self, request: web.Request) -> web.Response:
+        return web.json_response({"id": QQ_BOT_ID, "username": "bench", "bot": True})
+
+    async def qq_guilds(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            [
+                {
+                    "id": QQ_GUILD_ID,
+                    "name": "bench",
+                    "icon": "",
+                    "owner_id": QQ_BOT_ID,
+                    "owner": False,
+                    "member_count": 100,
+                    "max_members": 1000,
+                    "description": "",
+                    "joined_at": now_iso(),
+                }
+            ]
+        )
+
+    async def qq_member(self, request: web.Request) -> web.Response:
+        user = request.match_info["user"]
+        return web.json_response(
+            {
+                "user": {"id": user, "username": f"qq{user[-3:]}"},
+                "nick": "",
+                "joined_at": now_iso(),
+            }
+        )
+
+    async def qq_send(self, request: web.Request) -> web.Response:
+        await request.read()
+        if random.random() < self.audit:
+            return web.json_response(
+                {
+                    "code": 304023,
+                    "message": "push message is waiting for audit now",
+                    "data": {"message_audit": {"audit_id": str(next_id())}},
+                },
+                status=202,
+            )
+        return web.json_response(
+            {
+                "id": str(next_id()),
+                "channel_id": request.match_info["channel"],
+                "guild_id": QQ_GUILD_ID,
+                "content": "",
+                "timestamp": now_iso(),
+                "author": {"id": QQ_BOT_ID, "username": "bench", "bot": True},
+            }
+        )
+
+
+class LoadRunner:
+    """生成事件并交给插件的 handler，记录每个方向的延迟与错误"""
+
+    def __init__(self, args: argparse.Namespace, base_url: str):
+        self.args = args
+        self.base_url = base_url
+        self.latencies: defaultdict[str, list[float]] = defaultdict(list)
+        self.errors: defaultdict[str, int] = defaultdict(int)
+        self.skipped: defaultdict[str, int] = defaultdict(int)
+        self.relayed: dict[str, list[tuple[Any, Any]]] = {"qq": [], "dc": []}
+
+    def dc_message_event(self, link: Any) -> Any:
+        from nonebot.adapters.discord import GuildMessageCreateEvent
+
+        user_id = random.randint(1, 20)
+        attachments = []
+        if random.random() < self.args.image:
+            attachments.append(
+                {
+                    "id": str(next_id()),
+                    "filename": "image.png",
+                    "size": 1,
+                    "url": f"{self.base_url}/cdn/image.png",
+                    "proxy_url": f"{self.base_url}/cdn/image.png",
+                    "content_type": "image/png",
+                    "width": 1280,
+                    "height": 960,
+                }
+            )
+        if random.random() < self.args.file:
+            attachments.append(
+                {
+                    "id": str(next_id()),
+                    "filename": "video.mp4",
+                    "size": self.args.file_kb * 1024,
+                    "url": f"{self.base_url}/cdn/video.mp4",
+                    "proxy_url": f"{self.base_url}/cdn/video.mp4",
+                    "content_type": "video/mp4",
+                }
+            )
+        return type_validate_python(
+            GuildMessageCreateEvent,
+            {
+                "id": str(next_id()),
+                "channel_id": str(link.dc_channel_id),
+                "guild_id": str(DC_GUILD_ID),
+                "author": dc_user(user_id),
+                "member": {
+                    "nick": None,
+                    "roles": [],
+                    "joined_at": now_iso(),
+                    "deaf": False,
+                    "mute": False,
+                    "flags": 0,
+                },
+                "content": random.choice(
+                    ["hello", f"hi <@{user_id + 1}>", "**bold** text " * 5]
+                ),
+                "timestamp": now_iso(),
+                "edited_timestamp": None,
+                "tts": False,
+                "mention_everyone": False,
+                "mentions": [],
+                "mention_roles": [],
+                "attachments": attachments,
+                "embeds": [],
+                "pinned": False,
+                "type": 0,
+            },
+        )
+
+    def qq_message_event(self, link: Any) -> Any:
+        from nonebot.adapters.qq import GuildMessageEvent
+
+        user_id = str(random.randint(1, 20))
+        attachments = []
+        if random.random() < self.args.image:
+            attachments.append(
+                {
+                    "content_type": "image/png",
+                    "filename": "image.png",
+                    "url": f"{self.base_url}/cdn/image.png",
+                }
+            )
+        if random.random() < self.args.file:
+            attachments.append(
+                {
+                    "content_type": "video/mp4",
+                    "filename": "video.mp4",
+                    "url": f"{self.base_url}/cdn/video.mp4",
+                }
+            )
+        return type_validate_python(
+            GuildMessageEvent,
+            {
+                "__type__": "MESSAGE_CREATE",
+                "id": str(next_id()),
+                "channel_id": link.qq_channel_id,
+                "guild_id": QQ_GUILD_ID,
+                "author": {"id": user_id, "username": f"qq{user_id}", "bot": False},
+                "content": random.choice(["你好", "hello world", "测试消息 " * 5]),
+                "timestamp": now_iso(),
+                "attachments": attachments,
+            },
+        )
+
+    def dc_delete_event(self, event: Any) -> Any:
+        from nonebot.adapters.discord import GuildMessageDeleteEvent
+
+        return type_validate_python(
+            GuildMessageDeleteEvent,
+            {
+                "id": str(event.id),
+                "channel_id": str(event.channel_id),
+                "guild_id": str(DC_GUILD_ID),
+            },
+        )
+
+    def qq_delete_event(self, event: Any) -> Any:
+        from nonebot.adapters.qq import MessageDeleteEvent
+
+        return type_validate_python(
+            MessageDeleteEvent,
+            {
+                "__type__": "MESSAGE_DELETE",
+                "message": {
+                    "id": event.id,
+                    "channel_id": event.channel_id,
+                    "guild_id": QQ_GUILD_ID,
+                    "author": {"id": event.author.id},
+                },
+                "op_user": {"id": event.author.id},
+            },
+        )
+
+    async def dispatch(self, direction: str, bot: Any, event: Any, handler: Callable):
+        """按 matcher 的规则检查事件，再交给插件的 handler"""
+        from nonebot_plugin_dcqg_relay import cluster, utils
+
+        if not (
+            utils.prefilter(event)
+            and await utils.check_messages(bot, event)
+            and cluster.owns_link(event)
+        ):
+            self.skipped[direction] += 1
+            return
+        start = time.perf_counter()
+        try:
+            await handler(bot, event, await utils.get_link(bot, event))
+        except Exception as e:
+            self.errors[direction] += 1
+            nonebot.logger.opt(exception=e).debug(f"{direction} error")
+        else:
+            self.latencies[direction].append(time.perf_counter() - start)
+            if direction in ("qq_to_dc", "dc_to_qq"):
+                self.relayed[direction[:2]].append((bot, event))
+
+    def next_event(self, dc_bot: Any, qq_bot: Any, links: list) -> tuple:
+        if random.random() < self.args.delete:
+            side = random.choice(["qq", "dc"])
+            if self.relayed[side]:
+                relayed = self.relayed[side]
+                bot, event = relayed.pop(random.randrange(len(relayed)))
+                if side == "qq":
+                    return ("delete_qq", bot, self.qq_delete_event(event))
+                return ("delete_dc", bot, self.dc_delete_event(event))
+        link = random.choice(links)
+        if random.random() < 0.5:
+            return ("qq_to_dc", qq_bot, self.qq_message_event(link))
+        return ("dc_to_qq", dc_bot, self.dc_message_event(link))
+
+    async def run(self, dc_bot: Any, qq_bot: Any, links: list) -> float:
+        import nonebot_plugin_dcqg_relay as relay
+
+        total = int(self.args.rate * self.args.duration)
+        tasks = []
+        start = time.perf_counter()
+        for i in range(total):
+            if (delay := start + i / self.args.rate - time.perf_counter()) > 0:
+                await asyncio.sleep(delay)
+            direction, bot, event = self.next_event(dc_bot, qq_bot, links)
+            handler = (
+                relay.delete_message
+                if direction.startswith("delete")
+                else relay.create_message
+            )
+            tasks.append(
+                asyncio.create_task(self.dispatch(direction, bot, event, handler))
+            )
+        await asyncio.gather(*tasks)
+        await self.wait_queues()
+        return time.perf_counter() - start
+
+    async def wait_queues(self):
+        """开启发件箱或消息合并时，等待队列中的消息发送完"""
+        from nonebot_plugin_dcqg_relay import stats
+
+        for _ in range(600):
+            status = await stats.collect_status()
+            if not any(link["queue_depth"] for link in status["links"]):
+                return
+            await asyncio.sleep(0.1)
+        nonebot.logger.warning("queues not drained in 60s")
+
+    def report(self, elapsed: float, server: FakeServer):
+        from nonebot_plugin_dcqg_relay import stats
+
+        print(f"\n{elapsed:.1f}s, target rate {self.args.rate}/s")
+        print(
+            f"{'direction':<10}{'ok':>7}{'error':>7}{'skip':>6}"
+            f"{'rate/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'err %':>7}"
+        )
+        for direction in ("qq_to_dc", "dc_to_qq", "delete_qq", "delete_dc"):
+            latencies = self.latencies[direction]
+            ok, errors = len(latencies), self.errors[direction]
+            print(
+                f"{direction:<10}{ok:>7}{errors:>7}{self.skipped[direction]:>6}"
+                f"{ok / elapsed:>9.1f}"
+                f"{percentile(latencies, 0.5) * 1000:>9.1f}"
+                f"{percentile(latencies, 0.99) * 1000:>9.1f}"
+                f"{errors / max(ok + errors, 1) * 100:>7.1f}"
+            )
+        link_stats = stats.link_stats.values()
+        print(
+            "send functions: "
+            f"{sum(s.successes for s in link_stats)} ok, "
+            f"{sum(s.failures for s in link_stats)} failed, "
+            f"{sum(s.retries for s in link_stats)} retries, "
+            f"{sum(s.dropped for s in link_stats)} dropped, "
+            f"{sum(s.deadline_misses for s in link_stats)} deadline misses"
+        )
+        for direction, transfer in stats.transfer_stats.items():
+            mib = transfer.bytes / 1024 / 1024
+            print(
+                f"streamed {direction}: {transfer.files} files, {mib:.1f} MiB, "
+                f"{mib / max(transfer.seconds, 1e-9):.1f} MiB/s"
+            )
+        print("fake server requests:")
+        for name, count in sorted(server.requests.items()):
+            print(f"  {count:>7}  {name}")
+
+
+async def prepare(base_url: str, links: list) -> tuple[Any, Any]:
+    """创建 bot 并触发连接事件，等待 webhook 准备完成"""
+    from nonebot.adapters.discord import Adapter as dc_Adapter, Bot as dc_Bot
+    from nonebot.adapters.discord.config import BotInfo as dc_BotInfo
+    from nonebot.adapters.qq import Adapter as qq_Adapter, Bot as qq_Bot
+    from nonebot.adapters.qq.config import BotInfo as qq_BotInfo
+    from yarl import URL
+
+    from nonebot_plugin_dcqg_relay import bots, utils
+
+    driver = nonebot.get_driver()
+    dc_adapter = next(a for a in driver._adapters.values() if isinstance(a, dc_Adapter))
+    qq_adapter = next(a for a in driver._adapters.values() if isinstance(a, qq_Adapter))
+    dc_adapter.base_url = URL(f"{base_url}/discord")
+    dc_bot = dc_Bot(dc_adapter, str(DC_APPLICATION_ID), dc_BotInfo(token="token"))
+    qq_bot = qq_Bot(qq_adapter, QQ_BOT_ID, qq_BotInfo(id=QQ_BOT_ID, secret="secret"))
+    dc_adapter.bot_connect(dc_bot)
+    qq_adapter.bot_connect(qq_bot)
+    for _ in range(200):
+        if (
+            len(utils.with_webhook_links) == len(links)
+            and bots.dc_bots
+            and bots.qq_bots
+        ):
+            break
+        await asyncio.sleep(0.05)
+    else:
+        raise RuntimeError("bots or webhooks not ready")
+    return dc_bot, qq_bot
+
+
+def main(args: argparse.Namespace):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}"
+
+    links = [
+        {
+            "qq_guild_id": QQ_GUILD_ID,
+            "dc_guild_id": DC_GUILD_ID,
+            "qq_channel_id": str(5000 + i),
+            "dc_channel_id": 6000 + i,
+        }
+        for i in range(args.links)
+    ]
+    data_dir = Path(tempfile.mkdtemp(prefix="dcqg-relay-bench-"))
+    config = {
+        "driver": "~none+~aiohttp",
+        "log_level": args.log_level,
+        "sqlalchemy_database_url": f"sqlite+aiosqlite:///{data_dir / 'bench.db'}",
+        "alembic_startup_check": False,
+        "localstore_use_cwd": False,
+        "localstore_data_dir": str(data_dir),
+        "qq_api_base": f"{base_url}/qq/",
+        "qq_auth_base": f"{base_url}/qq/auth",
+        "dcqg_relay_channel_links": links,
+    }
+    for item in args.set:
+        key, value = item.split("=", 1)
+        with suppress(json.JSONDecodeError):
+            value = json.loads(value)
+        config[key] = value
+    nonebot.init(**config)
+    from nonebot.adapters.discord import Adapter as dc_Adapter
+    from nonebot.adapters.qq import Adapter as qq_Adapter
+
+    driver = nonebot.get_driver()
+    driver.register_adapter(dc_Adapter)
+    driver.register_adapter(qq_Adapter)
+    nonebot.load_plugin("nonebot_plugin_dcqg_relay")
+
+    server = FakeServer(
+        args.latency_ms / 1000, args.rate_limit, args.audit, args.file_kb * 1024
+    )
+    tasks: set[asyncio.Task] = set()
+
+    async def bench():
+        runner = web.AppRunner(server.app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        try:
+            dc_bot, qq_bot = await prepare(base_url, links)
+            from nonebot_plugin_dcqg_relay import utils
+
+            load = LoadRunner(args, base_url)
+            elapsed = await load.run(dc_bot, qq_bot, utils.with_webhook_links)
+            load.report(elapsed, server)
+        except Exception:
+            nonebot.logger.exception("bench failed")
+        finally:
+            await runner.cleanup()
+            driver.exit()
+
+    async def start_bench():
+        task = asyncio.create_task(bench())
+        tasks.add(task)
+
+    # 插件与数据库的启动函数都执行完后再开始
+    next(iter(driver._adapters.values())).on_ready(start_bench)
+    nonebot.run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rate", type=float, default=50, help="每秒事件数")
+    parser.add_argument("--duration", type=float, default=10, help="持续时间（秒）")
+    parser.add_argument("--links", type=int, default=4, help="子频道绑定数")
+    parser.add_argument("--latency-ms", type=float, default=20, help="平均接口延迟")
+    parser.add_argument("--rate-limit", type=float, default=0, help="返回 429 的比例")
+    parser.add_argument("--audit", type=float, default=0, help="QQ 消息进入审核的比例")
+    parser.add_argument("--image", type=float, default=0, help="带图片的消息比例")
+    parser.add_argument("--file", type=float, default=0, help="带视频附件的消息比例")
+    parser.add_argument("--file-kb", type=int, default=4096, help="视频附件大小（KB）")
+    parser.add_argument("--delete", type=float, default=0.1, help="删除事件的比例")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument(
+        "--set", action="append", default=[], help="插件配置，如 key=value"
+    )
+    main(parser.parse_args())
@@ -1,8 +1,10 @@
-import re
+import time
 from typing import Union, Optional
 
-from nonebot import get_driver, logger, on, on_regex, require
-from nonebot.params import Depends
+from nonebot import get_driver, logger, on, on_command, on_type, require
+from nonebot.adapters import Message
+from nonebot.params import CommandArg, Depends
+from nonebot.permission import SUPERUSER
 from nonebot.adapters.discord import (
     Bot as dc_Bot,
     MessageCreateEvent as dc_MessageCreateEvent,
@@ -11,16 +13,36 @@ from nonebot.adapters.discord import (
 from nonebot.adapters.qq import (
     Bot as qq_Bot,
     GuildMessageEvent as qq_GuildMessageEvent,
+    MessageAuditPassEvent as qq_MessageAuditPassEvent,
+    MessageAuditRejectEvent as qq_MessageAuditRejectEvent,
     MessageDeleteEvent as qq_MessageDeleteEvent,
 )
 from nonebot.plugin import PluginMetadata
+from nonebot.rule import Rule
 
+require("nonebot_plugin_localstore")
 require("nonebot_plugin_orm")
 
+from .audit import resolve_audit, start_audit_tracker, stop_audit_tracker
+from .bots import register_bot, unregister_bot
+from .cluster import link_key, owns_link, start_lease_keeper, stop_lease_keeper
+from .coalesce import flush_all_bursts
 from .config import Config, LinkWithWebhook, plugin_config
 from .dc_to_qq import create_dc_to_qq, delete_dc_to_qq
-from .qq_to_dc import create_qq_to_dc, delete_qq_to_dc
-from .utils import check_messages, get_link, get_webhooks
+from .deadline import DeadlineExceeded, deadline_from, use_deadline
+from .outbox import start_outbox, stop_outbox
+from .profiler import (
+    PROFILE_DEFAULT_RATE,
+    profile_sample,
+    start_profile,
+    stop_profile,
+)
+from .qq_to_dc import create_qq_to_dc, delete_qq_to_dc, get_qq_bot_me
+from .reload import reload_links, start_links_watcher, stop_links_watcher
+from .snapshot import load_caches, save_caches
+from .stats import record_deadline_miss, setup_status_route
+from .trace import fail_trace, start_trace, start_trace_writer, stop_trace_writer
+from .utils import check_messages, get_link, get_webhooks, prefilter
 
 __plugin_meta__ = PluginMetadata(
     name="QQ频道-Discord 互通",
@@ -36,14 +58,36 @@ __plugin_meta__ = PluginMetadata(
 driver = get_driver()
 
 discord_proxy = plugin_config.discord_proxy
-unmatch_beginning = plugin_config.dcqg_relay_unmatch_beginning
 
 just_delete = []
 
-unmatcher = on_regex(
-    rf"\A *?[{re.escape(''.join(unmatch_beginning))}].*", priority=1, block=True
+matcher = on(rule=Rule(prefilter, check_messages, owns_link), priority=2, block=False)
+audit_matcher = on_type(
+    (qq_MessageAuditPassEvent, qq_MessageAuditRejectEvent), priority=1, block=False
+)
+reload_matcher = on_command("dcqg_reload", permission=SUPERUSER, priority=1, block=True)
+profile_matcher = on_command(
+    "dcqg_profile", permission=SUPERUSER, priority=1, block=True
 )
-matcher = on(rule=check_messages, priority=2, block=False)
+
+
+setup_status_route()
+
+# 关闭时按注册的相反顺序执行，trace 写入最先注册，在其他任务结束后最后写入
+driver.on_startup(start_trace_writer)
+driver.on_shutdown(stop_trace_writer)
+driver.on_startup(start_links_watcher)
+driver.on_shutdown(stop_links_watcher)
+driver.on_startup(start_audit_tracker)
+driver.on_shutdown(stop_audit_tracker)
+driver.on_startup(start_lease_keeper)
+driver.on_shutdown(stop_lease_keeper)
+driver.on_startup(start_outbox)
+driver.on_shutdown(flush_all_bursts)
+driver.on_shutdown(stop_outbox)
+driver.on_shutdown(stop_profile)
+driver.on_startup(load_caches)
+driver.on_shutdown(save_caches)
 
 
 @driver.on_bot_connect
@@ -58,20 +102,52 @@ async def prepare_webhooks(bot: dc_Bot):
 
 
 @driver.on_bot_connect
-async def get_dc_bot(bot: dc_Bot):
-    global dc_bot
-    dc_bot = bot
+async def add_bot(bot: Union[dc_Bot, qq_Bot]):
+    await register_bot(bot)
+    if isinstance(bot, qq_Bot):
+        await get_qq_bot_me(bot)
 
 
-@driver.on_bot_connect
-async def get_qq_bot(bot: qq_Bot):
-    global qq_bot
-    qq_bot = bot
+@driver.on_bot_disconnect
+async def remove_bot(bot: Union[dc_Bot, qq_Bot]):
+    await unregister_bot(bot)
 
 
-@unmatcher.handle()
-async def unmatcher_pass():
-    pass
+@audit_matcher.handle()
+async def audit_result(
+    event: Union[qq_MessageAuditPassEvent, qq_MessageAuditRejectEvent],
+):
+    resolve_audit(event)
+
+
+@reload_matcher.handle()
+async def reload_links_command():
+    try:
+        added, removed, failed = await reload_links()
+    except Exception as e:
+        await reload_matcher.finish(f"重新加载失败：{e}")
+    message = f"已重新加载：新增 {len(added)} 个，移除 {len(removed)} 个"
+    if failed:
+        message += f"，{len(failed)} 个频道获取 webhook 失败：{failed}"
+    await reload_matcher.finish(message)
+
+
+@profile_matcher.handle()
+async def profile_command(args: Message = CommandArg()):
+    command = args.extract_plain_text().split()
+    if command == ["stop"]:
+        await stop_profile()
+        await profile_matcher.finish("已停止性能采样")
+    if not command or command[0] != "start" or len(command) > 2:
+        await profile_matcher.finish("用法：/dcqg_profile start [比例] | stop")
+    try:
+        rate = float(command[1]) if len(command) == 2 else PROFILE_DEFAULT_RATE
+    except ValueError:
+        await profile_matcher.finish(f"无效的采样比例：{command[1]}")
+    if not 0 < rate <= 1:
+        await profile_matcher.finish(f"采样比例需要在 0~1 之间：{rate}")
+    start_profile(rate)
+    await profile_matcher.finish(f"已开始性能采样，比例：{rate}")
 
 
 @matcher.handle()
@@ -81,13 +157,27 @@ async def create_message(
     link: Optional[LinkWithWebhook] = Depends(get_link),
 ):
     logger.debug("into create_message()")
+    received_at = time.time()
     if link:
-        if isinstance(bot, qq_Bot) and isinstance(event, qq_GuildMessageEvent):
-            await create_qq_to_dc(bot, event, dc_bot, link)
-        elif isinstance(bot, dc_Bot) and isinstance(event, dc_MessageCreateEvent):
-            await create_dc_to_qq(bot, event, qq_bot, link)
-        else:
-            logger.error("bot type and event type not match")
+        direction = "qq_to_dc" if isinstance(bot, qq_Bot) else "dc_to_qq"
+        with (
+            profile_sample(),
+            use_deadline(deadline_from(received_at)),
+            start_trace(direction, link_key(link), event.id),
+        ):
+            try:
+                if isinstance(bot, qq_Bot) and isinstance(event, qq_GuildMessageEvent):
+                    await create_qq_to_dc(bot, event, link)
+                elif isinstance(bot, dc_Bot) and isinstance(
+                    event, dc_MessageCreateEvent
+                ):
+                    await create_dc_to_qq(bot, event, link)
+                else:
+                    logger.error("bot type and event type not match")
+            except DeadlineExceeded as e:
+                logger.warning(f"create_message(): drop stale message: {e}")
+                record_deadline_miss(link)
+                fail_trace(e)
 
 
 @matcher.handle()
@@ -97,10 +187,27 @@ async def delete_message(
     link: Optional[LinkWithWebhook] = Depends(get_link),
 ):
     logger.debug("into delete_message()")
+    received_at = time.time()
     if link:
-        if isinstance(bot, qq_Bot) and isinstance(event, qq_MessageDeleteEvent):
-            await delete_qq_to_dc(event, dc_bot, link, just_delete)
-        elif isinstance(bot, dc_Bot) and isinstance(event, dc_MessageDeleteEvent):
-            await delete_dc_to_qq(event, qq_bot, link, just_delete)
-        else:
-            logger.error("bot type and event type not match")
+        direction = "qq_to_dc" if isinstance(bot, qq_Bot) else "dc_to_qq"
+        source_id = (
+            event.message.id if isinstance(event, qq_MessageDeleteEvent) else event.id
+        )
+        with (
+            profile_sample(),
+            use_deadline(deadline_from(received_at)),
+            start_trace(f"delete_{direction}", link_key(link), source_id),
+        ):
+            try:
+                if isinstance(bot, qq_Bot) and isinstance(event, qq_MessageDeleteEvent):
+                    await delete_qq_to_dc(event, link, just_delete)
+                elif isinstance(bot, dc_Bot) and isinstance(
+                    event, dc_MessageDeleteEvent
+                ):
+                    await delete_dc_to_qq(event, link, just_delete)
+                else:
+                    logger.error("bot type and event type not match")
+            except DeadlineExceeded as e:
+                logger.warning(f"delete_message(): drop stale delete: {e}")
+                record_deadline_miss(link)
+                fail_trace(e)
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from typing import Optional, Union
+
+from nonebot import logger
+from nonebot.adapters.qq import (
+    MessageAuditPassEvent as qq_MessageAuditPassEvent,
+    MessageAuditRejectEvent as qq_MessageAuditRejectEvent,
+)
+from nonebot_plugin_orm import get_session
+
+from .model import MsgID
+
+AUDIT_MAX_AGE = 3600
+"""等待审核结果的最长时间（秒）"""
+AUDIT_MIN_INTERVAL = 1
+AUDIT_MAX_INTERVAL = 60
+
+pending_audits: dict[str, tuple[list[int], float]] = {}
+"""等待审核结果的消息，audit_id: (discord 消息 id 列表, 加入时间)"""
+passed_audits: list[tuple[int, str]] = []
+"""已通过审核、等待写入数据库的消息，(discord 消息 id, QQ 消息 id)"""
+tracker_task: Optional[asyncio.Task] = None
+tracker_wakeup: Optional[asyncio.Event] = None
+
+
+def add_audit(audit_id: str, dc_message_ids: list[int]):
+    """记录一条正在审核的消息，审核通过后写入消息 ID 对应关系"""
+    logger.debug(f"message in audit: [audit_id:{audit_id}, dcid:{dc_message_ids}]")
+    pending_audits[audit_id] = (dc_message_ids, time.time())
+
+
+def resolve_audit(event: Union[qq_MessageAuditPassEvent, qq_MessageAuditRejectEvent]):
+    """处理审核结果事件"""
+    if (pending := pending_audits.pop(event.audit_id, None)) is None:
+        return
+    dc_message_ids, _ = pending
+    if isinstance(event, qq_MessageAuditPassEvent) and event.message_id:
+        passed_audits.extend((dcid, event.message_id) for dcid in dc_message_ids)
+        if tracker_wakeup:
+            tracker_wakeup.set()
+    else:
+        logger.warning(
+            "message audit fail: "
+            + f"[audit_id:{event.audit_id}, dc_message_id: {dc_message_ids}]"
+        )
+
+
+async def flush_audits():
+    """将已通过审核的消息批量写入数据库，并清理过期的审核"""
+    now = time.time()
+    for audit_id, (dc_message_ids, added_at) in list(pending_audits.items()):
+        if now - added_at > AUDIT_MAX_AGE:
+            del pending_audits[audit_id]
+            logger.warning(
+                "message audit timeout: "
+                + f"[audit_id:{audit_id}, dc_message_id: {dc_message_ids}]"
+            )
+    if not passed_audits:
+        return
+    passed = passed_audits.copy()
+    async with get_session() as session:
+        session.add_all(MsgID(dcid=dcid, qqid=qqid) for dcid, qqid in passed)
+        await session.commit()
+    del passed_audits[: len(passed)]
+    logger.debug(f"audit tracker: {len(passed)} passed messages recorded")
+
+
+async def track_audits(wakeup: asyncio.Event):
+    """后台任务：有审核通过时立即写入，空闲时逐渐拉长清理间隔"""
+    interval = AUDIT_MIN_INTERVAL
+    while True:
+        try:
+            await asyncio.wait_for(wakeup.wait(), interval)
+            interval = AUDIT_MIN_INTERVAL
+        except asyncio.TimeoutError:
+            interval = min(interval * 2, AUDIT_MAX_INTERVAL)
+        wakeup.clear()
+        try:
+            await flush_audits()
+        except Exception as e:
+            logger.error(f"audit tracker error: {e}")
+
+
+async def start_audit_tracker():
+    global tracker_task, tracker_wakeup
+    if tracker_task is None:
+        tracker_wakeup = asyncio.Event()
+        tracker_task = asyncio.create_task(track_audits(tracker_wakeup))
+
+
+async def stop_audit_tracker():
+    global tracker_task
+    if tracker_task is not None:
+        tracker_task.cancel()
+        tracker_task = None
+    await flush_audits()
@@ -0,0 +1,148 @@
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+import time
+from typing import Optional, TypeVar, Union
+
+from nonebot import logger
+from nonebot.adapters.discord import Bot as dc_Bot
+from nonebot.adapters.qq import Bot as qq_Bot
+from nonebot.exception import ActionFailed, NetworkError
+
+T_Bot = TypeVar("T_Bot", dc_Bot, qq_Bot)
+
+dc_bots: dict[str, dc_Bot] = {}
+"""已连接的 Discord bot，self_id: bot"""
+qq_bots: dict[str, qq_Bot] = {}
+"""已连接的 QQ bot，self_id: bot"""
+bot_guilds: dict[str, set[str]] = {}
+"""bot 所在的服务器/频道 id，获取失败时不记录，视为可以到达所有服务器"""
+bot_load: dict[str, int] = {}
+"""bot 正在进行的请求数"""
+bot_failed_at: dict[str, float] = {}
+"""bot 最近一次请求失败的时间（time.monotonic()）"""
+
+GUILDS_PAGE_LIMIT = 100
+BOT_FAILURE_COOLDOWN = 60
+"""bot 请求失败后优先使用其他 bot 的时间（秒）"""
+
+
+class BotNotFound(LookupError):
+    """没有可以到达目标服务器/频道的 bot"""
+
+
+class BotUnavailable(BotNotFound):
+    """选中的 bot 请求失败（网络错误、服务端错误），重试时会优先使用其他 bot"""
+
+
+async def get_dc_bot_guilds(bot: dc_Bot) -> set[str]:
+    guilds: set[str] = set()
+    after = None
+    while page := await bot.get_current_user_guilds(
+        after=after, limit=GUILDS_PAGE_LIMIT
+    ):
+        guilds.update(str(guild.id) for guild in page)
+        if len(page) < GUILDS_PAGE_LIMIT:
+            break
+        after = page[-1].id
+    return guilds
+
+
+async def get_qq_bot_guilds(bot: qq_Bot) -> set[str]:
+    guilds: set[str] = set()
+    after = None
+    while page := await bot.guilds(after=after, limit=GUILDS_PAGE_LIMIT):
+        guilds.update(guild.id for guild in page if guild.id)
+        if len(page) < GUILDS_PAGE_LIMIT:
+            break
+        after = page[-1].id
+    return guilds
+
+
+async def register_bot(bot: Union[dc_Bot, qq_Bot]):
+    """记录新连接的 bot 及其所在的服务器/频道"""
+    try:
+        bot_guilds[bot.self_id] = await (
+            get_dc_bot_guilds(bot)
+            if isinstance(bot, dc_Bot)
+            else get_qq_bot_guilds(bot)
+        )
+    except Exception as e:
+        logger.warning(f"get guilds of bot {bot.self_id} error: {e}")
+        bot_guilds.pop(bot.self_id, None)
+    bot_load.setdefault(bot.self_id, 0)
+    bot_failed_at.pop(bot.self_id, None)
+    if isinstance(bot, dc_Bot):
+        dc_bots[bot.self_id] = bot
+    else:
+        qq_bots[bot.self_id] = bot
+    logger.debug(f"bot {bot.self_id} registered")
+
+
+async def unregister_bot(bot: Union[dc_Bot, qq_Bot]):
+    """移除断开连接的 bot，之后的请求会交给其他 bot"""
+    (dc_bots if isinstance(bot, dc_Bot) else qq_bots).pop(bot.self_id, None)
+    bot_guilds.pop(bot.self_id, None)
+    logger.debug(f"bot {bot.self_id} unregistered")
+
+
+def is_bot_failure(e: Exception) -> bool:
+    """是否为 bot 本身无法使用导致的错误，而不是这次请求的问题"""
+    if isinstance(e, NetworkError):
+        return True
+    status_code = getattr(e, "status_code", None)
+    return (
+        isinstance(e, ActionFailed)
+        and isinstance(status_code, int)
+        and (status_code == 401 or status_code >= 500)
+    )
+
+
+def is_cooling_down(self_id: str) -> bool:
+    return (
+        failed_at := bot_failed_at.get(self_id)
+    ) is not None and time.monotonic() - failed_at < BOT_FAILURE_COOLDOWN
+
+
+def pick_bot(bots: dict[str, T_Bot], guild_id: Union[int, str]) -> Optional[T_Bot]:
+    """选择能到达 guild_id 的 bot，优先最近没有失败、正在进行的请求最少的 bot"""
+    guild_id = str(guild_id)
+    candidates = [
+        bot
+        for self_id, bot in bots.items()
+        if self_id not in bot_guilds or guild_id in bot_guilds[self_id]
+    ]
+    return min(
+        candidates,
+        key=lambda bot: (is_cooling_down(bot.self_id), bot_load.get(bot.self_id, 0)),
+        default=None,
+    )
+
+
+@asynccontextmanager
+async def use_bot(
+    bots: dict[str, T_Bot], guild_id: Union[int, str]
+) -> AsyncIterator[T_Bot]:
+    """
+    选择一个 bot 并在使用期间计入其负载；
+    bot 请求失败时记录下来并抛出 BotUnavailable，由调用方按 BotNotFound 重试
+    """
+    if (bot := pick_bot(bots, guild_id)) is None:
+        raise BotNotFound(f"no bot available for guild {guild_id}")
+    bot_load[bot.self_id] = bot_load.get(bot.self_id, 0) + 1
+    try:
+        yield bot
+    except Exception as e:
+        if not is_bot_failure(e):
+            raise
+        bot_failed_at[bot.self_id] = time.monotonic()
+        raise BotUnavailable(f"bot {bot.self_id} failed: {e}") from e
+    finally:
+        bot_load[bot.self_id] -= 1
+
+
+def use_dc_bot(guild_id: int):
+    return use_bot(dc_bots, guild_id)
+
+
+def use_qq_bot(guild_id: str):
+    return use_bot(qq_bots, guild_id)
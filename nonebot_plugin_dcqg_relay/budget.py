@@ -0,0 +1,181 @@
+import asyncio
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Optional, TypeVar
+from typing_extensions import ParamSpec
+
+from .config import plugin_config
+
+T = TypeVar("T")
+P = ParamSpec("P")
+
+MEDIA_UNKNOWN_SIZE = 1024 * 1024
+"""下载没有 Content-Length 的文件时预先占用的字节数"""
+
+
+class ByteBudget:
+    """
+    按字节数限制同时占用的内存：预算用完后，新的转发排队等待；
+    已经占用预算的转发可以继续占用，避免互相等待
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        """0 为不限制"""
+        self.used = 0
+        self.waiters: deque[tuple[MediaLease, int, asyncio.Future[None]]] = deque()
+
+    def fits(self, size: int) -> bool:
+        return not self.limit or self.used == 0 or self.used + size <= self.limit
+
+    async def admit(self, lease: "MediaLease", size: int):
+        """按到达顺序等待足够的预算"""
+        if not self.waiters and self.fits(size):
+            self.used += size
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((lease, size, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(size)
+            else:
+                self.wake()
+            raise
+
+    def overdraw(self, size: int):
+        self.used += size
+
+    def release(self, size: int):
+        self.used -= size
+        self.wake()
+
+    def wake(self):
+        while self.waiters:
+            lease, size, future = self.waiters[0]
+            if future.done():
+                self.waiters.popleft()
+                continue
+            if not self.fits(size):
+                return
+            self.waiters.popleft()
+            self.used += size
+            future.set_result(None)
+            self.wake_lease(lease)
+
+    def wake_lease(self, lease: "MediaLease"):
+        """同一转发中其他正在排队的请求不再等待"""
+        for waiter in [waiter for waiter in self.waiters if waiter[0] is lease]:
+            self.waiters.remove(waiter)
+            _, size, future = waiter
+            if not future.done():
+                self.used += size
+                future.set_result(None)
+
+
+class MediaLease:
+    """一次转发占用的媒体预算，结束时全部归还"""
+
+    def __init__(self, budget: ByteBudget):
+        self.budget = budget
+        self.held = 0
+
+    async def acquire(self, size: int):
+        if self.held:
+            self.budget.overdraw(size)
+        else:
+            await self.budget.admit(self, size)
+        self.held += size
+
+    def release(self, size: int):
+        size = min(size, self.held)
+        self.held -= size
+        self.budget.release(size)
+
+    def close(self):
+        self.release(self.held)
+
+
+media_budget = ByteBudget(plugin_config.dcqg_relay_media_budget * 1024 * 1024)
+"""下载与转换中的图片共用的预算"""
+current_lease: ContextVar[Optional[MediaLease]] = ContextVar(
+    "dcqg_relay_media_lease", default=None
+)
+
+
+@asynccontextmanager
+async def use_media_budget() -> AsyncIterator[MediaLease]:
+    """此范围内（包括其中创建的任务）下载与转换的数据计入同一份预算，退出时归还"""
+    lease = MediaLease(media_budget)
+    token = current_lease.set(lease)
+    try:
+        yield lease
+    finally:
+        current_lease.reset(token)
+        lease.close()
+
+
+def with_media_budget(func: Callable[P, Awaitable[T]]) -> Callable[P, Awaitable[T]]:
+    """每次调用使用一份新的媒体预算"""
+
+    @wraps(func)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+        async with use_media_budget():
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+async def acquire_media(size: int):
+    if (lease := current_lease.get()) is not None:
+        await lease.acquire(size)
+
+
+def release_media(size: int):
+    if (lease := current_lease.get()) is not None:
+        lease.release(size)
+
+
+async def read_media(
+    read: Callable[[], Awaitable[bytes]], size: Optional[int]
+) -> bytes:
+    """按预计大小先占用预算再读取，读取后按实际大小修正，预算不足时排队"""
+    reserved = size or MEDIA_UNKNOWN_SIZE
+    await acquire_media(reserved)
+    try:
+        data = await read()
+    except BaseException:
+        release_media(reserved)
+        raise
+    if len(data) > reserved:
+        await acquire_media(len(data) - reserved)
+    else:
+        release_media(reserved - len(data))
+    return data
+
+
+async def convert_media(
+    func: Callable[[bytes], tuple[bytes, T]],
+    data: bytes,
+    estimate: Optional[Callable[[bytes], int]] = None,
+) -> tuple[bytes, T]:
+    """
+    在线程中转换数据，完成后改为占用输出的大小；
+    转换时额外占用 estimate 估计的内存（如图片解码后的大小），至少为输入的大小
+    """
+    reserved = len(data)
+    if estimate is not None:
+        reserved = max(reserved, await asyncio.to_thread(estimate, data))
+    await acquire_media(reserved)
+    try:
+        output, extra = await asyncio.to_thread(func, data)
+    finally:
+        release_media(reserved)
+    if output is not data:
+        await acquire_media(len(output))
+        release_media(len(data))
+    return output, extra
@@ -0,0 +1,79 @@
+from collections.abc import Hashable
+import time
+from typing import Generic, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """带过期时间的缓存，超过容量时先清理过期项，再淘汰最早写入的项"""
+
+    def __init__(self, ttl: float, maxsize: int = 4096, name: Optional[str] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.data: dict[K, tuple[float, V]] = {}
+        self.hits = 0
+        self.misses = 0
+        if name is not None:
+            caches[name] = self
+
+    def get(self, key: K) -> Optional[V]:
+        if (item := self.data.get(key)) is None:
+            self.misses += 1
+            return None
+        expire_at, value = item
+        if expire_at < time.time():
+            del self.data[key]
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        if key not in self.data and len(self.data) >= self.maxsize:
+            self.evict()
+        self.data[key] = (time.time() + self.ttl, value)
+
+    def evict(self) -> None:
+        now = time.time()
+        for key in [
+            key for key, (expire_at, _) in self.data.items() if expire_at < now
+        ]:
+            del self.data[key]
+        while len(self.data) >= self.maxsize:
+            del self.data[next(iter(self.data))]
+
+    def snapshot(self) -> list[tuple[K, float, V]]:
+        """未过期的项，(键, 过期时间, 值)"""
+        now = time.time()
+        return [
+            (key, expire_at, value)
+            for key, (expire_at, value) in self.data.items()
+            if expire_at >= now
+        ]
+
+    def restore(self, items: list[tuple[K, float, V]]) -> int:
+        """恢复快照中未过期的项，保留原来的过期时间，返回恢复的项数"""
+        now = time.time()
+        restored = 0
+        for key, expire_at, value in items:
+            if expire_at < now or key in self.data:
+                continue
+            if len(self.data) >= self.maxsize:
+                break
+            self.data[key] = (expire_at, value)
+            restored += 1
+        return restored
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+
+caches: dict[str, TTLCache] = {}
+"""有名字的缓存，用于状态统计与快照"""
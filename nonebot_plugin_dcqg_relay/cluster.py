@@ -0,0 +1,180 @@
+import asyncio
+import bisect
+import hashlib
+import time
+from typing import Optional, Union
+
+from nonebot import logger
+from nonebot.adapters.discord import (
+    MessageCreateEvent as dc_MessageCreateEvent,
+    MessageDeleteEvent as dc_MessageDeleteEvent,
+)
+from nonebot.adapters.qq import (
+    GuildMessageEvent as qq_GuildMessageEvent,
+    MessageDeleteEvent as qq_MessageDeleteEvent,
+)
+from nonebot_plugin_orm import get_session
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from . import utils
+from .config import Link, plugin_config
+from .model import LinkLease, Worker
+
+worker_id = plugin_config.dcqg_relay_worker_id
+lease_ttl = plugin_config.dcqg_relay_lease_ttl
+
+RING_REPLICAS = 64
+"""一致性哈希环上每个 worker 的虚拟节点数"""
+
+owned_links: set[str] = set()
+"""本 worker 持有租约的 link"""
+lease_task: Optional[asyncio.Task] = None
+leases_expire_at = 0.0
+
+
+def link_key(link: Link) -> str:
+    return f"{link.qq_channel_id}:{link.dc_channel_id}"
+
+
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big")
+
+
+def build_ring(workers: list[str]) -> list[tuple[int, str]]:
+    return sorted(
+        (ring_hash(f"{worker}#{i}"), worker)
+        for worker in workers
+        for i in range(RING_REPLICAS)
+    )
+
+
+def ring_owner(ring: list[tuple[int, str]], key: str) -> str:
+    index = bisect.bisect(ring, (ring_hash(key), ""))
+    return ring[index % len(ring)][1]
+
+
+async def sync_leases():
+    """
+    发送心跳，按一致性哈希领取 link 的租约：
+    环上的新 owner 直接接管其他 worker 的租约，原 owner 在发现租约被接管前继续转发，
+    避免 worker 加入或离开时有一段时间没有 worker 转发
+    """
+    global owned_links, leases_expire_at
+    now = time.time()
+    keys = {link_key(link) for link in utils.with_webhook_links}
+    async with get_session() as session:
+        await session.merge(Worker(worker_id=worker_id, heartbeat_at=now))
+        await session.execute(
+            delete(Worker).where(Worker.heartbeat_at < now - lease_ttl * 3)
+        )
+        # 本 worker 不再配置的 link，以及早已过期的租约
+        await session.execute(
+            delete(LinkLease).where(
+                or_(
+                    and_(
+                        LinkLease.worker_id == worker_id,
+                        LinkLease.link_key.not_in(keys),
+                    ),
+                    LinkLease.expires_at < now - lease_ttl * 3,
+                )
+            )
+        )
+        workers = list(
+            await session.scalars(
+                select(Worker.worker_id).where(Worker.heartbeat_at >= now - lease_ttl)
+            )
+        )
+        ring = build_ring(workers)
+        leases = {
+            lease.link_key: lease.worker_id
+            for lease in await session.scalars(
+                select(LinkLease).where(LinkLease.link_key.in_(keys))
+            )
+        }
+        owned: set[str] = set()
+        for key in keys:
+            holder = leases.get(key)
+            if holder is None:
+                if ring_owner(ring, key) != worker_id:
+                    continue
+                try:
+                    async with session.begin_nested():
+                        session.add(
+                            LinkLease(
+                                link_key=key,
+                                worker_id=worker_id,
+                                expires_at=now + lease_ttl,
+                            )
+                        )
+                except IntegrityError:
+                    # 其他 worker 同时领取了该 link，下一次同步时再按环接管
+                    continue
+                owned.add(key)
+                continue
+            if holder != worker_id and ring_owner(ring, key) != worker_id:
+                continue
+            # 续租自己的租约；或者作为环上的 owner，接管仍由原 worker 持有的租约
+            result = await session.execute(
+                update(LinkLease)
+                .where(LinkLease.link_key == key, LinkLease.worker_id == holder)
+                .values(worker_id=worker_id, expires_at=now + lease_ttl)
+            )
+            if result.rowcount:
+                owned.add(key)
+        await session.commit()
+    if owned != owned_links:
+        logger.info(f"worker {worker_id} owns {len(owned)}/{len(keys)} links")
+    owned_links = owned
+    leases_expire_at = now + lease_ttl
+
+
+async def keep_leases():
+    while True:
+        try:
+            await sync_leases()
+        except Exception as e:
+            logger.error(f"sync leases error: {e}")
+            if time.time() > leases_expire_at and owned_links:
+                logger.warning(f"worker {worker_id} leases expired, stop relaying")
+                owned_links.clear()
+        await asyncio.sleep(lease_ttl / 3)
+
+
+async def start_lease_keeper():
+    global lease_task
+    if worker_id and lease_task is None:
+        lease_task = asyncio.create_task(keep_leases())
+
+
+async def stop_lease_keeper():
+    """停止续租并释放本 worker 的租约，其他 worker 会在下一次同步时接管"""
+    global lease_task
+    if lease_task is None:
+        return
+    lease_task.cancel()
+    lease_task = None
+    async with get_session() as session:
+        await session.execute(delete(LinkLease).where(LinkLease.worker_id == worker_id))
+        await session.execute(delete(Worker).where(Worker.worker_id == worker_id))
+        await session.commit()
+
+
+def owns_link(
+    event: Union[
+        qq_GuildMessageEvent,
+        dc_MessageCreateEvent,
+        qq_MessageDeleteEvent,
+        dc_MessageDeleteEvent,
+    ],
+) -> bool:
+    """未开启多 worker 时总是处理；开启时只处理本 worker 持有租约的 link"""
+    if not worker_id:
+        return True
+    channel_id = (
+        event.message.channel_id
+        if isinstance(event, qq_MessageDeleteEvent)
+        else event.channel_id
+    )
+    link = utils.link_index.get(channel_id)
+    return link is not None and link_key(link) in owned_links
@@ -0,0 +1,122 @@
+import asyncio
+from collections.abc import Awaitable
+from functools import partial
+import time
+from typing import Callable, Optional, TypeVar
+
+from nonebot import logger
+
+from .config import plugin_config
+from .trace import fail_trace, start_trace
+
+coalesce_window = plugin_config.dcqg_relay_coalesce_window
+
+COALESCE_MAX_WINDOWS = 4
+"""从第一条消息起最多等待的窗口数，避免连续发言时一直不发送"""
+
+T_Payload = TypeVar("T_Payload")
+
+T_Key = tuple[str, str, str]
+"""(发送方向, link key, 作者 id)"""
+
+pending_bursts: dict[
+    T_Key, tuple[object, Callable[[object], Awaitable[None]], asyncio.Task, float]
+] = {}
+"""
+正在等待合并的消息，
+key: (已合并的消息, 发送函数, 定时发送任务, 第一条消息到达的时间)
+"""
+last_sends: dict[T_Key, asyncio.Future[None]] = {}
+"""同一 key 最后一次发送完成时完成的 future，用于按到达顺序发送"""
+
+
+async def run_in_order(key: T_Key, send: Callable[[], Awaitable[None]]):
+    """等待同一 key 之前的发送完成后再发送"""
+    previous = last_sends.get(key)
+    done = last_sends[key] = asyncio.get_running_loop().create_future()
+    try:
+        if previous is not None:
+            await asyncio.wait({previous})
+        await send()
+    finally:
+        done.set_result(None)
+        if last_sends.get(key) is done:
+            del last_sends[key]
+
+
+async def flush_later(
+    key: T_Key,
+    payload: T_Payload,
+    flush: Callable[[T_Payload], Awaitable[None]],
+    delay: float,
+):
+    await asyncio.sleep(delay)
+    if (pending := pending_bursts.get(key)) and pending[2] is asyncio.current_task():
+        del pending_bursts[key]
+    await run_in_order(key, partial(flush_burst, key, payload, flush))
+
+
+async def flush_burst(
+    key: T_Key, payload: T_Payload, flush: Callable[[T_Payload], Awaitable[None]]
+):
+    # 合并后的消息单独记录一个 trace，来源为合并的所有消息
+    with start_trace(key[0], key[1]):
+        try:
+            await flush(payload)
+        except Exception as e:
+            fail_trace(e)
+            logger.error(f"coalesce: flush error: {e}")
+
+
+async def coalesce(
+    key: T_Key,
+    payload: T_Payload,
+    merge: Callable[[T_Payload, T_Payload], Optional[T_Payload]],
+    flush: Callable[[T_Payload], Awaitable[None]],
+):
+    """
+    将同一 key 在窗口期内连续到达的消息合并，窗口期内没有新消息时再发送；
+    无法合并（如超出长度限制）时先发送已合并的部分；
+    从第一条消息起最多等待 COALESCE_MAX_WINDOWS 个窗口
+    """
+    started_at = time.monotonic()
+    while (pending := pending_bursts.pop(key, None)) is not None:
+        pending_payload, _, task, pending_started_at = pending
+        task.cancel()
+        if (merged := merge(pending_payload, payload)) is not None:
+            payload, started_at = merged, pending_started_at
+            break
+        await run_in_order(key, partial(flush_burst, key, pending_payload, flush))
+        # 发送期间可能有新的消息等待合并，继续检查
+        started_at = time.monotonic()
+    window = coalesce_window / 1000
+    delay = min(window, started_at + window * COALESCE_MAX_WINDOWS - time.monotonic())
+    pending_bursts[key] = (
+        payload,
+        flush,
+        asyncio.create_task(flush_later(key, payload, flush, max(0, delay))),
+        started_at,
+    )
+
+
+async def send_now(key: T_Key, send: Callable[[], Awaitable[None]]):
+    """不合并的消息：先发送同一 key 正在等待合并的消息，再按顺序发送"""
+    pending = pending_bursts.pop(key, None)
+    if pending is not None:
+        pending[2].cancel()
+
+    async def send_after_pending():
+        if pending is not None:
+            await flush_burst(key, pending[0], pending[1])
+        await send()
+
+    await run_in_order(key, send_after_pending)
+
+
+async def flush_all_bursts(link_keys: Optional[set[str]] = None):
+    """立即发送等待合并的消息，link_keys 为 None 时发送全部"""
+    keys = [key for key in pending_bursts if link_keys is None or key[1] in link_keys]
+    pending = [(key, pending_bursts.pop(key)) for key in keys]
+    for key, (payload, flush, task, _) in pending:
+        task.cancel()
+        await run_in_order(key, partial(flush_burst, key, payload, flush))
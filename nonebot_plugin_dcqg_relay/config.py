@@ -1,6 +1,7 @@
+from pathlib import Path
 from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from nonebot import get_plugin_config
 
 
@@ -9,6 +10,8 @@ class Link(BaseModel):
     dc_guild_id: int
     qq_channel_id: str
     dc_channel_id: int
+    unmatch_beginning: Optional[list[str]] = None
+    """该链接不转发的消息开头，为 None 时使用全局设置"""
 
 
 class LinkWithoutWebhook(Link):
@@ -26,7 +29,55 @@ class Config(BaseModel):
     """子频道绑定"""
     dcqg_relay_unmatch_beginning: list[str] = ["/"]
     """不转发的消息开头"""
+    dcqg_relay_author_blocklist: list[str] = []
+    """不转发的用户 id（QQ 或 Discord）"""
     discord_proxy: Optional[str] = None
+    dcqg_relay_image_max_size: int = 2048
+    """图片最大边长（像素），超过时缩小，为 0 时不缩小"""
+    dcqg_relay_image_quality: int = 85
+    """重新编码图片时的质量（JPEG/WEBP）"""
+    dcqg_relay_emoji_composite: bool = False
+    """将 Discord 消息中的多个表情拼成一张图片，与文字一起发送到QQ"""
+    dcqg_relay_image_passthrough: bool = False
+    """QQ 图片以 URL 放入 Discord embed，不下载再上传"""
+    dcqg_relay_member_cache_ttl: int = 600
+    """成员名与头像缓存的有效时间（秒）"""
+    dcqg_relay_guild_cache_ttl: int = 3600
+    """Discord 频道名与身份组名缓存的有效时间（秒）"""
+    dcqg_relay_delete_concurrency: int = 5
+    """撤回消息时同时发出的删除请求数"""
+    dcqg_relay_worker_id: Optional[str] = None
+    """多进程部署时本 worker 的 id，不为 None 时按租约划分 link"""
+    dcqg_relay_lease_ttl: int = 30
+    """link 租约与 worker 心跳的有效时间（秒）"""
+    dcqg_relay_outbox: bool = False
+    """先将消息写入数据库中的发件箱，再由后台按 link 顺序发送"""
+    dcqg_relay_outbox_workers: int = 4
+    """发件箱的发送任务数"""
+    dcqg_relay_outbox_max_attempts: int = 5
+    """发件箱中一条消息的最大发送次数"""
+    dcqg_relay_outbox_ttl: int = 86400
+    """发件箱中的消息从写入起保留的最长时间（秒），超过时放弃，0 为不限制"""
+    dcqg_relay_coalesce_window: int = 0
+    """合并同一作者连续纯文本消息的窗口（毫秒），0 为不合并"""
+    dcqg_relay_links_file: Optional[Path] = None
+    """从该 JSON 文件读取子频道绑定，文件修改后自动重新加载"""
+    dcqg_relay_status_path: Optional[str] = None
+    """状态接口的路径，None 为不开启"""
+    dcqg_relay_status_token: Optional[str] = None
+    """访问状态接口需要的 token，未设置时不开启状态接口"""
+    dcqg_relay_profile_rate: float = Field(0, ge=0, le=1)
+    """对转发处理进行性能采样的比例，0 为不采样"""
+    dcqg_relay_deadline: int = 0
+    """一条消息从收到起转发的最长时间（秒），超过时放弃，0 为不限制"""
+    dcqg_relay_media_budget: int = 128
+    """同时下载与转换的图片占用内存的上限（MiB），0 为不限制"""
+    dcqg_relay_cache_snapshot: bool = False
+    """关闭时将查询缓存保存到插件数据目录，启动时恢复"""
+    dcqg_relay_trace: bool = False
+    """将每条消息的转发过程（trace）写入插件数据目录的 JSONL 文件"""
+    dcqg_relay_trace_min_ms: int = 0
+    """只写入耗时不少于该值（毫秒）或出错的 trace"""
 
 
 plugin_config = get_plugin_config(Config)
@@ -1,66 +1,266 @@
 import asyncio
-import io
+from functools import partial
 import re
 from typing import Optional
 
-import filetype
 from nonebot import logger
 from nonebot.adapters.discord import (
     Bot as dc_Bot,
     MessageCreateEvent as dc_MessageCreateEvent,
     MessageDeleteEvent as dc_MessageDeleteEvent,
 )
-from nonebot.adapters.discord.api import UNSET
+from nonebot.adapters.discord.api import UNSET, Attachment
 from nonebot.adapters.qq import (
-    Bot as qq_Bot,
     Message as qq_SegmentMessage,
     MessageSegment as qq_MessageSegment,
 )
 from nonebot.adapters.qq.exception import AuditException
 from nonebot.adapters.qq.models import Message as qq_Message
+from nonebot.adapters.qq.utils import unescape
 from nonebot_plugin_orm import get_session
-from sqlalchemy import select
-from PIL import Image
+from pydantic import BaseModel
+from sqlalchemy import delete, select
+from yarl import URL
 
+from .audit import add_audit
+from .bots import BotNotFound, use_qq_bot
+from .cache import TTLCache
+from .budget import acquire_media, convert_media, release_media, with_media_budget
+from .cluster import link_key
+from .coalesce import coalesce, coalesce_window, send_now
 from .config import LinkWithWebhook, plugin_config
+from .deadline import (
+    DeadlineExceeded,
+    check_deadline,
+    sleep_before_retry,
+    with_deadline,
+)
+from .media import (
+    EMOJI_CDN_MAX_SIZE,
+    EMOJI_TILE_GAP,
+    EMOJI_TILE_SIZE,
+    QQ_IMAGE_FORMATS,
+    QQ_IMAGE_MAX_BYTES,
+    composite_images,
+    decoded_size,
+    optimize_image,
+)
 from .model import MsgID
-from .utils import get_dc_member_name, get_file_bytes
+from .outbox import add_to_outbox, outbox_enabled, outbox_handler
+from .qq_emoji_dict import unicode_emoji_ids
+from .stats import record_deadline_miss, record_retry, track_relay
+from .stream import format_size
+from .trace import add_destinations, add_sources, fail_trace, span
+from .utils import delete_relayed_messages, get_dc_member_name, get_file_bytes
 
 discord_proxy = plugin_config.discord_proxy
+emoji_composite = plugin_config.dcqg_relay_emoji_composite
+image_max_size = plugin_config.dcqg_relay_image_max_size
 
+QQ_MAX_CONTENT_LENGTH = 2000
+"""合并消息时 QQ 单条消息的最大字数"""
+EMOJI_CACHE_TTL = 7 * 24 * 3600
+"""Discord 表情图片不会改变，缓存较长时间"""
 
-async def get_qq_img(url: str, proxy: Optional[str]) -> io.BytesIO:
-    img_bytes = await get_file_bytes(url, proxy)
-    match = filetype.match(img_bytes)
-    kind = match.extension if match else "webp"
-    if kind == "webp":
-        with Image.open(io.BytesIO(img_bytes)) as img:
-            output = io.BytesIO()
-            img.save(output, format="PNG")
+dc_channel_names: TTLCache[tuple[int, int], str] = TTLCache(
+    plugin_config.dcqg_relay_guild_cache_ttl, name="dc_channel_names"
+)
+"""Discord 频道名缓存，键为 (guild_id, channel_id)"""
+dc_role_names: TTLCache[tuple[int, int], str] = TTLCache(
+    plugin_config.dcqg_relay_guild_cache_ttl, name="dc_role_names"
+)
+"""Discord 身份组名缓存，键为 (guild_id, role_id)"""
+dc_emoji_images: TTLCache[str, bytes] = TTLCache(
+    EMOJI_CACHE_TTL, maxsize=512, name="dc_emoji_images"
+)
+"""Discord 表情原图缓存，键为 CDN 地址"""
+
+UNICODE_EMOJI_PATTERN = re.compile(
+    r"(?<!\u200d)("
+    + "|".join(map(re.escape, sorted(unicode_emoji_ids, key=len, reverse=True)))
+    + r")(?![\ufe0f\U0001f3fb-\U0001f3ff]*[\u200d\u20e3])"
+    + r"[\ufe0f\U0001f3fb-\U0001f3ff]*"
+)
+"""
+有对应 QQ 表情的 Unicode 表情（可带变体选择符与肤色），
+不匹配 ZWJ 组合表情与键帽表情中的一部分
+"""
+
+
+class DCToQQPayload(BaseModel):
+    """整理后的 discord 转 QQ 消息"""
+
+    dc_message_ids: list[int]
+    """合并发送时包含多条 discord 消息"""
+    header: str
+    """发送者名称"""
+    text: str
+    """QQ 消息内容格式，包含 QQ 表情"""
+    mention_everyone: bool = False
+    emoji_list: list[str]
+    emoji_names: list[str] = []
+    """emoji_list 中表情的名字，拼接的图片获取失败时以文字代替"""
+    img_list: list[str]
+    reference_dc_id: Optional[int] = None
+    """被回复的 discord 消息 id"""
+    sent: int = 0
+    """已经发出的 QQ 消息数（每张图片一条），发件箱重试时从这里继续"""
+
+
+def build_qq_text(text: str) -> qq_SegmentMessage:
+    """将文本中有对应 QQ 表情的 Unicode 表情转换为 QQ 表情"""
+    message = qq_SegmentMessage()
+    text_begin = 0
+    for emoji in UNICODE_EMOJI_PATTERN.finditer(text):
+        if content := text[text_begin : emoji.start()]:
+            message += qq_MessageSegment.text(content)
+        message += qq_MessageSegment.emoji(unicode_emoji_ids[emoji.group(1)])
+        text_begin = emoji.end()
+    if content := text[text_begin:]:
+        message += qq_MessageSegment.text(content)
+    return message
+
+
+def parse_qq_content(content: str) -> qq_SegmentMessage:
+    """将 QQ 消息内容格式还原为消息，只还原 QQ 表情"""
+    message = qq_SegmentMessage()
+    text_begin = 0
+    for emoji in re.finditer(r"<emoji:(\d+)>", content):
+        if text := content[text_begin : emoji.start()]:
+            message += qq_MessageSegment.text(unescape(text))
+        message += qq_MessageSegment.emoji(emoji.group(1))
+        text_begin = emoji.end()
+    if text := content[text_begin:]:
+        message += qq_MessageSegment.text(unescape(text))
+    return message
+
+
+def build_dc_emoji_url(emoji_id: str, animated: bool) -> str:
+    """获取 Discord 表情的 CDN 地址，按最大边长请求缩小后的版本"""
+    url = URL("https://cdn.discordapp.com/emojis/") / (
+        f"{emoji_id}." + ("gif" if animated else "webp")
+    )
+    if image_max_size:
+        size = min(EMOJI_CDN_MAX_SIZE, 1 << (image_max_size.bit_length() - 1))
+        url = url.with_query(size=size)
+    return str(url)
+
+
+def build_dc_attachment_url(attachment: Attachment) -> str:
+    """获取 Discord 图片附件的地址，过大时通过 media proxy 请求缩小后的版本"""
+    width, height = attachment.width, attachment.height
+    if (
+        not image_max_size
+        or not width
+        or not height
+        or max(width, height) <= image_max_size
+        or attachment.content_type == "image/gif"
+    ):
+        return attachment.url
+    scale = image_max_size / max(width, height)
+    return str(
+        URL(attachment.proxy_url).update_query(
+            width=max(1, int(width * scale)), height=max(1, int(height * scale))
+        )
+    )
+
+
+def describe_dc_attachment(attachment: Attachment) -> str:
+    """图片以外的 Discord 附件的文字说明"""
+    content_type = (
+        attachment.content_type if attachment.content_type is not UNSET else ""
+    )
+    if attachment.duration_secs is not UNSET:
+        return f"[语音 {attachment.duration_secs:.0f} 秒]"
+    if content_type.startswith("video/"):
+        kind = "视频"
+    elif content_type.startswith("audio/"):
+        kind = "音频"
     else:
-        output = io.BytesIO(img_bytes)
-    return output
+        kind = "文件"
+    return f"[{kind}：{attachment.filename}，{format_size(attachment.size)}]"
+
+
+async def convert_qq_img(img_bytes: bytes) -> bytes:
+    img_bytes, _ = await convert_media(
+        partial(optimize_image, formats=QQ_IMAGE_FORMATS, max_bytes=QQ_IMAGE_MAX_BYTES),
+        img_bytes,
+        decoded_size,
+    )
+    return img_bytes
+
+
+async def get_qq_img(url: str, proxy: Optional[str]) -> bytes:
+    return await convert_qq_img(await get_file_bytes(url, proxy))
+
+
+async def get_dc_emoji_bytes(url: str, proxy: Optional[str]) -> bytes:
+    """获取 Discord 表情原图，优先使用缓存"""
+    if (img_bytes := dc_emoji_images.get(url)) is not None:
+        await acquire_media(len(img_bytes))
+        return img_bytes
+    img_bytes = await get_file_bytes(url, proxy)
+    dc_emoji_images.set(url, img_bytes)
+    return img_bytes
+
+
+async def get_qq_emoji(url: str, proxy: Optional[str]) -> bytes:
+    return await convert_qq_img(await get_dc_emoji_bytes(url, proxy))
+
+
+async def get_qq_emoji_composite(
+    urls: list[str], proxy: Optional[str]
+) -> Optional[bytes]:
+    """下载多个表情并拼接为一张图片，跳过下载失败的表情，全部失败时返回 None"""
+    results = await asyncio.gather(
+        *(get_dc_emoji_bytes(url, proxy) for url in urls), return_exceptions=True
+    )
+    emoji_bytes: list[bytes] = []
+    for url, result in zip(urls, results):
+        if isinstance(result, asyncio.CancelledError):
+            raise result
+        if isinstance(result, BaseException):
+            logger.warning(f"get emoji {url} error: {result!r}, skip")
+        else:
+            emoji_bytes.append(result)
+    if not emoji_bytes:
+        return None
+    img_bytes = await asyncio.to_thread(
+        composite_images, emoji_bytes, EMOJI_TILE_SIZE, EMOJI_TILE_GAP
+    )
+    if img_bytes is not None:
+        await acquire_media(len(img_bytes))
+    release_media(sum(map(len, emoji_bytes)))
+    return img_bytes
 
 
 async def get_dc_channel_name(bot: dc_Bot, guild_id: int, channel_id: int) -> str:
+    if (name := dc_channel_names.get((guild_id, channel_id))) is not None:
+        return name
     channels = await bot.get_guild_channels(guild_id=guild_id)
-    channel = next(channel for channel in channels if channel.id == channel_id)
-    return (
-        channel.name
-        if channel.name is not UNSET and channel.name is not None
-        else "(error:无名频道)"
-    )
+    # 一次请求得到服务器的全部频道，一起缓存
+    for channel in channels:
+        dc_channel_names.set(
+            (guild_id, channel.id),
+            channel.name
+            if channel.name is not UNSET and channel.name is not None
+            else "(error:无名频道)",
+        )
+    return dc_channel_names.data[(guild_id, channel_id)][1]
 
 
 async def get_dc_role_name(bot: dc_Bot, guild_id: int, role_id: int) -> str:
+    if (name := dc_role_names.get((guild_id, role_id))) is not None:
+        return name
     roles = await bot.get_guild_roles(guild_id=guild_id)
-    role = next(role for role in roles if role.id == role_id)
-    return role.name
+    for role in roles:
+        dc_role_names.set((guild_id, role.id), role.name)
+    return dc_role_names.data[(guild_id, role_id)][1]
 
 
 async def build_qq_message(
     bot: dc_Bot, event: dc_MessageCreateEvent
-) -> tuple[qq_SegmentMessage, list[str]]:
+) -> tuple[qq_SegmentMessage, list[str], list[str], list[str]]:
     qq_message = qq_SegmentMessage(
         qq_MessageSegment.text(
             (
@@ -73,6 +273,8 @@ async def build_qq_message(
             + f"(@{event.author.username}):\n"
         )
     )
+    emoji_list: list[str] = []
+    emoji_names: list[str] = []
     img_list: list[str] = []
     message = (
         event
@@ -90,7 +292,7 @@ async def build_qq_message(
         content,
     ):
         if content := content[text_begin : embed.pos + embed.start()]:
-            qq_message += qq_MessageSegment.text(content)
+            qq_message += build_qq_text(content)
         text_begin = embed.pos + embed.end()
         if embed.group("type") in ("@!", "@"):
             nick, username = await get_dc_member_name(
@@ -126,12 +328,10 @@ async def build_qq_message(
                 if not cut[1]:
                     qq_message += qq_MessageSegment.text(cut[0])
                 else:
-                    img_list.append(
-                        "https://cdn.discordapp.com/emojis/"
-                        + cut[1]
-                        + "."
-                        + ("gif" if embed.group("type") == "a:" else "webp")
+                    emoji_list.append(
+                        build_dc_emoji_url(cut[1], embed.group("type") == "a:")
                     )
+                    emoji_names.append(cut[0])
             else:
                 qq_message += qq_MessageSegment.text(embed.group())
         else:
@@ -140,7 +340,7 @@ async def build_qq_message(
             else:
                 qq_message += qq_MessageSegment.text(embed.group())
     if content := content[text_begin:]:
-        qq_message += qq_MessageSegment.text(content)
+        qq_message += build_qq_text(content)
 
     if message.mention_everyone:
         qq_message += qq_MessageSegment.mention_everyone()
@@ -150,90 +350,197 @@ async def build_qq_message(
             if attachment.content_type is not UNSET and re.match(
                 r"image/(gif|jpeg|png|webp)", attachment.content_type, 0
             ):
-                img_list.append(attachment.url)
+                img_list.append(build_dc_attachment_url(attachment))
             else:
-                pass
-    return qq_message, img_list
+                # QQ频道不能发送文件，以文字说明代替
+                qq_message += qq_MessageSegment.text(
+                    "\n" + describe_dc_attachment(attachment)
+                )
+    return qq_message, emoji_list, emoji_names, img_list
 
 
-async def create_dc_to_qq(
-    bot: dc_Bot, event: dc_MessageCreateEvent, qq_bot: qq_Bot, link: LinkWithWebhook
-):
-    """discord 消息转发到 QQ"""
-    logger.debug("into create_dc_to_qq()")
-    message, img_list = await build_qq_message(bot, event)
-    if img_list:
-        get_img_tasks = [get_qq_img(img, discord_proxy) for img in img_list]
-        img_data_list = await asyncio.gather(*get_img_tasks)
+async def build_dc_to_qq_payload(
+    bot: dc_Bot, event: dc_MessageCreateEvent
+) -> DCToQQPayload:
+    """整理 discord 消息中需要转发的内容"""
+    message, emoji_list, emoji_names, img_list = await build_qq_message(bot, event)
+    header, *segments = message
+    return DCToQQPayload(
+        dc_message_ids=[event.id],
+        header=str(header),
+        text="".join(str(seg) for seg in segments if seg.type in ("text", "emoji")),
+        mention_everyone=any(seg.type == "mention_everyone" for seg in message),
+        emoji_list=emoji_list,
+        emoji_names=emoji_names,
+        img_list=img_list,
+        reference_dc_id=(
+            event.referenced_message.id
+            if event.referenced_message is not UNSET
+            and event.referenced_message is not None
+            else None
+        ),
+    )
+
+
+@outbox_handler("dc_to_qq", DCToQQPayload)
+@track_relay
+@with_media_budget
+async def send_dc_to_qq(payload: DCToQQPayload, link: LinkWithWebhook):
+    """发送 discord 转 QQ 的消息，并记录消息 id"""
+    add_sources(*payload.dc_message_ids)
+    message = parse_qq_content(payload.header + payload.text)
+    if payload.mention_everyone:
+        message += qq_MessageSegment.mention_everyone()
+    emoji_list, img_list = payload.emoji_list, payload.img_list
+    if emoji_composite and len(emoji_list) > 1:
+        get_img_tasks = [partial(get_qq_emoji_composite, emoji_list, discord_proxy)]
+    else:
+        get_img_tasks = [
+            partial(get_qq_emoji, emoji, discord_proxy) for emoji in emoji_list
+        ]
+    get_img_tasks.extend(partial(get_qq_img, img, discord_proxy) for img in img_list)
+    img_data_list: list[Optional[bytes]]
+    if get_img_tasks:
+        # 重试时不再下载已经发出的图片
+        img_data_list = [None] * payload.sent + await with_deadline(
+            asyncio.gather(*(get() for get in get_img_tasks[payload.sent :])),
+            "get_qq_img",
+        )
     else:
-        img_data_list = ["0"]
+        img_data_list = [None]
+    if (
+        emoji_composite
+        and len(emoji_list) > 1
+        and payload.sent == 0
+        and img_data_list[0] is None
+    ):
+        # 表情全部获取失败时，以表情名代替
+        message += qq_MessageSegment.text(
+            " ".join(f":{name}:" for name in payload.emoji_names)
+        )
 
-    async with get_session() as session:
-        if (
-            event.referenced_message is not UNSET
-            and event.referenced_message is not None
-            and (
-                reference := await session.scalar(
+    if payload.reference_dc_id is not None:
+        async with get_session() as session:
+            if reference := await with_deadline(
+                session.scalar(
                     select(MsgID.qqid)
-                    .filter(MsgID.dcid == event.referenced_message.id)
+                    .filter(MsgID.dcid == payload.reference_dc_id)
                     .limit(1)
+                ),
+                "select MsgID",
+            ):
+                message += qq_MessageSegment.reference(reference)
+
+    sends: list[qq_Message] = []
+    try:
+        for i, img_data in enumerate(img_data_list):
+            if i < payload.sent:
+                continue
+            if isinstance(img_data, bytes):
+                send_message = (
+                    message + qq_MessageSegment.file_image(img_data)
+                    if i == 0
+                    else qq_SegmentMessage(qq_MessageSegment.file_image(img_data))
                 )
-            )
-        ):
-            message += qq_MessageSegment.reference(reference)
-
-    sends: list = []
-    for i, img_data in enumerate(img_data_list):
-        try_times = 1
-        while True:
-            try:
-                if isinstance(img_data, io.BytesIO):
-                    message = (
-                        message.append(qq_MessageSegment.file_image(img_data))
-                        if i == 0
-                        else qq_SegmentMessage(qq_MessageSegment.file_image(img_data))
-                    )
-                sends.append(await qq_bot.send_to_channel(link.qq_channel_id, message))
-                break
-            except AuditException as e:
-                try_times = 1
-                while True:
-                    if id := (await e.get_audit_result()).message_id:
-                        sends.append(id)
-                        break
-                    else:
-                        logger.warning(f"get_audit_result retry {try_times}")
-                        if try_times >= 5:
-                            logger.warning(
-                                "message audit fail: "
-                                + f"[audit_id:{e.audit_id}, dc_message_id: {event.id}]"
+            else:
+                send_message = message
+            try_times = 1
+            while True:
+                check_deadline("send_to_channel")
+                try:
+                    async with use_qq_bot(link.qq_guild_id) as qq_bot:
+                        sends.append(
+                            await with_deadline(
+                                qq_bot.send_to_channel(
+                                    link.qq_channel_id, send_message
+                                ),
+                                "send_to_channel",
                             )
-                            return
-                        try_times += 1
-                        await asyncio.sleep(1)
-                break
-            except NameError as e:
-                logger.warning(f"create_dc_to_qq() error {e}, retry {try_times}")
-                if try_times >= 3:
-                    raise e
-                try_times += 1
-                await asyncio.sleep(5)
-
-    async with get_session() as session:
-        for send in sends:
-            session.add(
-                MsgID(
-                    dcid=event.id,
-                    qqid=send.id if isinstance(send, qq_Message) else send,
-                )
-            )
-        await session.commit()
+                        )
+                    break
+                except AuditException as e:
+                    add_audit(e.audit_id, payload.dc_message_ids)
+                    break
+                except BotNotFound as e:
+                    logger.warning(f"send_dc_to_qq() error {e}, retry {try_times}")
+                    if try_times >= 3:
+                        raise e
+                    record_retry(link)
+                    try_times += 1
+                    await sleep_before_retry(5, "send_dc_to_qq", e)
+            payload.sent = i + 1
+    finally:
+        # 中途放弃时也记录已发送的消息，以便之后撤回
+        if sends:
+            add_destinations(*(send.id for send in sends))
+            with span("commit MsgID"):
+                async with get_session() as session:
+                    session.add_all(
+                        MsgID(dcid=dcid, qqid=send.id)
+                        for send in sends
+                        for dcid in payload.dc_message_ids
+                    )
+                    await session.commit()
+
+
+def merge_dc_to_qq_payloads(
+    first: DCToQQPayload, second: DCToQQPayload
+) -> Optional[DCToQQPayload]:
+    """合并同一作者的两条纯文本消息，超出 QQ 长度限制时返回 None"""
+    text = first.text + "\n" + second.text
+    if len(first.header + text) > QQ_MAX_CONTENT_LENGTH:
+        return None
+    return DCToQQPayload(
+        dc_message_ids=first.dc_message_ids + second.dc_message_ids,
+        header=second.header,
+        text=text,
+        emoji_list=[],
+        img_list=[],
+    )
+
+
+async def relay_dc_to_qq(payload: DCToQQPayload, link: LinkWithWebhook):
+    add_sources(*payload.dc_message_ids)
+    if outbox_enabled:
+        await add_to_outbox(link, "dc_to_qq", payload)
+        logger.debug("relay_dc_to_qq(): added to outbox")
+        return
+    try:
+        await send_dc_to_qq(payload, link)
+    except DeadlineExceeded as e:
+        logger.warning(f"relay_dc_to_qq(): drop stale message: {e}")
+        record_deadline_miss(link)
+        fail_trace(e)
+
+
+async def create_dc_to_qq(
+    bot: dc_Bot, event: dc_MessageCreateEvent, link: LinkWithWebhook
+):
+    """discord 消息转发到 QQ"""
+    logger.debug("into create_dc_to_qq()")
+    payload = await with_deadline(
+        build_dc_to_qq_payload(bot, event), "build_dc_to_qq_payload"
+    )
+    key = ("dc_to_qq", link_key(link), str(event.author.id))
+    if not coalesce_window:
+        await relay_dc_to_qq(payload, link)
+    elif (
+        not payload.emoji_list
+        and not payload.img_list
+        and not payload.mention_everyone
+        and payload.reference_dc_id is None
+    ):
+        await coalesce(
+            key, payload, merge_dc_to_qq_payloads, partial(relay_dc_to_qq, link=link)
+        )
+    else:
+        # 同一作者之前等待合并的消息需要先发出
+        await send_now(key, partial(relay_dc_to_qq, payload, link))
     logger.debug("finish create_dc_to_qq()")
 
 
 async def delete_dc_to_qq(
     event: dc_MessageDeleteEvent,
-    qq_bot: qq_Bot,
     link: LinkWithWebhook,
     just_delete: list,
 ):
@@ -245,21 +552,36 @@ async def delete_dc_to_qq(
     while True:
         try:
             async with get_session() as session:
-                if msgids := await session.scalars(
-                    select(MsgID).filter(MsgID.dcid == event.id)
-                ):
-                    for msgid in msgids:
-                        await qq_bot.delete_message(
-                            message_id=msgid.qqid, channel_id=link.qq_channel_id
+                result = await with_deadline(
+                    session.execute(
+                        select(MsgID.id, MsgID.qqid).filter(MsgID.dcid == event.id)
+                    ),
+                    "select MsgID",
+                )
+                rows = result.tuples().all()
+            if rows:
+                async with use_qq_bot(link.qq_guild_id) as qq_bot:
+                    deleted = await with_deadline(
+                        delete_relayed_messages(
+                            rows,
+                            partial(
+                                qq_bot.delete_message, channel_id=link.qq_channel_id
+                            ),
+                            just_delete,
+                        ),
+                        "delete_relayed_messages",
+                    )
+                if deleted:
+                    async with get_session() as session:
+                        await session.execute(
+                            delete(MsgID).where(MsgID.id.in_(deleted))
                         )
-                        just_delete.append(msgid.qqid)
-                        await session.delete(msgid)
-                    await session.commit()
+                        await session.commit()
             logger.debug("finish delete_dc_to_qq()")
             break
-        except (UnboundLocalError, TypeError, NameError) as e:
+        except (UnboundLocalError, TypeError, BotNotFound) as e:
             logger.warning(f"delete_dc_to_qq() error: {e}, retry {try_times}")
             if try_times == 3:
                 raise e
             try_times += 1
-            await asyncio.sleep(5)
+            await sleep_before_retry(5, "delete_dc_to_qq", e)
@@ -0,0 +1,79 @@
+import asyncio
+from collections.abc import Awaitable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+from typing import Optional, TypeVar
+
+from .config import plugin_config
+from .trace import add_retry, span
+
+relay_deadline = plugin_config.dcqg_relay_deadline
+
+T = TypeVar("T")
+
+current_deadline: ContextVar[Optional[float]] = ContextVar(
+    "dcqg_relay_deadline", default=None
+)
+"""当前转发的截止时间（time.time()），None 为不限制"""
+
+
+class DeadlineExceeded(Exception):
+    """转发超过截止时间"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        super().__init__(f"deadline exceeded at {stage}")
+
+
+def deadline_from(received_at: float) -> Optional[float]:
+    """从收到消息的时间计算截止时间"""
+    return received_at + relay_deadline if relay_deadline else None
+
+
+@contextmanager
+def use_deadline(deadline: Optional[float]) -> Iterator[None]:
+    """在此范围内（包括其中创建的任务）使用该截止时间"""
+    token = current_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def time_left() -> Optional[float]:
+    if (deadline := current_deadline.get()) is None:
+        return None
+    return deadline - time.time()
+
+
+def check_deadline(stage: str):
+    if (left := time_left()) is not None and left <= 0:
+        raise DeadlineExceeded(stage)
+
+
+async def with_deadline(aw: Awaitable[T], stage: str) -> T:
+    """等待 aw，超过截止时间时取消并抛出 DeadlineExceeded；同时在 trace 中记录该阶段"""
+    with span(stage):
+        if (left := time_left()) is None:
+            return await aw
+        if left <= 0:
+            # 关闭未开始的协程，避免 never awaited 警告
+            asyncio.ensure_future(aw).cancel()
+            raise DeadlineExceeded(stage)
+        try:
+            return await asyncio.wait_for(aw, left)
+        except asyncio.TimeoutError:
+            if (left := time_left()) is not None and left <= 0:
+                raise DeadlineExceeded(stage) from None
+            raise
+
+
+async def sleep_before_retry(
+    delay: float, stage: str, error: Optional[BaseException] = None
+):
+    """重试前等待，等待后会超过截止时间时直接放弃；同时在 trace 中记录这次重试"""
+    add_retry(stage, error)
+    if (left := time_left()) is not None and left <= delay:
+        raise DeadlineExceeded(stage)
+    await asyncio.sleep(delay)
@@ -0,0 +1,168 @@
+import io
+from typing import Optional
+
+import filetype
+from nonebot import logger
+from PIL import Image, ImageSequence
+
+from .config import plugin_config
+
+image_max_size = plugin_config.dcqg_relay_image_max_size
+image_quality = plugin_config.dcqg_relay_image_quality
+
+QQ_IMAGE_FORMATS = {"png", "jpg", "gif"}
+"""QQ频道可以接收的图片格式"""
+QQ_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+DC_IMAGE_FORMATS = {"png", "jpg", "gif", "webp"}
+"""Discord 可以接收的图片格式"""
+DC_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+DC_FILE_MAX_BYTES = 10 * 1024 * 1024
+"""Discord webhook 可以上传的单个文件大小"""
+
+EMOJI_CDN_MAX_SIZE = 128
+"""向 Discord CDN 请求表情时的最大尺寸，表情原图不超过此尺寸"""
+EMOJI_TILE_SIZE = 64
+"""拼接表情时每个表情的高度（像素）"""
+EMOJI_TILE_GAP = 4
+
+PIL_FORMATS = {"png": "PNG", "jpg": "JPEG", "gif": "GIF", "webp": "WEBP"}
+
+
+def has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (
+        img.mode == "P" and "transparency" in img.info
+    )
+
+
+def encode_image(img: Image.Image, kind: str, size: Optional[tuple[int, int]]) -> bytes:
+    """按 kind 重新编码图片，size 不为 None 时缩放"""
+    output = io.BytesIO()
+    if getattr(img, "is_animated", False) and kind in ("gif", "webp"):
+        frames = []
+        durations = []
+        for frame in ImageSequence.Iterator(img):
+            durations.append(frame.info.get("duration", img.info.get("duration", 100)))
+            frame = frame.convert("RGBA")
+            frames.append(frame.resize(size, Image.LANCZOS) if size else frame)
+        frames[0].save(
+            output,
+            format=PIL_FORMATS[kind],
+            save_all=True,
+            append_images=frames[1:],
+            duration=durations,
+            loop=img.info.get("loop", 0),
+            disposal=2,
+            optimize=True,
+        )
+        return output.getvalue()
+
+    frame = img.resize(size, Image.LANCZOS) if size else img
+    if kind == "jpg":
+        frame.convert("RGB").save(
+            output, format="JPEG", quality=image_quality, optimize=True
+        )
+    elif kind == "webp":
+        frame.save(output, format="WEBP", quality=image_quality, method=4)
+    else:
+        if frame.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            frame = frame.convert("RGBA")
+        frame.save(output, format=PIL_FORMATS[kind], optimize=True)
+    return output.getvalue()
+
+
+def pick_format(img: Image.Image, kind: str, formats: set[str]) -> str:
+    """根据目标平台可以接收的格式选择输出格式"""
+    if getattr(img, "is_animated", False):
+        if kind in formats and kind in ("gif", "webp"):
+            return kind
+        if "gif" in formats:
+            return "gif"
+    if kind in formats and kind != "png":
+        return kind
+    if has_alpha(img):
+        return "webp" if "webp" in formats else "png"
+    return "jpg" if "jpg" in formats else "png"
+
+
+def decoded_size(img_bytes: bytes) -> int:
+    """
+    只读取文件头，估计解码后占用的内存（宽 × 高 × 通道数 × 帧数），
+    动图按转换时使用的 RGBA 计算，不是图片时为 0
+    """
+    try:
+        with Image.open(io.BytesIO(img_bytes)) as img:
+            frames = getattr(img, "n_frames", 1)
+            bands = 4 if frames > 1 else len(img.getbands())
+            return img.width * img.height * bands * frames
+    except Exception:
+        return 0
+
+
+def optimize_image(
+    img_bytes: bytes, formats: set[str], max_bytes: int
+) -> tuple[bytes, str]:
+    """按目标平台的格式与大小限制压缩、缩放图片，返回图片数据与扩展名"""
+    match = filetype.match(img_bytes)
+    kind = match.extension if match else "dat"
+    try:
+        img = Image.open(io.BytesIO(img_bytes))
+        img.load()
+    except Exception as e:
+        logger.debug(f"optimize image: not a image ({e}), skip")
+        return img_bytes, kind
+
+    with img:
+        width, height = img.size
+        scale = min(1.0, image_max_size / max(width, height)) if image_max_size else 1.0
+        if kind in formats and scale == 1.0 and len(img_bytes) <= max_bytes:
+            return img_bytes, kind
+
+        out_kind = pick_format(img, kind, formats)
+        output = img_bytes
+        for _ in range(5):
+            size = (
+                (max(1, int(width * scale)), max(1, int(height * scale)))
+                if scale < 1.0
+                else None
+            )
+            output = encode_image(img, out_kind, size)
+            if len(output) <= max_bytes:
+                break
+            scale *= 0.75
+
+    if kind in formats and scale == 1.0 and len(output) >= len(img_bytes):
+        output, out_kind = img_bytes, kind
+    logger.debug(
+        f"optimize image: {kind} {len(img_bytes)} bytes -> {out_kind} "
+        + f"{len(output)} bytes, saved {len(img_bytes) - len(output)} bytes"
+    )
+    return output, out_kind
+
+
+def composite_images(images: list[bytes], height: int, gap: int) -> Optional[bytes]:
+    """
+    将多张小图片按相同高度横向拼接为一张 PNG，动图只取第一帧；
+    跳过无法解码的图片，全部无法解码时返回 None
+    """
+    tiles: list[Image.Image] = []
+    for img_bytes in images:
+        try:
+            with Image.open(io.BytesIO(img_bytes)) as img:
+                width = max(1, round(img.width * height / img.height))
+                tiles.append(img.convert("RGBA").resize((width, height), Image.LANCZOS))
+        except Exception as e:
+            logger.debug(f"composite images: skip a image ({e})")
+    if not tiles:
+        return None
+    canvas = Image.new(
+        "RGBA",
+        (sum(tile.width for tile in tiles) + gap * (len(tiles) - 1), height),
+        (0, 0, 0, 0),
+    )
+    x = 0
+    for tile in tiles:
+        canvas.paste(tile, (x, 0), tile)
+        x += tile.width + gap
+    output = io.BytesIO()
+    canvas.save(output, format="PNG", optimize=True)
+    return output.getvalue()
@@ -13,8 +13,7 @@ import sqlite3 as sql
 
 from alembic import op
 from nonebot import logger, require
-from sqlalchemy.ext.automap import automap_base
-from sqlalchemy.orm import Session
+import sqlalchemy as sa
 
 revision: str = "0105684994ff"
 down_revision: str | Sequence[str] | None = "a9b783356705"
@@ -22,22 +21,34 @@ branch_labels: str | Sequence[str] | None = None
 depends_on: str | Sequence[str] | None = None
 
 
+MIGRATE_CHUNK_SIZE = 10000
+
+
 def move_from_sqlite():
     import nonebot_plugin_localstore as store
 
     database_file = store.get_data_file("sync_message_to_discord", "msgid.db")
     if database_file.exists():
         logger.info("dcqg_relay: 发现来自 msgid.db 的数据，正在迁移...")
-        Base = automap_base()
-        Base.prepare(autoload_with=op.get_bind())
-        MsgID = Base.classes.nonebot_plugin_dcqg_relay_msgid
-        session = Session(op.get_bind())
+        msgid_table = sa.table(
+            "nonebot_plugin_dcqg_relay_msgid",
+            sa.column("dcid", sa.Integer),
+            sa.column("qqid", sa.String),
+        )
+        bind = op.get_bind()
         sql_conn = sql.connect(database_file)
-        datas = sql_conn.execute("SELECT * FROM ID").fetchall()
-        sql_conn.close()
-        for data in datas:
-            session.add(MsgID(dcid=data[0], qqid=data[1]))
-        session.commit()
+        try:
+            cursor = sql_conn.execute("SELECT * FROM ID")
+            moved = 0
+            while datas := cursor.fetchmany(MIGRATE_CHUNK_SIZE):
+                bind.execute(
+                    sa.insert(msgid_table),
+                    [{"dcid": data[0], "qqid": data[1]} for data in datas],
+                )
+                moved += len(datas)
+                logger.info(f"dcqg_relay: 已迁移 {moved} 条")
+        finally:
+            sql_conn.close()
         logger.info("dcqg_relay: 迁移完成")
 
 
@@ -6,3 +6,24 @@ class MsgID(Model):
     id: Mapped[int] = mapped_column(primary_key=True)
     dcid: Mapped[int]
     qqid: Mapped[str]
+
+
+class Worker(Model):
+    worker_id: Mapped[str] = mapped_column(primary_key=True)
+    heartbeat_at: Mapped[float]
+
+
+class LinkLease(Model):
+    link_key: Mapped[str] = mapped_column(primary_key=True)
+    worker_id: Mapped[str]
+    expires_at: Mapped[float]
+
+
+class Outbox(Model):
+    id: Mapped[int] = mapped_column(primary_key=True)
+    link_key: Mapped[str] = mapped_column(index=True)
+    direction: Mapped[str]
+    payload: Mapped[str]
+    created_at: Mapped[float]
+    attempts: Mapped[int]
+    next_attempt_at: Mapped[float]
@@ -0,0 +1,224 @@
+import asyncio
+from collections.abc import Awaitable
+import json
+import time
+from typing import Any, Callable, Optional, TypeVar
+
+from nonebot import logger
+from nonebot.compat import model_dump, type_validate_json
+from nonebot_plugin_orm import get_session
+from pydantic import BaseModel
+from sqlalchemy import delete, select, update
+
+from . import cluster, utils
+from .config import LinkWithWebhook, plugin_config
+from .deadline import DeadlineExceeded, check_deadline, use_deadline
+from .model import Outbox
+from .stats import record_deadline_miss, record_drop, record_retry
+from .trace import fail_trace, set_trace_attr, span, start_trace
+
+outbox_enabled = plugin_config.dcqg_relay_outbox
+outbox_workers = plugin_config.dcqg_relay_outbox_workers
+outbox_max_attempts = plugin_config.dcqg_relay_outbox_max_attempts
+outbox_ttl = plugin_config.dcqg_relay_outbox_ttl
+
+OUTBOX_SCAN_INTERVAL = 5
+"""检查到期重试与其他进程写入的消息的间隔（秒）"""
+OUTBOX_RETRY_BASE = 2
+
+T_Payload = TypeVar("T_Payload", bound=BaseModel)
+T_Handler = Callable[[Any, LinkWithWebhook], Awaitable[None]]
+
+outbox_handlers: dict[str, tuple[type[BaseModel], T_Handler]] = {}
+"""发送方向: (消息类型, 发送函数)"""
+ready_links: Optional[asyncio.Queue[str]] = None
+busy_links: dict[str, asyncio.Event] = {}
+"""正在发送的 link，发送结束时 set"""
+outbox_tasks: list[asyncio.Task] = []
+
+
+def outbox_handler(direction: str, payload_type: type[T_Payload]):
+    """注册一个发送方向的发送函数"""
+
+    def decorator(
+        func: Callable[[T_Payload, LinkWithWebhook], Awaitable[None]],
+    ) -> Callable[[T_Payload, LinkWithWebhook], Awaitable[None]]:
+        outbox_handlers[direction] = (payload_type, func)
+        return func
+
+    return decorator
+
+
+def dump_payload(payload: BaseModel) -> str:
+    return json.dumps(model_dump(payload), ensure_ascii=False, separators=(",", ":"))
+
+
+async def add_to_outbox(link: LinkWithWebhook, direction: str, payload: BaseModel):
+    """将待发送的消息写入发件箱，由后台发送"""
+    key = cluster.link_key(link)
+    now = time.time()
+    entry = Outbox(
+        link_key=key,
+        direction=direction,
+        payload=dump_payload(payload),
+        created_at=now,
+        attempts=0,
+        next_attempt_at=now,
+    )
+    with span("add_to_outbox"):
+        async with get_session() as session:
+            session.add(entry)
+            await session.flush()
+            # 发送时的 trace 中也有 outbox_id，用于关联
+            set_trace_attr("outbox_id", entry.id)
+            await session.commit()
+    if ready_links is not None:
+        ready_links.put_nowait(key)
+
+
+def find_link(key: str) -> Optional[LinkWithWebhook]:
+    return next(
+        (link for link in utils.with_webhook_links if cluster.link_key(link) == key),
+        None,
+    )
+
+
+async def deliver(entry: Outbox, link: LinkWithWebhook) -> bool:
+    """发送一条消息，成功或放弃时返回 True，需要稍后重试时返回 False"""
+    payload_type, handler = outbox_handlers[entry.direction]
+    payload = type_validate_json(payload_type, entry.payload)
+    with start_trace(entry.direction, entry.link_key) as trace:
+        trace.attrs.update(outbox_id=entry.id, attempt=entry.attempts + 1)
+        try:
+            # 发件箱中的消息已经持久化，不使用单条消息的截止时间，
+            # 只在写入后超过 outbox_ttl 时放弃
+            with use_deadline(entry.created_at + outbox_ttl if outbox_ttl else None):
+                check_deadline("outbox")
+                await handler(payload, link)
+            return True
+        except DeadlineExceeded as e:
+            logger.warning(f"outbox: drop stale {entry.id}: {e}")
+            record_deadline_miss(link)
+            fail_trace(e)
+            return True
+        except Exception as e:
+            fail_trace(e)
+            if entry.attempts + 1 >= outbox_max_attempts:
+                logger.error(
+                    f"outbox: drop {entry.id} after {entry.attempts + 1} tries: {e}"
+                )
+                record_drop(link)
+                return True
+            logger.warning(f"outbox: send {entry.id} error: {e}, retry later")
+            record_retry(link)
+            # 发送函数会在 payload 中记录已发出的部分，重试时从这里继续
+            entry.payload = dump_payload(payload)
+            return False
+
+
+async def drain_link(key: str, retry_now: bool = False):
+    """
+    按写入顺序发送一个 link 的消息，遇到需要重试的消息时暂停该 link；
+    retry_now 为 True 时不等待重试时间
+    """
+    while True:
+        async with get_session() as session:
+            entry = await session.scalar(
+                select(Outbox)
+                .where(Outbox.link_key == key)
+                .order_by(Outbox.id)
+                .limit(1)
+            )
+        if entry is None or (entry.next_attempt_at > time.time() and not retry_now):
+            return
+        if (link := find_link(key)) is None:
+            # link 被移除或 webhook 尚未就绪时保留消息，之后可以继续发送
+            logger.warning(f"outbox: link {key} not found, keep {entry.id}")
+            return
+        if await deliver(entry, link):
+            async with get_session() as session:
+                await session.execute(delete(Outbox).where(Outbox.id == entry.id))
+                await session.commit()
+            continue
+        async with get_session() as session:
+            await session.execute(
+                update(Outbox)
+                .where(Outbox.id == entry.id)
+                .values(
+                    payload=entry.payload,
+                    attempts=entry.attempts + 1,
+                    next_attempt_at=time.time()
+                    + OUTBOX_RETRY_BASE ** (entry.attempts + 1),
+                )
+            )
+            await session.commit()
+        return
+
+
+async def drain_exclusive(key: str, retry_now: bool = False):
+    """同一 link 同时只由一个任务发送"""
+    done = busy_links[key] = asyncio.Event()
+    try:
+        await drain_link(key, retry_now)
+    except Exception as e:
+        logger.error(f"outbox: drain {key} error: {e}")
+    finally:
+        del busy_links[key]
+        done.set()
+
+
+async def outbox_sender(queue: asyncio.Queue[str]):
+    while True:
+        key = await queue.get()
+        if key not in busy_links:
+            await drain_exclusive(key)
+
+
+async def drain_links(keys: set[str]):
+    """
+    立即发送这些 link 在发件箱中的消息，等待重试的消息也立即重试一次；
+    正在发送的 link 先等待原任务结束
+    """
+    for key in keys:
+        while (busy := busy_links.get(key)) is not None:
+            await busy.wait()
+        await drain_exclusive(key, retry_now=True)
+
+
+async def outbox_scanner(queue: asyncio.Queue[str]):
+    """启动时重放未发送的消息，之后定期检查到期的重试"""
+    while True:
+        try:
+            async with get_session() as session:
+                keys = await session.scalars(
+                    select(Outbox.link_key)
+                    .where(Outbox.next_attempt_at <= time.time())
+                    .distinct()
+                )
+                for key in keys:
+                    if find_link(key) is None:
+                        continue
+                    if not cluster.worker_id or key in cluster.owned_links:
+                        queue.put_nowait(key)
+        except Exception as e:
+            logger.error(f"outbox: scan error: {e}")
+        await asyncio.sleep(OUTBOX_SCAN_INTERVAL)
+
+
+async def start_outbox():
+    global ready_links
+    if not outbox_enabled or ready_links is not None:
+        return
+    ready_links = asyncio.Queue()
+    outbox_tasks.append(asyncio.create_task(outbox_scanner(ready_links)))
+    outbox_tasks.extend(
+        asyncio.create_task(outbox_sender(ready_links)) for _ in range(outbox_workers)
+    )
+
+
+async def stop_outbox():
+    global ready_links
+    for task in outbox_tasks:
+        task.cancel()
+    outbox_tasks.clear()
+    ready_links = None
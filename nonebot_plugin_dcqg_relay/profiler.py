@@ -0,0 +1,163 @@
+import asyncio
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import random
+import sys
+import threading
+import time
+from types import FrameType
+from typing import Optional
+
+from nonebot import logger
+import nonebot_plugin_localstore as store
+
+from .config import plugin_config
+
+profile_rate = plugin_config.dcqg_relay_profile_rate
+
+PROFILE_DEFAULT_RATE = 0.1
+"""通过命令开启采样且未指定比例时使用的比例"""
+PROFILE_INTERVAL = 0.01
+"""采样线程读取调用栈的间隔（秒）"""
+PROFILE_FILE_SAMPLES = 100
+"""每个结果文件汇总的采样次数"""
+PROFILE_KEEP_FILES = 10
+"""保留的结果文件数，超过后删除最早的文件"""
+
+
+class Sample:
+    """一次被采样的调用：只记录调用栈中包含该任务的采样"""
+
+    def __init__(self, task: asyncio.Task, thread_id: int):
+        self.task = task
+        self.thread_id = thread_id
+        self.stacks: Counter[str] = Counter()
+
+
+active_samples: set[Sample] = set()
+"""正在进行的采样"""
+sampler_lock = threading.Lock()
+"""保护 active_samples 与各采样的 stacks，采样线程与事件循环线程共用"""
+sampler_thread: Optional[threading.Thread] = None
+pending_stacks: Counter[str] = Counter()
+"""已汇总的调用栈，key 为 collapsed 格式的调用栈，value 为采样到的次数"""
+pending_samples = 0
+write_tasks: set[asyncio.Task] = set()
+
+
+def get_profile_dir() -> Path:
+    return store.get_plugin_data_dir() / "profile"
+
+
+def frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def task_stack(frame: Optional[FrameType], task: asyncio.Task) -> Optional[str]:
+    """task 正在运行时，返回从 task 的协程开始的调用栈，否则返回 None"""
+    root = getattr(task.get_coro(), "cr_frame", None)
+    if root is None:
+        return None
+    names: list[str] = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        if frame is root:
+            return ";".join(reversed(names))
+        frame = frame.f_back
+    return None
+
+
+def run_sampler():
+    """定时读取事件循环线程的调用栈，没有进行中的采样时退出"""
+    global sampler_thread
+    while True:
+        time.sleep(PROFILE_INTERVAL)
+        with sampler_lock:
+            if not active_samples:
+                sampler_thread = None
+                return
+            frames = sys._current_frames()
+            for sample in active_samples:
+                if stack := task_stack(frames.get(sample.thread_id), sample.task):
+                    sample.stacks[stack] += 1
+            del frames
+
+
+def write_profile(stacks: Counter[str], profile_dir: Path):
+    """写入一个结果文件，并删除过多的旧文件"""
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    (
+        profile_dir / f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.collapsed"
+    ).write_text(
+        "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()),
+        encoding="utf-8",
+    )
+    for path in sorted(profile_dir.glob("*.collapsed"))[:-PROFILE_KEEP_FILES]:
+        path.unlink(missing_ok=True)
+
+
+async def save_profile():
+    """将已汇总的采样写入文件"""
+    global pending_stacks, pending_samples
+    if not pending_samples:
+        return
+    stacks, pending_stacks, pending_samples = pending_stacks, Counter(), 0
+    try:
+        await asyncio.to_thread(write_profile, stacks, get_profile_dir())
+    except Exception as e:
+        logger.error(f"write profile error: {e}")
+
+
+def add_sample(sample: Sample):
+    global pending_samples
+    pending_stacks.update(sample.stacks)
+    pending_samples += 1
+    if pending_samples >= PROFILE_FILE_SAMPLES:
+        task = asyncio.create_task(save_profile())
+        write_tasks.add(task)
+        task.add_done_callback(write_tasks.discard)
+
+
+@contextmanager
+def profile_sample() -> Iterator[None]:
+    """
+    按 profile_rate 的概率对本次调用采样：
+    由采样线程定时读取调用栈，只统计正在运行本次调用所在任务时的调用栈
+    """
+    global sampler_thread
+    task = asyncio.current_task()
+    if not profile_rate or task is None or random.random() >= profile_rate:
+        yield
+        return
+    sample = Sample(task, threading.get_ident())
+    with sampler_lock:
+        active_samples.add(sample)
+        if sampler_thread is None:
+            sampler_thread = threading.Thread(
+                target=run_sampler, name="dcqg-relay-profiler", daemon=True
+            )
+            sampler_thread.start()
+    try:
+        yield
+    finally:
+        with sampler_lock:
+            active_samples.discard(sample)
+        add_sample(sample)
+
+
+def start_profile(rate: float):
+    global profile_rate
+    profile_rate = rate
+    logger.info(f"profiling started, rate: {rate}")
+
+
+async def stop_profile():
+    global profile_rate
+    profile_rate = 0
+    await save_profile()
+    logger.info("profiling stopped")
@@ -375,3 +375,85 @@ qq_emoji_dict = {
     "412": "开心",
     "413": "摇起来",
 }
+
+qq_emoji_ids: dict[str, str] = {}
+"""QQ 表情名称: QQ 表情 id，名称重复时使用第一个 id"""
+for emoji_id, emoji_name in qq_emoji_dict.items():
+    qq_emoji_ids.setdefault(emoji_name, emoji_id)
+
+unicode_emoji_names = {
+    "😮": "惊讶",
+    "😍": "色",
+    "😢": "流泪",
+    "😭": "大哭",
+    "😡": "发怒",
+    "😜": "调皮",
+    "😁": "呲牙",
+    "🙂": "微笑",
+    "😎": "酷",
+    "🤮": "吐",
+    "😴": "睡",
+    "😱": "惊恐",
+    "😅": "擦汗",
+    "😘": "飞吻",
+    "😄": "大笑",
+    "😂": "笑哭",
+    "😏": "斜眼笑",
+    "😉": "眨眼睛",
+    "😐": "面无表情",
+    "🤦": "捂脸",
+    "❓": "疑问",
+    "💀": "骷髅",
+    "👋": "挥手",
+    "🐷": "猪头",
+    "🎂": "蛋糕",
+    "⚡": "闪电",
+    "💣": "炸弹",
+    "🔪": "刀",
+    "⚽": "足球",
+    "💩": "便便",
+    "☕": "咖啡",
+    "🌹": "玫瑰",
+    "🥀": "凋谢",
+    "❤": "爱心",
+    "💔": "心碎",
+    "🎁": "礼物",
+    "☀": "太阳",
+    "🌙": "月亮",
+    "👍": "赞",
+    "👎": "踩",
+    "🤝": "握手",
+    "✌": "胜利",
+    "🍉": "西瓜",
+    "👏": "鼓掌",
+    "🍺": "啤酒",
+    "🏀": "篮球",
+    "🙏": "祈祷",
+    "👌": "OK",
+    "🧨": "鞭炮",
+    "🏮": "灯笼",
+    "🍌": "香蕉",
+    "✈": "飞机",
+    "💰": "钞票",
+    "🐼": "熊猫",
+    "💡": "灯泡",
+    "⏰": "闹钟",
+    "💊": "药",
+    "🐸": "青蛙",
+    "🍵": "茶",
+    "👻": "幽灵",
+    "🥚": "蛋",
+    "🧧": "红包",
+    "🎉": "庆祝",
+    "❌": "❌",
+    "✔": "✔️",
+    "🎆": "烟花",
+    "🌈": "彩虹",
+    "🎲": "骰子",
+}
+"""Unicode 表情: 对应的 QQ 表情名称，不含变体选择符"""
+
+unicode_emoji_ids = {
+    char: qq_emoji_ids[emoji_name] for char, emoji_name in unicode_emoji_names.items()
+}
+"""Unicode 表情: QQ 表情 id"""
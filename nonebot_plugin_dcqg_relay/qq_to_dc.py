@@ -1,100 +1,252 @@
 import asyncio
+from contextlib import AsyncExitStack
+from functools import partial
 import re
 from typing import Optional
 
-import filetype
+import aiohttp
 from nonebot import logger
 from nonebot.adapters.discord import Bot as dc_Bot
-from nonebot.adapters.discord.api import UNSET, Embed, EmbedAuthor, File, MessageGet
-from nonebot.adapters.discord.exception import NetworkError
+from nonebot.adapters.discord.api import (
+    UNSET,
+    Embed,
+    EmbedAuthor,
+    EmbedImage,
+    File,
+    MessageGet,
+)
+from nonebot.adapters.discord.exception import ActionFailed, NetworkError
 from nonebot.adapters.qq import (
     Bot as qq_Bot,
     GuildMessageEvent as qq_GuildMessageEvent,
     MessageDeleteEvent as qq_MessageDeleteEvent,
 )
-from nonebot.adapters.qq.models import Message as qq_Message, MessageReference
+from nonebot.adapters.qq.models import Member as qq_Member, User as qq_User
 from nonebot_plugin_orm import get_session
-from sqlalchemy import select
+from pydantic import BaseModel
+from sqlalchemy import delete, select
+from yarl import URL
 
-from .config import LinkWithWebhook
+from .bots import BotNotFound, use_dc_bot, use_qq_bot
+from .budget import convert_media, with_media_budget
+from .cache import TTLCache
+from .cluster import link_key
+from .coalesce import coalesce, coalesce_window, send_now
+from .config import LinkWithWebhook, plugin_config
+from .deadline import DeadlineExceeded, sleep_before_retry, with_deadline
+from .media import (
+    DC_FILE_MAX_BYTES,
+    DC_IMAGE_FORMATS,
+    DC_IMAGE_MAX_BYTES,
+    decoded_size,
+    optimize_image,
+)
 from .model import MsgID
+from .outbox import add_to_outbox, outbox_enabled, outbox_handler
 from .qq_emoji_dict import qq_emoji_dict
-from .utils import get_dc_member_name, get_file_bytes
+from .stats import record_deadline_miss, record_retry, track_relay
+from .stream import (
+    FileTooLarge,
+    MediaSource,
+    format_size,
+    open_media,
+    stream_to_discord,
+)
+from .trace import add_destinations, add_retry, add_sources, fail_trace, span
+from .utils import (
+    add_relayed_message,
+    delete_relayed_messages,
+    get_dc_member_name,
+)
+
+image_passthrough = plugin_config.dcqg_relay_image_passthrough
+
+DC_MAX_EMBEDS = 10
+"""Discord 单条消息最多 embed 数"""
+DC_MAX_CONTENT_LENGTH = 2000
+"""Discord 单条消息最大字数"""
+SENT_MESSAGE = "message"
+"""payload.sent 中表示带有文字、图片与 embed 的消息已经发出"""
+
+qq_member_names: TTLCache[tuple[str, str], str] = TTLCache(
+    plugin_config.dcqg_relay_member_cache_ttl, name="qq_member_names"
+)
+"""QQ频道成员名缓存，键为 (guild_id, user_id)"""
+dc_member_avatars: TTLCache[tuple[int, int], str] = TTLCache(
+    plugin_config.dcqg_relay_member_cache_ttl, name="dc_member_avatars"
+)
+"""Discord 成员头像地址缓存，键为 (guild_id, user_id)"""
+qq_bot_users: dict[str, qq_User] = {}
+"""QQ bot 自身的用户信息，bot 连接时获取"""
+
+
+class QQReply(BaseModel):
+    """QQ 消息回复的部分"""
+
+    message_id: str
+    """被回复的消息 id"""
+    author_id: str
+    guild_id: str
+    content: str = ""
+    timestamp: Optional[int] = None
+
+
+class QQToDCPayload(BaseModel):
+    """整理后的 QQ 转 discord 消息"""
+
+    qq_message_ids: list[str]
+    """合并发送时包含多条 QQ 消息"""
+    text: str
+    img_list: list[str]
+    username: str
+    avatar_url: Optional[str] = None
+    reply: Optional[QQReply] = None
+    sent: list[str] = []
+    """已经发出的部分（SENT_MESSAGE 与文件地址），发件箱重试时跳过"""
 
 
 async def get_qq_member_name(bot: qq_Bot, guild_id: str, user_id: str) -> str:
+    if (name := qq_member_names.get((guild_id, user_id))) is not None:
+        return name
     member = await bot.get_member(guild_id=guild_id, user_id=user_id)
-    return member.nick or (member.user.username if member.user else "") or ""
+    name = member.nick or (member.user.username if member.user else "") or ""
+    qq_member_names.set((guild_id, user_id), name)
+    return name
 
 
 async def get_dc_member_avatar(bot: dc_Bot, guild_id: int, user_id: int) -> str:
+    if (url := dc_member_avatars.get((guild_id, user_id))) is not None:
+        return url
     member = await bot.get_guild_member(guild_id=guild_id, user_id=user_id)
     if member.avatar is not UNSET and (avatar := member.avatar):
-        return (
+        url = (
             f"https://cdn.discordapp.com/guilds/{guild_id}/users/{user_id}/avatars/{avatar}."
             + ("gif" if re.match(r"^a_.*", avatar) else "webp")
         )
     elif (user := member.user) and user is not UNSET and user.avatar:
-        return f"https://cdn.discordapp.com/avatars/{user_id}/{user.avatar}." + (
+        url = f"https://cdn.discordapp.com/avatars/{user_id}/{user.avatar}." + (
             "gif" if re.match(r"^a_.*", user.avatar) else "webp"
         )
     else:
-        return ""
+        url = ""
+    dc_member_avatars.set((guild_id, user_id), url)
+    return url
 
 
 async def build_dc_file(url: str) -> File:
     """获取图片文件，用于发送到 Discord"""
-    img_bytes = await get_file_bytes(url)
-    match = filetype.match(img_bytes)
-    kind = match.extension if match else "dat"
+    async with open_media(url) as source:
+        return await read_dc_file(source)
+
+
+async def read_dc_file(source: MediaSource) -> File:
+    """读取已开始下载的图片，用于发送到 Discord"""
+    url = source.url
+    img_bytes = await source.read()
+    img_bytes, kind = await convert_media(
+        partial(optimize_image, formats=DC_IMAGE_FORMATS, max_bytes=DC_IMAGE_MAX_BYTES),
+        img_bytes,
+        decoded_size,
+    )
     return File(content=img_bytes, filename=f"{url.split('/')[-1]!s}.{kind}")
 
 
+async def get_qq_bot_me(bot: qq_Bot) -> qq_User:
+    """获取 QQ bot 自身的用户信息，只在第一次调用时请求"""
+    if (me := qq_bot_users.get(bot.self_id)) is None:
+        me = qq_bot_users[bot.self_id] = await bot.me()
+    return me
+
+
+async def get_dc_reference_message(
+    dc_bot: dc_Bot, channel_id: int, qq_message_id: str
+) -> Optional[MessageGet]:
+    """获取 QQ 消息对应的 discord 消息"""
+    async with get_session() as session:
+        reference_id = await session.scalar(
+            select(MsgID.dcid).filter(MsgID.qqid == qq_message_id).limit(1)
+        )
+    if not reference_id:
+        return None
+    return await dc_bot.get_channel_message(
+        channel_id=channel_id, message_id=reference_id
+    )
+
+
+def media_url(img: str) -> str:
+    return img if "://" in img else f"https://{img}"
+
+
+def pick_passthrough_images(
+    images: dict[str, MediaSource], max_embeds: int
+) -> dict[str, str]:
+    """从已判断类型的图片中挑选可以直接用 URL 放进 embed 的图片，返回 {原地址: 直链}"""
+    passthrough: dict[str, str] = {}
+    for img, source in images.items():
+        if len(passthrough) >= max_embeds:
+            break
+        url = URL(source.url)
+        if url.scheme in ("http", "https") and url.host:
+            passthrough[img] = str(url)
+    return passthrough
+
+
+async def get_qq_reply_member(reply: QQReply, link: LinkWithWebhook) -> qq_Member:
+    async with use_qq_bot(link.qq_guild_id) as bot:
+        return await bot.get_member(guild_id=reply.guild_id, user_id=reply.author_id)
+
+
 async def build_dc_embeds(
-    bot: qq_Bot,
-    dc_bot: dc_Bot,
-    reference: MessageReference,
-    reply: qq_Message,
-    link: LinkWithWebhook,
+    dc_bot: dc_Bot, reply: QQReply, link: LinkWithWebhook
 ) -> list[Embed]:
-    """处理 QQ 转 discord 中的回复部分"""
+    """
+    处理 QQ 转 discord 中的回复部分；
+    QQ 请求各自选择 QQ bot，失败时不会算作 discord bot 的失败，反之亦然
+    """
     guild_id, channel_id = link.dc_guild_id, link.dc_channel_id
 
     author = ""
-    timestamp = f"<t:{int(reply.timestamp.timestamp())}:R>" if reply.timestamp else ""
+    timestamp = f"<t:{reply.timestamp}:R>" if reply.timestamp else ""
 
-    async with get_session() as session:
-        if reference_id := await session.scalar(
-            select(MsgID.dcid).filter(MsgID.qqid == reference.message_id).limit(1)
-        ):
-            dc_message = await dc_bot.get_channel_message(
-                channel_id=channel_id, message_id=reference_id
-            )
-            if reply.author.id == (await bot.me()).id:
-                name, _ = await get_dc_member_name(
-                    dc_bot, guild_id, dc_message.author.id
-                )
-                author = EmbedAuthor(
-                    name=name + f"(@{dc_message.author.username})",
-                    icon_url=await get_dc_member_avatar(
-                        dc_bot, guild_id, dc_message.author.id
-                    ),
-                )
-                timestamp = f"<t:{int(dc_message.timestamp.timestamp())}:R>"
+    # 被回复的消息可能由其他 QQ bot 转发
+    async with use_qq_bot(link.qq_guild_id) as bot:
+        await get_qq_bot_me(bot)
+    is_relayed = any(reply.author_id == me.id for me in qq_bot_users.values())
+    if is_relayed:
+        dc_message = await get_dc_reference_message(
+            dc_bot, channel_id, reply.message_id
+        )
+        member = None
+    else:
+        dc_message, member = await asyncio.gather(
+            get_dc_reference_message(dc_bot, channel_id, reply.message_id),
+            get_qq_reply_member(reply, link),
+        )
 
-            description = (
-                f"{dc_message.content}\n\n"
-                + timestamp
-                + f"[[ ↑ ]](https://discord.com/channels/{guild_id}/{channel_id}/{reference_id})"
+    if dc_message:
+        if is_relayed:
+            (name, _), avatar = await asyncio.gather(
+                get_dc_member_name(dc_bot, guild_id, dc_message.author.id),
+                get_dc_member_avatar(dc_bot, guild_id, dc_message.author.id),
             )
-        else:
-            description = f"{reply.content}\n\n" + timestamp + "[ ? ]"
+            author = EmbedAuthor(
+                name=name + f"(@{dc_message.author.username})", icon_url=avatar
+            )
+            timestamp = f"<t:{int(dc_message.timestamp.timestamp())}:R>"
+
+        description = (
+            f"{dc_message.content}\n\n"
+            + timestamp
+            + f"[[ ↑ ]](https://discord.com/channels/{guild_id}/{channel_id}/{dc_message.id})"
+        )
+    else:
+        description = f"{reply.content}\n\n" + timestamp + "[ ? ]"
 
     if not author:
-        member = await bot.get_member(guild_id=reply.guild_id, user_id=reply.author.id)
+        member = member or await get_qq_reply_member(reply, link)
         author = EmbedAuthor(
             name=(member.nick or (member.user.username if member.user else "") or "")
-            + f"[ID:{reply.author.id}]",
+            + f"[ID:{reply.author_id}]",
             icon_url=(member.user.avatar if member.user else "") or "",
         )
 
@@ -111,34 +263,49 @@ async def build_dc_message(
     bot: qq_Bot, event: qq_GuildMessageEvent
 ) -> tuple[str, list[str]]:
     """获取 QQ 消息，用于发送到 discord"""
-    text = ""
+    text: list[str] = []
     img_list: list[str] = []
-    for msg in event.get_message():
+    message = event.get_message()
+    mention_ids = list(
+        dict.fromkeys(
+            msg.data["user_id"] for msg in message if msg.type == "mention_user"
+        )
+    )
+    mention_names = dict(
+        zip(
+            mention_ids,
+            await asyncio.gather(
+                *(
+                    get_qq_member_name(bot, event.guild_id, user_id)
+                    for user_id in mention_ids
+                )
+            ),
+        )
+    )
+    for msg in message:
         if msg.type == "text":
             # 文本
-            text += (
+            text.append(
                 str(msg.data["text"])
                 .replace("@everyone", "@.everyone")
                 .replace("@here", "@.here")
             )
         elif msg.type == "emoji":
             # 表情
-            text += (
+            text.append(
                 f"[{qq_emoji_dict.get(msg.data['id'], 'QQemojiID:' + msg.data['id'])}]"
             )
         elif msg.type == "mention_user":
             # @人
-            text += (
-                f"@{await get_qq_member_name(bot, event.guild_id, msg.data['user_id'])}"
-                + f"[ID:{msg.data['user_id']}]"
-                + " "
-            )
+            user_id = msg.data["user_id"]
+            text.append(f"@{mention_names[user_id]}[ID:{user_id}] ")
         elif msg.type == "image":
             # 图片
             img_list.append(msg.data["url"])
-    return text, img_list
+    return "".join(text), img_list
 
 
+@with_media_budget
 async def send_to_discord(
     bot: dc_Bot,
     webhook_id: int,
@@ -148,85 +315,291 @@ async def send_to_discord(
     embed: Optional[list[Embed]],
     username: Optional[str],
     avatar_url: Optional[str],
-) -> MessageGet:
-    """用 webhook 发送到 discord"""
-    if img_list:
-        get_img_tasks = [build_dc_file(img) for img in img_list]
-        files = await asyncio.gather(*get_img_tasks)
-    else:
-        files = None
+    sent: list[str],
+    sends: list[MessageGet],
+):
+    """
+    用 webhook 发送到 discord，图片以外的文件在之后逐个流式上传；
+    发出的消息加入 sends，已经发出的部分记录在 sent 中，重试时跳过
+    """
+    img_list = [img for img in img_list or [] if img not in sent]
+    async with AsyncExitStack() as stack:
+        opened = await with_deadline(
+            asyncio.gather(
+                *(
+                    stack.enter_async_context(open_media(media_url(img)))
+                    for img in img_list
+                ),
+                return_exceptions=True,
+            ),
+            "open_media",
+        )
+        if errors := [e for e in opened if isinstance(e, BaseException)]:
+            raise errors[0]
+        sources = {
+            img: source
+            for img, source in zip(img_list, opened)
+            if isinstance(source, MediaSource)
+        }
+        # 按判断后的类型挑选直链图片，视频等文件不能放进 embed
+        images = {img: source for img, source in sources.items() if source.is_image}
+        passthrough: dict[str, str] = {}
+        if image_passthrough:
+            passthrough = pick_passthrough_images(
+                images, DC_MAX_EMBEDS - len(embed or [])
+            )
+        files = await with_deadline(
+            asyncio.gather(
+                *(
+                    read_dc_file(source)
+                    for img, source in images.items()
+                    if img not in passthrough
+                )
+            ),
+            "build_dc_file",
+        )
+        streams: dict[str, MediaSource] = {}
+        too_large: list[str] = []
+        for img, source in sources.items():
+            if source.is_image:
+                continue
+            if source.size is not None and source.size > DC_FILE_MAX_BYTES:
+                text = (text or "") + (
+                    f"\n[文件过大：{source.filename}，{format_size(source.size)}]"
+                )
+                too_large.append(img)
+            else:
+                streams[img] = source
+
+        if SENT_MESSAGE not in sent and (
+            text or files or embed or passthrough or not streams
+        ):
+            sends.append(
+                await send_webhook_message(
+                    bot,
+                    webhook_id,
+                    token,
+                    text,
+                    files or None,
+                    embed,
+                    passthrough,
+                    username,
+                    avatar_url,
+                )
+            )
+            sent.extend([SENT_MESSAGE, *images, *too_large])
+        for img, source in streams.items():
+            try:
+                sends.append(
+                    await with_deadline(
+                        stream_to_discord(
+                            bot, webhook_id, token, source, username, avatar_url
+                        ),
+                        "stream_to_discord",
+                    )
+                )
+            except (FileTooLarge, aiohttp.ClientError) as e:
+                logger.warning(f"send_to_discord() stream {source.filename} error: {e}")
+                continue
+            sent.append(img)
 
+
+async def send_webhook_message(
+    bot: dc_Bot,
+    webhook_id: int,
+    token: str,
+    text: Optional[str],
+    files: Optional[list[File]],
+    embed: Optional[list[Embed]],
+    passthrough: dict[str, str],
+    username: Optional[str],
+    avatar_url: Optional[str],
+) -> MessageGet:
     try_times = 1
     while True:
         try:
-            send = await bot.execute_webhook(
-                webhook_id=webhook_id,
-                token=token,
-                content=text or "",
-                files=files,
-                embeds=embed,
-                username=username,
-                avatar_url=avatar_url,
-                wait=True,
+            send = await with_deadline(
+                bot.execute_webhook(
+                    webhook_id=webhook_id,
+                    token=token,
+                    content=text or "",
+                    files=files,
+                    embeds=[
+                        *(embed or []),
+                        *(
+                            Embed(image=EmbedImage(url=url))
+                            for url in passthrough.values()
+                        ),
+                    ]
+                    or None,
+                    username=username,
+                    avatar_url=avatar_url,
+                    wait=True,
+                ),
+                "execute_webhook",
             )
             break
+        except ActionFailed as e:
+            if not passthrough:
+                raise e
+            logger.warning(f"send_to_discord() image passthrough failed: {e}")
+            add_retry("execute_webhook", e)
+            files = [
+                *(files or []),
+                *await with_deadline(
+                    asyncio.gather(
+                        *(build_dc_file(url) for url in passthrough.values())
+                    ),
+                    "build_dc_file",
+                ),
+            ]
+            passthrough = {}
         except NetworkError as e:
             logger.warning(f"send_to_discord() error: {e}, retry {try_times}")
             if try_times == 3:
                 raise e
             try_times += 1
-            await asyncio.sleep(5)
+            await sleep_before_retry(5, "send_to_discord", e)
     return send
 
 
-async def create_qq_to_dc(
-    bot: qq_Bot,
-    event: qq_GuildMessageEvent,
-    dc_bot: dc_Bot,
-    link: LinkWithWebhook,
-):
-    """QQ 消息转发到 discord"""
-    logger.debug("into create_qq_to_dc()")
+async def build_qq_to_dc_payload(
+    bot: qq_Bot, event: qq_GuildMessageEvent
+) -> QQToDCPayload:
+    """整理 QQ 消息中需要转发的内容"""
     text, img_list = await build_dc_message(bot, event)
+    reply = None
+    if (reply_message := event.reply) and (reference := event.message_reference):
+        reply = QQReply(
+            message_id=reference.message_id,
+            author_id=reply_message.author.id,
+            guild_id=reply_message.guild_id,
+            content=reply_message.content or "",
+            timestamp=(
+                int(reply_message.timestamp.timestamp())
+                if reply_message.timestamp
+                else None
+            ),
+        )
+    return QQToDCPayload(
+        qq_message_ids=[event.id],
+        text=text,
+        img_list=img_list,
+        username=f"{event.author.username} [ID:{event.author.id}]",
+        avatar_url=event.author.avatar,
+        reply=reply,
+    )
 
-    if (reply := event.reply) and (reference := event.message_reference):
-        embeds = await build_dc_embeds(bot, dc_bot, reference, reply, link)
-    else:
-        embeds = None
-
-    username = f"{event.author.username} [ID:{event.author.id}]"
-    avatar = event.author.avatar
 
-    try_times = 1
-    while True:
+@outbox_handler("qq_to_dc", QQToDCPayload)
+@track_relay
+async def send_qq_to_dc(payload: QQToDCPayload, link: LinkWithWebhook):
+    """发送 QQ 转 discord 的消息，并记录消息 id"""
+    add_sources(*payload.qq_message_ids)
+    async with use_dc_bot(link.dc_guild_id) as dc_bot:
+        if payload.reply:
+            embeds = await with_deadline(
+                build_dc_embeds(dc_bot, payload.reply, link), "build_dc_embeds"
+            )
+        else:
+            embeds = None
+        sends: list[MessageGet] = []
         try:
-            send = await send_to_discord(
+            await send_to_discord(
                 dc_bot,
                 link.webhook_id,
                 link.webhook_token,
-                text,
-                img_list,
+                payload.text,
+                payload.img_list,
                 embeds,
-                username,
-                avatar,
+                payload.username,
+                payload.avatar_url,
+                payload.sent,
+                sends,
             )
+        finally:
+            # 中途放弃时也记录已发送的消息，以便之后撤回
+            if sends:
+                add_destinations(*(send.id for send in sends))
+                for send in sends:
+                    add_relayed_message(send.id)
+                with span("commit MsgID"):
+                    async with get_session() as session:
+                        session.add_all(
+                            MsgID(dcid=send.id, qqid=qqid)
+                            for send in sends
+                            for qqid in payload.qq_message_ids
+                        )
+                        await session.commit()
+
+
+def merge_qq_to_dc_payloads(
+    first: QQToDCPayload, second: QQToDCPayload
+) -> Optional[QQToDCPayload]:
+    """合并同一作者的两条纯文本消息，超出 discord 长度限制时返回 None"""
+    text = first.text + "\n" + second.text
+    if len(text) > DC_MAX_CONTENT_LENGTH:
+        return None
+    return QQToDCPayload(
+        qq_message_ids=first.qq_message_ids + second.qq_message_ids,
+        text=text,
+        img_list=[],
+        username=second.username,
+        avatar_url=second.avatar_url,
+    )
+
+
+async def relay_qq_to_dc(payload: QQToDCPayload, link: LinkWithWebhook):
+    add_sources(*payload.qq_message_ids)
+    if outbox_enabled:
+        await add_to_outbox(link, "qq_to_dc", payload)
+        logger.debug("relay_qq_to_dc(): added to outbox")
+        return
+
+    try_times = 1
+    while True:
+        try:
+            await send_qq_to_dc(payload, link)
             break
-        except NameError as e:
-            logger.warning(f"create_qq_to_dc() error: {e}, retry {try_times}")
+        except BotNotFound as e:
+            logger.warning(f"relay_qq_to_dc() error: {e}, retry {try_times}")
             if try_times == 3:
                 raise e
+            record_retry(link)
             try_times += 1
-            await asyncio.sleep(5)
+            await sleep_before_retry(5, "relay_qq_to_dc", e)
+        except DeadlineExceeded as e:
+            logger.warning(f"relay_qq_to_dc(): drop stale message: {e}")
+            record_deadline_miss(link)
+            fail_trace(e)
+            break
 
-    async with get_session() as session:
-        session.add(MsgID(dcid=send.id, qqid=event.id))
-        await session.commit()
+
+async def create_qq_to_dc(
+    bot: qq_Bot,
+    event: qq_GuildMessageEvent,
+    link: LinkWithWebhook,
+):
+    """QQ 消息转发到 discord"""
+    logger.debug("into create_qq_to_dc()")
+    payload = await with_deadline(
+        build_qq_to_dc_payload(bot, event), "build_qq_to_dc_payload"
+    )
+    key = ("qq_to_dc", link_key(link), str(event.author.id))
+    if not coalesce_window:
+        await relay_qq_to_dc(payload, link)
+    elif not payload.img_list and payload.reply is None:
+        await coalesce(
+            key, payload, merge_qq_to_dc_payloads, partial(relay_qq_to_dc, link=link)
+        )
+    else:
+        # 同一作者之前等待合并的消息需要先发出
+        await send_now(key, partial(relay_qq_to_dc, payload, link))
     logger.debug("finish create_qq_to_dc()")
 
 
 async def delete_qq_to_dc(
     event: qq_MessageDeleteEvent,
-    dc_bot: dc_Bot,
     link: LinkWithWebhook,
     just_delete: list,
 ):
@@ -238,21 +611,38 @@ async def delete_qq_to_dc(
     while True:
         try:
             async with get_session() as session:
-                if msgids := await session.scalars(
-                    select(MsgID).filter(MsgID.qqid == event.message.id)
-                ):
-                    for msgid in msgids:
-                        await dc_bot.delete_message(
-                            message_id=msgid.dcid, channel_id=link.dc_channel_id
+                result = await with_deadline(
+                    session.execute(
+                        select(MsgID.id, MsgID.dcid).filter(
+                            MsgID.qqid == event.message.id
+                        )
+                    ),
+                    "select MsgID",
+                )
+                rows = result.tuples().all()
+            if rows:
+                async with use_dc_bot(link.dc_guild_id) as dc_bot:
+                    deleted = await with_deadline(
+                        delete_relayed_messages(
+                            rows,
+                            partial(
+                                dc_bot.delete_message, channel_id=link.dc_channel_id
+                            ),
+                            just_delete,
+                        ),
+                        "delete_relayed_messages",
+                    )
+                if deleted:
+                    async with get_session() as session:
+                        await session.execute(
+                            delete(MsgID).where(MsgID.id.in_(deleted))
                         )
-                        just_delete.append(msgid.dcid)
-                        await session.delete(msgid)
-                    await session.commit()
+                        await session.commit()
             logger.debug("finish delete_qq_to_dc()")
             break
-        except (UnboundLocalError, TypeError, NameError) as e:
+        except (UnboundLocalError, TypeError, BotNotFound) as e:
             logger.warning(f"delete_qq_to_dc() error: {e}, retry {try_times}")
             if try_times == 3:
                 raise e
             try_times += 1
-            await asyncio.sleep(5)
+            await sleep_before_retry(5, "delete_qq_to_dc", e)
@@ -0,0 +1,133 @@
+import asyncio
+from pathlib import Path
+from typing import Optional, Union
+
+from nonebot import logger
+from nonebot.compat import model_dump, type_validate_json
+
+from . import utils
+from .bots import BotNotFound, use_dc_bot
+from .cluster import link_key
+from .coalesce import flush_all_bursts
+from .config import LinkWithWebhook, LinkWithoutWebhook, plugin_config
+from .outbox import drain_links, outbox_enabled
+
+links_file = plugin_config.dcqg_relay_links_file
+
+LINKS_FILE_POLL_INTERVAL = 5
+"""检查 link 文件是否修改的间隔（秒）"""
+
+watcher_task: Optional[asyncio.Task] = None
+reload_lock: Optional[asyncio.Lock] = None
+
+
+def get_mtime(path: Path) -> Optional[float]:
+    return path.stat().st_mtime if path.exists() else None
+
+
+def load_links_file(path: Path) -> list[LinkWithoutWebhook]:
+    return type_validate_json(list[LinkWithoutWebhook], path.read_text("utf-8"))
+
+
+async def provision_link(link: LinkWithoutWebhook) -> Union[LinkWithWebhook, int]:
+    try:
+        async with use_dc_bot(link.dc_guild_id) as bot:
+            return await utils.get_webhook(bot, link)
+    except BotNotFound as e:
+        logger.error(
+            f"get webhook error, Discord channel id: {link.dc_channel_id}: {e}"
+        )
+        return link.dc_channel_id
+
+
+async def apply_links(
+    links: list[LinkWithoutWebhook],
+) -> tuple[list[str], list[str], list[int]]:
+    """
+    替换当前的 link：只为新增的 link 获取 webhook，整体替换索引，
+    并在移除 link 前发送它们尚未发送的消息
+
+    返回 (新增的 link, 移除的 link, 获取 webhook 失败的 Discord 频道)
+    """
+    old_links = {link_key(link): link for link in utils.with_webhook_links}
+    new_keys = {link_key(link) for link in links}
+    removed = set(old_links) - new_keys
+
+    kept: list[LinkWithWebhook] = []
+    added: list[LinkWithoutWebhook] = []
+    for link in links:
+        if (old := old_links.get(link_key(link))) is None:
+            added.append(link)
+            continue
+        kept.append(
+            LinkWithWebhook(
+                **model_dump(link, exclude={"webhook_id", "webhook_token"}),
+                webhook_id=old.webhook_id,
+                webhook_token=old.webhook_token,
+            )
+        )
+    provisioned = await asyncio.gather(*(provision_link(link) for link in added))
+    failed = [result for result in provisioned if isinstance(result, int)]
+    new_links = kept + [
+        result for result in provisioned if isinstance(result, LinkWithWebhook)
+    ]
+
+    utils.without_webhook_links = links
+    # 先停止接收被移除 link 的消息，发送完积压的消息后再移除
+    utils.build_link_index(new_links)
+    utils.with_webhook_links = new_links + [old_links[key] for key in removed]
+    if removed:
+        await flush_all_bursts(removed)
+        if outbox_enabled:
+            await drain_links(removed)
+    utils.with_webhook_links = new_links
+
+    added_keys = [link_key(link) for link in added]
+    logger.info(
+        f"links reloaded: {len(new_links)} links, added {added_keys}, "
+        + f"removed {sorted(removed)}, failed {failed}"
+    )
+    return added_keys, sorted(removed), failed
+
+
+async def reload_links() -> tuple[list[str], list[str], list[int]]:
+    """从 link 文件重新加载 link"""
+    global reload_lock
+    if links_file is None:
+        raise FileNotFoundError("dcqg_relay_links_file is not set")
+    if reload_lock is None:
+        reload_lock = asyncio.Lock()
+    async with reload_lock:
+        links = await asyncio.to_thread(load_links_file, links_file)
+        return await apply_links(links)
+
+
+async def watch_links_file(path: Path, mtime: Optional[float]):
+    """后台任务：link 文件修改后自动重新加载"""
+    while True:
+        await asyncio.sleep(LINKS_FILE_POLL_INTERVAL)
+        try:
+            new_mtime = await asyncio.to_thread(get_mtime, path)
+            if new_mtime is None or new_mtime == mtime:
+                continue
+            mtime = new_mtime
+            await reload_links()
+        except Exception as e:
+            logger.error(f"reload links error: {e}")
+
+
+async def start_links_watcher():
+    """启动时从 link 文件读取 link，webhook 在 Discord bot 连接后获取"""
+    global watcher_task
+    if links_file is None or watcher_task is not None:
+        return
+    if (mtime := get_mtime(links_file)) is not None:
+        utils.without_webhook_links = load_links_file(links_file)
+    watcher_task = asyncio.create_task(watch_links_file(links_file, mtime))
+
+
+async def stop_links_watcher():
+    global watcher_task
+    if watcher_task is not None:
+        watcher_task.cancel()
+        watcher_task = None
@@ -0,0 +1,123 @@
+import asyncio
+import base64
+import json
+from pathlib import Path
+from typing import Any
+
+from nonebot import logger
+import nonebot_plugin_localstore as store
+
+from .cache import caches
+from .config import plugin_config
+
+cache_snapshot = plugin_config.dcqg_relay_cache_snapshot
+
+SNAPSHOT_VERSION = 1
+
+
+def get_snapshot_path() -> Path:
+    return store.get_plugin_data_dir() / "caches.json"
+
+
+def encode_item(item: Any) -> Any:
+    """将缓存的键和值转换为 JSON：tuple 转为列表，bytes 转为 base64"""
+    if isinstance(item, tuple):
+        return [encode_item(i) for i in item]
+    if isinstance(item, bytes):
+        return {"bytes": base64.b64encode(item).decode()}
+    if item is None or isinstance(item, (str, int, float)):
+        return item
+    raise TypeError(f"unsupported cache item type: {type(item).__name__}")
+
+
+def decode_item(item: Any) -> Any:
+    """encode_item 的逆变换，列表还原为 tuple"""
+    if isinstance(item, list):
+        return tuple(decode_item(i) for i in item)
+    if isinstance(item, dict):
+        return base64.b64decode(item["bytes"], validate=True)
+    return item
+
+
+def write_snapshot(path: Path, snapshot: dict[str, Any]):
+    """先写入临时文件再替换，避免中途退出留下不完整的文件"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_suffix(".tmp")
+    temp.write_text(
+        json.dumps(
+            {
+                "version": snapshot["version"],
+                "caches": {
+                    name: [
+                        [encode_item(key), expire_at, encode_item(value)]
+                        for key, expire_at, value in items
+                    ]
+                    for name, items in snapshot["caches"].items()
+                },
+            },
+            ensure_ascii=False,
+        ),
+        encoding="utf-8",
+    )
+    temp.replace(path)
+
+
+def read_snapshot(path: Path) -> dict[str, Any]:
+    if not path.exists():
+        return {}
+    snapshot = json.loads(path.read_text(encoding="utf-8"))
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return {}
+    return {
+        "version": SNAPSHOT_VERSION,
+        "caches": {
+            name: [
+                (decode_item(key), float(expire_at), decode_item(value))
+                for key, expire_at, value in items
+            ]
+            for name, items in snapshot["caches"].items()
+        },
+    }
+
+
+async def save_caches():
+    """将有名字的缓存中未过期的项写入快照文件"""
+    if not cache_snapshot:
+        return
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "caches": {name: cache.snapshot() for name, cache in caches.items()},
+    }
+    try:
+        await asyncio.to_thread(write_snapshot, get_snapshot_path(), snapshot)
+    except Exception as e:
+        logger.error(f"save cache snapshot error: {e}")
+        return
+    logger.info(
+        "cache snapshot saved: "
+        + ", ".join(
+            f"{name} {len(items)}" for name, items in snapshot["caches"].items()
+        )
+    )
+
+
+async def load_caches():
+    """从快照文件恢复缓存，已过期的项不恢复"""
+    if not cache_snapshot:
+        return
+    try:
+        snapshot = await asyncio.to_thread(read_snapshot, get_snapshot_path())
+    except Exception as e:
+        logger.warning(f"load cache snapshot error: {e}")
+        return
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return
+    restored = {
+        name: caches[name].restore(items)
+        for name, items in snapshot["caches"].items()
+        if name in caches
+    }
+    logger.info(
+        "cache snapshot restored: "
+        + ", ".join(f"{name} {count}" for name, count in restored.items())
+    )
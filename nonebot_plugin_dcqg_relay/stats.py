@@ -0,0 +1,233 @@
+from collections import Counter, defaultdict
+from collections.abc import Awaitable
+from functools import wraps
+import json
+import secrets
+import time
+from typing import Any, Callable, Optional, TypeVar
+
+from nonebot import get_driver, logger
+from nonebot.drivers import URL, ASGIMixin, HTTPServerSetup, Request, Response
+from nonebot_plugin_orm import get_session
+from sqlalchemy import func, select
+
+from . import audit, bots, cluster, coalesce, utils
+from .budget import media_budget
+from .cache import caches
+from .config import Link, LinkWithWebhook, plugin_config
+from .deadline import DeadlineExceeded
+from .model import MsgID, Outbox
+
+status_path = plugin_config.dcqg_relay_status_path
+status_token = plugin_config.dcqg_relay_status_token
+
+MSGID_COUNT_TTL = 300
+"""消息 ID 表行数的缓存时间（秒），避免每次请求都扫描整张表"""
+
+T_Payload = TypeVar("T_Payload")
+
+
+class LinkStats:
+    """一个 link 的转发统计"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.dropped = 0
+        self.deadline_misses = 0
+        self.last_success_at: Optional[float] = None
+        self.last_failure_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+
+link_stats: defaultdict[str, LinkStats] = defaultdict(LinkStats)
+"""link key: 转发统计"""
+
+
+class TransferStats:
+    """流式转发文件的统计"""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+
+transfer_stats: defaultdict[str, TransferStats] = defaultdict(TransferStats)
+"""发送方向: 流式转发统计"""
+msgid_count: Optional[tuple[int, float]] = None
+"""(消息 ID 表的行数, 统计时间)"""
+
+
+def get_link_stats(link: Link) -> LinkStats:
+    return link_stats[cluster.link_key(link)]
+
+
+def record_retry(link: Link):
+    get_link_stats(link).retries += 1
+
+
+def record_drop(link: Link):
+    get_link_stats(link).dropped += 1
+
+
+def record_deadline_miss(link: Link):
+    get_link_stats(link).deadline_misses += 1
+
+
+def record_transfer(direction: str, size: int, seconds: float):
+    stats = transfer_stats[direction]
+    stats.files += 1
+    stats.bytes += size
+    stats.seconds += seconds
+
+
+def track_relay(
+    func: Callable[[T_Payload, LinkWithWebhook], Awaitable[None]],
+) -> Callable[[T_Payload, LinkWithWebhook], Awaitable[None]]:
+    """记录发送函数的进行数、成功与失败，超过截止时间不计为失败"""
+
+    @wraps(func)
+    async def wrapper(payload: T_Payload, link: LinkWithWebhook):
+        stats = get_link_stats(link)
+        stats.in_flight += 1
+        try:
+            await func(payload, link)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            stats.failures += 1
+            stats.last_failure_at = time.time()
+            stats.last_error = repr(e)
+            raise
+        else:
+            stats.successes += 1
+            stats.last_success_at = time.time()
+        finally:
+            stats.in_flight -= 1
+
+    return wrapper
+
+
+async def count_msgids() -> int:
+    global msgid_count
+    now = time.time()
+    if msgid_count is None or now - msgid_count[1] > MSGID_COUNT_TTL:
+        async with get_session() as session:
+            count = await session.scalar(select(func.count()).select_from(MsgID))
+        msgid_count = (count or 0, now)
+    return msgid_count[0]
+
+
+async def collect_status() -> dict[str, Any]:
+    async with get_session() as session:
+        result = await session.execute(
+            select(Outbox.link_key, func.count()).group_by(Outbox.link_key)
+        )
+        outbox_depth = dict(result.tuples().all())
+    burst_depth = Counter(key[1] for key in coalesce.pending_bursts)
+    ready = {cluster.link_key(link) for link in utils.with_webhook_links}
+
+    links = []
+    for link in utils.without_webhook_links:
+        key = cluster.link_key(link)
+        stats = link_stats.get(key) or LinkStats()
+        links.append(
+            {
+                "link": key,
+                "qq_channel_id": link.qq_channel_id,
+                "dc_channel_id": link.dc_channel_id,
+                "webhook_ready": key in ready,
+                "owned": not cluster.worker_id or key in cluster.owned_links,
+                "queue_depth": outbox_depth.get(key, 0) + burst_depth[key],
+                "in_flight": stats.in_flight,
+                "successes": stats.successes,
+                "failures": stats.failures,
+                "retries": stats.retries,
+                "dropped": stats.dropped,
+                "deadline_misses": stats.deadline_misses,
+                "last_success_at": stats.last_success_at,
+                "last_failure_at": stats.last_failure_at,
+                "last_error": stats.last_error,
+            }
+        )
+    return {
+        "worker_id": cluster.worker_id,
+        "bots": {"discord": len(bots.dc_bots), "qq": len(bots.qq_bots)},
+        "links": links,
+        "caches": {
+            name: {
+                "size": len(cache),
+                "hits": cache.hits,
+                "misses": cache.misses,
+                "hit_rate": cache.hit_rate,
+            }
+            for name, cache in caches.items()
+        },
+        "media_budget": {
+            "used": media_budget.used,
+            "limit": media_budget.limit,
+            "waiting": len(media_budget.waiters),
+        },
+        "transfers": {
+            direction: {
+                "files": stats.files,
+                "bytes": stats.bytes,
+                "seconds": stats.seconds,
+                "bytes_per_second": stats.bytes / stats.seconds if stats.seconds else 0,
+            }
+            for direction, stats in transfer_stats.items()
+        },
+        "msgid_count": await count_msgids(),
+        "audit_backlog": {
+            "pending": len(audit.pending_audits),
+            "passed": len(audit.passed_audits),
+        },
+    }
+
+
+def is_authorized(request: Request) -> bool:
+    if status_token is None:
+        return False
+    authorization = request.headers.get("Authorization", "")
+    return secrets.compare_digest(
+        authorization.encode(), f"Bearer {status_token}".encode()
+    )
+
+
+async def handle_status(request: Request) -> Response:
+    if not is_authorized(request):
+        return Response(401, content=json.dumps({"error": "unauthorized"}))
+    try:
+        status = await collect_status()
+    except Exception as e:
+        logger.error(f"collect status error: {e}")
+        return Response(500, content=json.dumps({"error": repr(e)}))
+    return Response(
+        200,
+        headers={"Content-Type": "application/json"},
+        content=json.dumps(status, ensure_ascii=False),
+    )
+
+
+def setup_status_route():
+    """在 driver 的 HTTP 服务上注册状态接口"""
+    if status_path is None:
+        return
+    if status_token is None:
+        logger.warning("dcqg_relay_status_token is not set, status route disabled")
+        return
+    driver = get_driver()
+    if not isinstance(driver, ASGIMixin):
+        logger.warning(f"driver {driver.type} does not support http server")
+        return
+    driver.setup_http_server(
+        HTTPServerSetup(
+            path=URL(status_path),
+            method="GET",
+            name="dcqg_relay_status",
+            handle_func=handle_status,
+        )
+    )
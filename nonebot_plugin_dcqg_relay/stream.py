@@ -0,0 +1,155 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+import mimetypes
+import time
+from typing import Any, Optional
+
+import aiohttp
+import filetype
+from nonebot.adapters.discord import Bot as dc_Bot
+from nonebot.adapters.discord.api import MessageGet
+from nonebot.compat import type_validate_python
+from yarl import URL
+
+from .budget import read_media
+from .config import plugin_config
+from .media import DC_FILE_MAX_BYTES
+from .stats import record_transfer
+
+discord_proxy = plugin_config.discord_proxy
+
+STREAM_CHUNK_SIZE = 64 * 1024
+"""流式转发时每次读取的字节数"""
+SNIFF_SIZE = 261
+"""Content-Type 不明确时，判断文件类型需要读取的开头字节数"""
+
+
+class FileTooLarge(Exception):
+    """文件超过目标平台的大小限制"""
+
+
+class MediaSource:
+    """已经开始下载、还未读取内容的文件"""
+
+    def __init__(self, url: str, response: aiohttp.ClientResponse):
+        self.url = url
+        self.response = response
+        self.content_type = response.content_type
+        self.size = response.content_length
+        self.filename = URL(url).name or "file"
+        self.head = b""
+        """判断文件类型时已经读取的开头"""
+        self.transferred = 0
+
+    @property
+    def is_image(self) -> bool:
+        return self.content_type.startswith("image/")
+
+    async def sniff(self):
+        """Content-Type 不明确时按文件开头判断类型，并补全文件扩展名"""
+        if self.content_type == "application/octet-stream":
+            try:
+                self.head = await self.response.content.readexactly(SNIFF_SIZE)
+            except asyncio.IncompleteReadError as e:
+                self.head = e.partial
+            if kind := filetype.guess(self.head):
+                self.content_type = kind.mime
+        if "." not in self.filename and (
+            extension := mimetypes.guess_extension(self.content_type)
+        ):
+            self.filename += extension
+
+    async def read(self) -> bytes:
+        """读取全部内容，计入媒体预算"""
+        data = await read_media(
+            self.response.read,
+            None if self.size is None else self.size - len(self.head),
+        )
+        return self.head + data if self.head else data
+
+    async def iter_chunks(self, max_bytes: int) -> AsyncIterator[bytes]:
+        """分块读取，超过 max_bytes 时抛出 FileTooLarge"""
+        if self.head:
+            self.transferred += len(self.head)
+            yield self.head
+        async for chunk in self.response.content.iter_chunked(STREAM_CHUNK_SIZE):
+            self.transferred += len(chunk)
+            if self.transferred > max_bytes:
+                raise FileTooLarge(f"{self.filename} exceeds {max_bytes} bytes")
+            yield chunk
+
+
+@asynccontextmanager
+async def open_media(
+    url: str, proxy: Optional[str] = None
+) -> AsyncIterator[MediaSource]:
+    """开始下载文件，只读取响应头"""
+    async with (
+        aiohttp.ClientSession() as session,
+        session.get(url, proxy=proxy) as response,
+    ):
+        response.raise_for_status()
+        source = MediaSource(url, response)
+        await source.sniff()
+        yield source
+
+
+def format_size(size: Optional[float]) -> str:
+    if size is None:
+        return "未知大小"
+    if size < 1024:
+        return f"{size:.0f} B"
+    for unit in ("KB", "MB"):
+        size /= 1024
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+    return f"{size / 1024:.1f} GB"
+
+
+async def stream_to_discord(
+    bot: dc_Bot,
+    webhook_id: int,
+    token: str,
+    source: MediaSource,
+    username: Optional[str],
+    avatar_url: Optional[str],
+) -> MessageGet:
+    """将文件边下载边上传到 discord webhook，不在内存中保存整个文件"""
+    if source.size is not None and source.size > DC_FILE_MAX_BYTES:
+        raise FileTooLarge(f"{source.filename} is {source.size} bytes")
+    payload: dict[str, Any] = {
+        "content": "",
+        "attachments": [{"id": 0, "filename": source.filename}],
+    }
+    if username:
+        payload["username"] = username
+    if avatar_url:
+        payload["avatar_url"] = avatar_url
+
+    with aiohttp.MultipartWriter("form-data") as form:
+        form.append_json(payload).set_content_disposition(
+            "form-data", name="payload_json"
+        )
+        form.append_payload(
+            aiohttp.AsyncIterablePayload(
+                source.iter_chunks(DC_FILE_MAX_BYTES),
+                content_type=source.content_type,
+            )
+        ).set_content_disposition(
+            "form-data", name="files[0]", filename=source.filename
+        )
+        start = time.perf_counter()
+        async with (
+            aiohttp.ClientSession() as session,
+            session.post(
+                str(bot.adapter.base_url / f"webhooks/{webhook_id}/{token}"),
+                params={"wait": "true"},
+                data=form,
+                proxy=discord_proxy,
+            ) as response,
+        ):
+            response.raise_for_status()
+            result = await response.json()
+    record_transfer("qq_to_dc", source.transferred, time.perf_counter() - start)
+    return type_validate_python(MessageGet, result)
@@ -0,0 +1,228 @@
+import asyncio
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+import json
+from pathlib import Path
+import secrets
+import time
+from typing import Any, Optional, Union
+
+from nonebot import logger
+import nonebot_plugin_localstore as store
+
+from .config import plugin_config
+
+trace_enabled = plugin_config.dcqg_relay_trace
+trace_min_ms = plugin_config.dcqg_relay_trace_min_ms
+
+TRACE_FLUSH_INTERVAL = 5
+"""写入 trace 文件的间隔（秒）"""
+TRACE_KEEP_FILES = 7
+"""保留的 trace 文件数（每天一个），超过后删除最早的文件"""
+TRACE_MAX_SPANS = 200
+"""一条 trace 最多记录的阶段数"""
+TRACE_MAX_PENDING = 10000
+"""等待写入的 trace 数上限，超过时丢弃新的 trace"""
+
+
+class Span:
+    """trace 中的一个阶段"""
+
+    def __init__(self, stage: str, start: float):
+        self.stage = stage
+        self.start = start
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self, origin: float) -> dict[str, Any]:
+        span: dict[str, Any] = {
+            "stage": self.stage,
+            "start_ms": round((self.start - origin) * 1000, 1),
+            "duration_ms": (
+                None if self.duration is None else round(self.duration * 1000, 1)
+            ),
+        }
+        if self.error:
+            span["error"] = self.error
+        return span
+
+
+class Trace:
+    """一次转发或撤回的过程，包括各阶段耗时、两边的消息 id 与重试"""
+
+    def __init__(self, name: str, link: str, parent_id: Optional[str] = None):
+        self.trace_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        """在另一个 trace 中发起（合并发送、发件箱）时为发起的 trace"""
+        self.name = name
+        self.link = link
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.sources: list[str] = []
+        self.destinations: list[str] = []
+        self.spans: list[Span] = []
+        self.retries: list[dict[str, Any]] = []
+        self.attrs: dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "link": self.link,
+            "started_at": self.started_at,
+            "duration_ms": (
+                None if self.duration is None else round(self.duration * 1000, 1)
+            ),
+            "error": self.error,
+            "sources": self.sources,
+            "destinations": self.destinations,
+            "retries": self.retries,
+            "spans": [span.to_dict(self.origin) for span in self.spans],
+            **self.attrs,
+        }
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar(
+    "dcqg_relay_trace", default=None
+)
+pending_traces: list[str] = []
+"""等待写入文件的 trace（JSON）"""
+writer_task: Optional[asyncio.Task] = None
+
+
+def get_trace_dir() -> Path:
+    return store.get_plugin_data_dir() / "trace"
+
+
+@contextmanager
+def start_trace(
+    name: str, link: str, source_id: Union[str, int, None] = None
+) -> Iterator[Trace]:
+    """
+    在此范围内（包括其中创建的任务）记录一个新的 trace，结束时写入文件；
+    日志的 extra 中带有 dcqg_trace，可以在日志格式中使用
+    """
+    parent = current_trace.get()
+    trace = Trace(name, link, parent.trace_id if parent else None)
+    if source_id is not None:
+        trace.sources.append(str(source_id))
+    token = current_trace.set(trace)
+    try:
+        with logger.contextualize(dcqg_trace=trace.trace_id):
+            yield trace
+    except BaseException as e:
+        trace.error = trace.error or repr(e)
+        raise
+    finally:
+        current_trace.reset(token)
+        trace.duration = time.perf_counter() - trace.origin
+        export_trace(trace)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """记录一个阶段的耗时与错误"""
+    trace = current_trace.get()
+    if trace is None or len(trace.spans) >= TRACE_MAX_SPANS:
+        yield
+        return
+    item = Span(stage, time.perf_counter())
+    trace.spans.append(item)
+    try:
+        yield
+    except BaseException as e:
+        item.error = repr(e)
+        raise
+    finally:
+        item.duration = time.perf_counter() - item.start
+
+
+def add_sources(*ids: Union[str, int]):
+    """记录来源消息 id，合并发送时有多个"""
+    if (trace := current_trace.get()) is not None:
+        trace.sources.extend(str(id) for id in ids if str(id) not in trace.sources)
+
+
+def add_destinations(*ids: Union[str, int]):
+    """记录发送或撤回的目标消息 id"""
+    if (trace := current_trace.get()) is not None:
+        trace.destinations.extend(str(id) for id in ids)
+
+
+def add_retry(stage: str, error: Optional[BaseException]):
+    if (trace := current_trace.get()) is not None:
+        trace.retries.append(
+            {
+                "stage": stage,
+                "at_ms": round((time.perf_counter() - trace.origin) * 1000, 1),
+                "error": None if error is None else repr(error),
+            }
+        )
+
+
+def set_trace_attr(key: str, value: Any):
+    if (trace := current_trace.get()) is not None:
+        trace.attrs[key] = value
+
+
+def fail_trace(error: BaseException):
+    """记录被处理掉、没有继续抛出的错误（如超过截止时间放弃）"""
+    if (trace := current_trace.get()) is not None:
+        trace.error = repr(error)
+
+
+def export_trace(trace: Trace):
+    """按 trace_min_ms 筛选后加入待写入队列，出错的 trace 总是写入"""
+    if not trace_enabled or len(pending_traces) >= TRACE_MAX_PENDING:
+        return
+    if trace.error is None and (trace.duration or 0) * 1000 < trace_min_ms:
+        return
+    pending_traces.append(
+        json.dumps(trace.to_dict(), ensure_ascii=False, separators=(",", ":"))
+    )
+
+
+def write_traces(lines: list[str], trace_dir: Path):
+    """追加到当天的文件，并删除过多的旧文件"""
+    trace_dir.mkdir(parents=True, exist_ok=True)
+    path = trace_dir / f"{datetime.now().strftime('%Y%m%d')}.jsonl"
+    with path.open("a", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+    for path in sorted(trace_dir.glob("*.jsonl"))[:-TRACE_KEEP_FILES]:
+        path.unlink(missing_ok=True)
+
+
+async def save_traces():
+    if not pending_traces:
+        return
+    lines = pending_traces[:]
+    pending_traces.clear()
+    try:
+        await asyncio.to_thread(write_traces, lines, get_trace_dir())
+    except Exception as e:
+        logger.error(f"write trace error: {e}")
+
+
+async def trace_writer():
+    while True:
+        await asyncio.sleep(TRACE_FLUSH_INTERVAL)
+        await save_traces()
+
+
+async def start_trace_writer():
+    global writer_task
+    if trace_enabled and writer_task is None:
+        writer_task = asyncio.create_task(trace_writer())
+
+
+async def stop_trace_writer():
+    global writer_task
+    if writer_task is not None:
+        writer_task.cancel()
+        writer_task = None
+    await save_traces()
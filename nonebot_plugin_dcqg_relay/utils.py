@@ -1,9 +1,11 @@
 import asyncio
+from collections.abc import Awaitable, Sequence
 import re
-from typing import Optional, Union
+from typing import Any, Callable, Optional, Union
 
 import aiohttp
 from nonebot import logger
+from nonebot.adapters import Event
 from nonebot.compat import model_dump
 from nonebot.adapters.discord import (
     Bot as dc_Bot,
@@ -18,12 +20,85 @@ from nonebot.adapters.qq import (
     MessageDeleteEvent as qq_MessageDeleteEvent,
 )
 
+from .budget import read_media
+from .cache import TTLCache
 from .config import LinkWithWebhook, LinkWithoutWebhook, plugin_config
+from .trace import add_destinations
 
 
 without_webhook_links: list[LinkWithoutWebhook] = plugin_config.dcqg_relay_channel_links
 with_webhook_links: list[LinkWithWebhook] = []
 discord_proxy = plugin_config.discord_proxy
+delete_concurrency = plugin_config.dcqg_relay_delete_concurrency
+unmatch_beginning = plugin_config.dcqg_relay_unmatch_beginning
+author_blocklist = set(plugin_config.dcqg_relay_author_blocklist)
+
+RELAY_EVENTS = (
+    qq_GuildMessageEvent,
+    dc_MessageCreateEvent,
+    qq_MessageDeleteEvent,
+    dc_MessageDeleteEvent,
+)
+
+link_index: dict[Union[int, str], LinkWithWebhook] = {}
+"""频道 id 到 link 的索引，QQ子频道与 Discord 频道 id 都在其中"""
+unmatch_patterns: dict[Union[int, str], Optional[re.Pattern[str]]] = {}
+"""频道 id 到不转发消息开头的正则"""
+webhook_ids: set[int] = set()
+"""插件使用的 webhook id，由这些 webhook 发送的消息是自己转发的消息"""
+relayed_message_ids: dict[int, None] = {}
+"""最近转发到 discord 的消息 id，按插入顺序淘汰"""
+RELAYED_MESSAGE_MAX = 1024
+
+dc_member_names: TTLCache[tuple[int, int], tuple[str, str]] = TTLCache(
+    plugin_config.dcqg_relay_member_cache_ttl, name="dc_member_names"
+)
+"""Discord 成员名缓存，键为 (guild_id, user_id)，不在服务器中查询时 guild_id 为 0"""
+
+
+def build_unmatch_pattern(beginning: list[str]) -> Optional[re.Pattern[str]]:
+    if not beginning:
+        return None
+    return re.compile(rf"\A *(?:{'|'.join(re.escape(b) for b in beginning)})")
+
+
+def build_link_index(links: list[LinkWithWebhook]):
+    """重建 link 索引，整体替换以保证查询时索引完整"""
+    global link_index, unmatch_patterns, webhook_ids
+    new_index: dict[Union[int, str], LinkWithWebhook] = {}
+    new_patterns: dict[Union[int, str], Optional[re.Pattern[str]]] = {}
+    for link in links:
+        pattern = build_unmatch_pattern(
+            unmatch_beginning
+            if link.unmatch_beginning is None
+            else link.unmatch_beginning
+        )
+        for channel_id in (link.dc_channel_id, link.qq_channel_id):
+            new_index[channel_id] = link
+            new_patterns[channel_id] = pattern
+    link_index, unmatch_patterns = new_index, new_patterns
+    webhook_ids = {link.webhook_id for link in links}
+
+
+def prefilter(event: Event) -> bool:
+    """在依赖注入前过滤事件：事件类型、未绑定的频道、屏蔽的用户与不转发的消息开头"""
+    if not isinstance(event, RELAY_EVENTS):
+        return False
+    channel_id = (
+        event.message.channel_id
+        if isinstance(event, qq_MessageDeleteEvent)
+        else event.channel_id
+    )
+    if channel_id not in link_index:
+        return False
+    if isinstance(event, (qq_GuildMessageEvent, dc_MessageCreateEvent)):
+        if author_blocklist and event.get_user_id() in author_blocklist:
+            return False
+        if (pattern := unmatch_patterns[channel_id]) and pattern.match(
+            event.get_plaintext()
+        ):
+            return False
+    return True
 
 
 async def check_messages(
@@ -37,17 +112,21 @@ async def check_messages(
 ) -> bool:
     """检查消息"""
     logger.debug("checked event type")
-    if isinstance(event, dc_MessageCreateEvent):
-        if not (
-            re.match(r".*?\[ID:\d*?\]$", event.author.username)
-            and event.author.bot is True
-        ):
-            return True
+    if isinstance(event, dc_MessageCreateEvent) and (
+        event.webhook_id in webhook_ids or event.id in relayed_message_ids
+    ):
         logger.debug("is self relay message")
         return False
     return True
 
 
+def add_relayed_message(message_id: int):
+    """记录转发到 discord 的消息 id，用于识别自己转发的消息"""
+    relayed_message_ids[message_id] = None
+    if len(relayed_message_ids) > RELAYED_MESSAGE_MAX:
+        del relayed_message_ids[next(iter(relayed_message_ids))]
+
+
 async def get_link(
     bot: Union[qq_Bot, dc_Bot],
     event: Union[
@@ -66,44 +145,79 @@ async def get_link(
 
 
 async def pick_link(channel_id: Union[int, str]) -> Optional[LinkWithWebhook]:
-    return next(
-        (
-            link
-            for link in with_webhook_links
-            if link.dc_channel_id == channel_id or link.qq_channel_id == channel_id
-        ),
-        None,
-    )
+    return link_index.get(channel_id)
 
 
 async def get_dc_member_name(
     bot: dc_Bot, guild_id: Missing[int], user_id: int
 ) -> tuple[str, str]:
+    key = (guild_id if guild_id is not UNSET else 0, user_id)
+    if (name := dc_member_names.get(key)) is not None:
+        return name
     try:
         if guild_id is not UNSET:
             member = await bot.get_guild_member(guild_id=guild_id, user_id=user_id)
             if (nick := member.nick) and nick is not UNSET:
-                return nick, member.user.username if member.user is not UNSET else ""
+                name = nick, member.user.username if member.user is not UNSET else ""
             elif member.user is not UNSET and (global_name := member.user.global_name):
-                return global_name, member.user.username
+                name = global_name, member.user.username
             else:
-                return "", str(user_id)
+                name = "", str(user_id)
         else:
             user = await bot.get_user(user_id=user_id)
-            return user.global_name or "", user.username
+            name = user.global_name or "", user.username
     except ActionFailed as e:
         if e.message == "Unknown User":
             return "(error:未知用户)", str(user_id)
         else:
             raise e
+    dc_member_names.set(key, name)
+    return name
+
+
+async def delete_relayed_messages(
+    rows: Sequence[tuple[int, Any]],
+    delete_func: Callable[..., Awaitable[Any]],
+    just_delete: list,
+) -> list[int]:
+    """
+    并发删除转发的消息，rows 为 (MsgID 行 id, 消息 id)，返回删除成功的行 id；
+    其中有删除被取消时，其余删除完成后再抛出 CancelledError
+    """
+    semaphore = asyncio.Semaphore(delete_concurrency)
+
+    async def delete_one(message_id: Any):
+        async with semaphore:
+            return await delete_func(message_id=message_id)
+
+    just_delete.extend(message_id for _, message_id in rows)
+    results = await asyncio.gather(
+        *(delete_one(message_id) for _, message_id in rows), return_exceptions=True
+    )
+    deleted: list[int] = []
+    cancelled: Optional[asyncio.CancelledError] = None
+    for (row_id, message_id), result in zip(rows, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, asyncio.CancelledError):
+                cancelled = result
+            else:
+                logger.warning(f"delete message {message_id} error: {result}")
+            just_delete.remove(message_id)
+        else:
+            deleted.append(row_id)
+            add_destinations(message_id)
+    if cancelled is not None:
+        raise cancelled
+    return deleted
 
 
 async def get_file_bytes(url: str, proxy: Optional[str] = None) -> bytes:
+    """下载文件，按 Content-Length 先占用媒体预算，预算不足时排队"""
     async with (
         aiohttp.ClientSession() as session,
         session.get(url, proxy=proxy) as response,
     ):
-        return await response.read()
+        return await read_media(response.read, response.content_length)
 
 
 async def get_webhook(
@@ -156,9 +270,15 @@ async def build_link(
 
 async def get_webhooks(bot: dc_Bot) -> list[int]:
     global with_webhook_links
-    task = [get_webhook(bot, link) for link in without_webhook_links]
+    provisioned = {link.dc_channel_id for link in with_webhook_links}
+    task = [
+        get_webhook(bot, link)
+        for link in without_webhook_links
+        if link.dc_channel_id not in provisioned
+    ]
     links = await asyncio.gather(*task)
     with_webhook_links.extend(
         link for link in links if isinstance(link, LinkWithWebhook)
     )
+    build_link_index(with_webhook_links)
     return [link for link in links if isinstance(link, int)]
@@ -0,0 +1,31 @@
+from pathlib import Path
+import tempfile
+
+import nonebot
+import pytest
+
+
+def pytest_configure(config: pytest.Config):
+    data_dir = Path(tempfile.mkdtemp(prefix="dcqg-relay-test-"))
+    nonebot.init(
+        driver="~none+~aiohttp",
+        sqlalchemy_database_url=f"sqlite+aiosqlite:///{data_dir / 'test.db'}",
+        alembic_startup_check=False,
+        localstore_use_cwd=False,
+        localstore_data_dir=str(data_dir),
+    )
+    from nonebot.adapters.discord import Adapter as dc_Adapter
+    from nonebot.adapters.qq import Adapter as qq_Adapter
+
+    driver = nonebot.get_driver()
+    driver.register_adapter(dc_Adapter)
+    driver.register_adapter(qq_Adapter)
+    nonebot.load_plugin("nonebot_plugin_dcqg_relay")
+
+
+@pytest.fixture
+async def orm():
+    """按测试用的数据库建表，每个测试使用新的连接"""
+    from nonebot_plugin_orm import init_orm
+
+    await init_orm()
@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+from typing import Any
+
+from nonebot.adapters.discord.exception import ActionFailed, NetworkError
+from nonebot.drivers import Response
+import pytest
+
+from nonebot_plugin_dcqg_relay import bots
+from nonebot_plugin_dcqg_relay.bots import BotUnavailable, pick_bot, use_bot
+
+
+@pytest.fixture(autouse=True)
+def clean_bots():
+    yield
+    bots.bot_guilds.clear()
+    bots.bot_load.clear()
+    bots.bot_failed_at.clear()
+
+
+def make_bots(*self_ids: str) -> dict[str, Any]:
+    return {self_id: SimpleNamespace(self_id=self_id) for self_id in self_ids}
+
+
+async def fail_with(candidates: dict[str, Any], error: Exception):
+    async with use_bot(candidates, 1):
+        raise error
+
+
+def test_pick_bot_by_guild_and_load():
+    candidates = make_bots("a", "b", "c")
+    bots.bot_guilds.update({"a": {"1"}, "b": {"1", "2"}})
+    bots.bot_load.update({"a": 0, "b": 1, "c": 2})
+    assert pick_bot(candidates, 1).self_id == "a"
+    assert pick_bot(candidates, 2).self_id == "b"
+    assert pick_bot(candidates, 3).self_id == "c"
+
+
+async def test_fail_over_after_network_error():
+    candidates = make_bots("a", "b")
+    with pytest.raises(BotUnavailable):
+        await fail_with(candidates, NetworkError("timeout"))
+    assert bots.bot_load["a"] == 0
+    async with use_bot(candidates, 1) as bot:
+        assert bot.self_id == "b"
+
+
+@pytest.mark.parametrize(("status_code", "failover"), [(400, False), (503, True)])
+async def test_fail_over_by_status_code(status_code: int, failover: bool):
+    candidates = make_bots("a", "b")
+    with pytest.raises(BotUnavailable if failover else ActionFailed):
+        await fail_with(candidates, ActionFailed(Response(status_code)))
+    assert ("a" in bots.bot_failed_at) is failover
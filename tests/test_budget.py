@@ -0,0 +1,111 @@
+import asyncio
+import io
+
+from PIL import Image
+import pytest
+
+from nonebot_plugin_dcqg_relay import budget
+from nonebot_plugin_dcqg_relay.budget import ByteBudget, MediaLease
+from nonebot_plugin_dcqg_relay.media import decoded_size
+
+
+async def test_admit_in_order():
+    media = ByteBudget(100)
+    first, second, third = MediaLease(media), MediaLease(media), MediaLease(media)
+    await first.acquire(80)
+    waiting = asyncio.create_task(second.acquire(50))
+    later = asyncio.create_task(third.acquire(10))
+    await asyncio.sleep(0)
+    # 按到达顺序等待，后到的小请求不会插队
+    assert not waiting.done()
+    assert not later.done()
+
+    first.close()
+    await asyncio.gather(waiting, later)
+    assert media.used == 60
+
+
+async def test_lease_overdraws():
+    media = ByteBudget(100)
+    lease = MediaLease(media)
+    await lease.acquire(80)
+    # 已经占用预算的转发继续占用时不等待，避免互相等待
+    await asyncio.wait_for(lease.acquire(80), 1)
+    assert media.used == 160
+    lease.close()
+    assert media.used == 0
+
+
+async def test_wake_same_lease():
+    media = ByteBudget(100)
+    holder, lease = MediaLease(media), MediaLease(media)
+    await holder.acquire(100)
+    first = asyncio.create_task(lease.acquire(60))
+    second = asyncio.create_task(lease.acquire(60))
+    await asyncio.sleep(0)
+
+    holder.close()
+    await asyncio.gather(first, second)
+    assert media.used == 120
+
+
+async def test_cancel_waiting():
+    media = ByteBudget(100)
+    holder = MediaLease(media)
+    await holder.acquire(60)
+    big = asyncio.create_task(MediaLease(media).acquire(100))
+    small = asyncio.create_task(MediaLease(media).acquire(30))
+    await asyncio.sleep(0)
+    assert not small.done()
+
+    # 排在前面的请求取消后，后面放得下的请求不再等待
+    big.cancel()
+    await asyncio.wait_for(small, 1)
+    assert media.used == 90
+    assert not media.waiters
+
+
+async def test_cancel_after_admitted():
+    media = ByteBudget(100)
+    holder = MediaLease(media)
+    await holder.acquire(100)
+    waiting = asyncio.create_task(MediaLease(media).acquire(50))
+    await asyncio.sleep(0)
+
+    # 预算已分配但等待的任务还未恢复时取消，分配的预算要归还
+    holder.close()
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert media.used == 0
+
+
+def make_png(size: tuple[int, int]) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGBA", size).save(output, format="PNG")
+    return output.getvalue()
+
+
+def test_decoded_size():
+    assert decoded_size(make_png((100, 50))) == 100 * 50 * 4
+    assert decoded_size(b"not an image") == 0
+
+
+async def test_convert_reserves_decoded_size(monkeypatch: pytest.MonkeyPatch):
+    media = ByteBudget(0)
+    monkeypatch.setattr(budget, "media_budget", media)
+    data = make_png((1000, 1000))
+    used: list[int] = []
+
+    def convert(data: bytes) -> tuple[bytes, None]:
+        used.append(media.used)
+        return b"x" * 10, None
+
+    async with budget.use_media_budget() as lease:
+        # 下载时已经按输入的大小占用
+        await lease.acquire(len(data))
+        output, _ = await budget.convert_media(convert, data, decoded_size)
+        assert output == b"x" * 10
+        assert lease.held == 10
+    assert used == [len(data) + 1000 * 1000 * 4]
+    assert media.used == 0
@@ -0,0 +1,107 @@
+from pathlib import Path
+import json
+import time
+
+import pytest
+
+from nonebot_plugin_dcqg_relay import snapshot
+from nonebot_plugin_dcqg_relay.cache import TTLCache
+
+
+def test_snapshot_skips_expired():
+    cache: TTLCache[str, int] = TTLCache(60)
+    cache.set("a", 1)
+    cache.data["b"] = (time.time() - 1, 2)
+    assert [(key, value) for key, _, value in cache.snapshot()] == [("a", 1)]
+
+
+def test_restore_keeps_expire_time():
+    cache: TTLCache[str, int] = TTLCache(60)
+    expire_at = time.time() + 10
+    assert cache.restore([("a", expire_at, 1), ("b", time.time() - 1, 2)]) == 1
+    assert cache.data == {"a": (expire_at, 1)}
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+
+
+def test_restore_does_not_overwrite():
+    cache: TTLCache[str, int] = TTLCache(60, maxsize=2)
+    cache.set("a", 1)
+    items = [("a", time.time() + 10, 0), ("b", time.time() + 10, 2)]
+    items.append(("c", time.time() + 10, 3))
+    # 已有的项比快照中的新；超过容量的项不恢复
+    assert cache.restore(items) == 1
+    assert cache.get("a") == 1
+    assert cache.get("b") == 2
+    assert cache.get("c") is None
+
+
+@pytest.fixture
+def named_cache(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> TTLCache:
+    cache: TTLCache[str, int] = TTLCache(60)
+    monkeypatch.setattr(snapshot, "caches", {"test": cache})
+    monkeypatch.setattr(snapshot, "cache_snapshot", True)
+    monkeypatch.setattr(snapshot, "get_snapshot_path", lambda: tmp_path / "caches.json")
+    return cache
+
+
+async def test_save_and_load(named_cache: TTLCache, tmp_path: Path):
+    named_cache.set("a", 1)
+    named_cache.data["expired"] = (time.time() - 1, 2)
+    await snapshot.save_caches()
+    assert not (tmp_path / "caches.tmp").exists()
+
+    named_cache.data.clear()
+    await snapshot.load_caches()
+    assert list(named_cache.data) == ["a"]
+    assert named_cache.get("a") == 1
+
+
+async def test_load_ignores_other_versions(named_cache: TTLCache, tmp_path: Path):
+    (tmp_path / "caches.json").write_text(
+        json.dumps(
+            {
+                "version": snapshot.SNAPSHOT_VERSION + 1,
+                "caches": {"test": [["a", time.time() + 10, 1]]},
+            }
+        )
+    )
+    await snapshot.load_caches()
+    assert len(named_cache) == 0
+
+
+async def test_load_broken_snapshot(named_cache: TTLCache, tmp_path: Path):
+    (tmp_path / "caches.json").write_bytes(b"broken")
+    await snapshot.load_caches()
+    assert len(named_cache) == 0
+
+
+async def test_save_and_load_tuples_and_bytes(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+):
+    names: TTLCache[tuple[int, int], tuple[str, str]] = TTLCache(60)
+    images: TTLCache[str, bytes] = TTLCache(60)
+    monkeypatch.setattr(snapshot, "caches", {"names": names, "images": images})
+    monkeypatch.setattr(snapshot, "cache_snapshot", True)
+    monkeypatch.setattr(snapshot, "get_snapshot_path", lambda: tmp_path / "caches.json")
+    names.set((1, 2), ("nick", "user"))
+    images.set("emoji", b"\x89PNG\x00")
+    await snapshot.save_caches()
+    # 快照为 JSON 文本，不会在读取时执行代码
+    json.loads((tmp_path / "caches.json").read_text(encoding="utf-8"))
+
+    names.data.clear()
+    images.data.clear()
+    await snapshot.load_caches()
+    assert names.get((1, 2)) == ("nick", "user")
+    assert images.get("emoji") == b"\x89PNG\x00"
+
+
+async def test_load_snapshot_with_bad_items(named_cache: TTLCache, tmp_path: Path):
+    (tmp_path / "caches.json").write_text(
+        json.dumps(
+            {"version": snapshot.SNAPSHOT_VERSION, "caches": {"test": [["a", 1]]}}
+        )
+    )
+    await snapshot.load_caches()
+    assert len(named_cache) == 0
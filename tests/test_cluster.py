@@ -0,0 +1,158 @@
+from nonebot_plugin_orm import get_session
+import pytest
+from sqlalchemy import delete, select
+
+from nonebot_plugin_dcqg_relay import cluster, utils
+from nonebot_plugin_dcqg_relay.cluster import (
+    RING_REPLICAS,
+    build_ring,
+    link_key,
+    ring_hash,
+    ring_owner,
+)
+from nonebot_plugin_dcqg_relay.config import LinkWithWebhook
+from nonebot_plugin_dcqg_relay.model import LinkLease, Worker
+
+KEYS = [f"{i}:{i + 1000}" for i in range(300)]
+
+
+def test_ring_hash_is_stable():
+    assert ring_hash("a") == ring_hash("a")
+    assert ring_hash("a") != ring_hash("b")
+    assert 0 <= ring_hash("a") < 2**64
+
+
+def test_build_ring():
+    ring = build_ring(["w1", "w2"])
+    assert len(ring) == 2 * RING_REPLICAS
+    assert ring == sorted(ring)
+    assert build_ring(["w2", "w1"]) == ring
+
+
+def test_ring_spreads_keys():
+    ring = build_ring(["w1", "w2", "w3"])
+    owners = [ring_owner(ring, key) for key in KEYS]
+    assert all(owners.count(worker) > len(KEYS) / 6 for worker in ("w1", "w2", "w3"))
+
+
+def test_adding_worker_only_moves_its_keys():
+    before = build_ring(["w1", "w2", "w3"])
+    after = build_ring(["w1", "w2", "w3", "w4"])
+    for key in KEYS:
+        owner = ring_owner(after, key)
+        assert owner in (ring_owner(before, key), "w4")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+async def leases(orm: None, monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    """清空租约表，使用可以调整的时间，link 为 LINKS"""
+    async with get_session() as session:
+        await session.execute(delete(LinkLease))
+        await session.execute(delete(Worker))
+        await session.commit()
+    clock = FakeClock()
+    monkeypatch.setattr(cluster, "time", clock)
+    monkeypatch.setattr(utils, "with_webhook_links", LINKS)
+    monkeypatch.setattr(cluster, "owned_links", set())
+    return clock
+
+
+LINKS = [
+    LinkWithWebhook(
+        qq_guild_id="1",
+        dc_guild_id=2,
+        qq_channel_id=str(i),
+        dc_channel_id=i,
+        webhook_id=5,
+        webhook_token="token",
+    )
+    for i in range(20)
+]
+LINK_KEYS = {link_key(link) for link in LINKS}
+
+
+async def sync_as(worker: str, monkeypatch: pytest.MonkeyPatch) -> set[str]:
+    monkeypatch.setattr(cluster, "worker_id", worker)
+    await cluster.sync_leases()
+    return cluster.owned_links
+
+
+async def lease_holders() -> dict[str, tuple[str, float]]:
+    async with get_session() as session:
+        return {
+            lease.link_key: (lease.worker_id, lease.expires_at)
+            for lease in await session.scalars(select(LinkLease))
+        }
+
+
+async def test_claim_and_renew(leases: FakeClock, monkeypatch: pytest.MonkeyPatch):
+    assert await sync_as("w1", monkeypatch) == LINK_KEYS
+    holders = await lease_holders()
+    assert {worker for worker, _ in holders.values()} == {"w1"}
+
+    leases.now += 10
+    assert await sync_as("w1", monkeypatch) == LINK_KEYS
+    assert all(
+        expires_at == leases.now + cluster.lease_ttl
+        for _, expires_at in (await lease_holders()).values()
+    )
+
+
+async def test_hand_off_to_new_owner(
+    leases: FakeClock, monkeypatch: pytest.MonkeyPatch
+):
+    await sync_as("w1", monkeypatch)
+    leases.now += 1
+    taken = await sync_as("w2", monkeypatch)
+    ring = build_ring(["w1", "w2"])
+    # 新 owner 不等租约过期，直接接管
+    assert taken == {key for key in LINK_KEYS if ring_owner(ring, key) == "w2"}
+    assert taken
+
+    leases.now += 1
+    # 原 owner 在同步时发现租约被接管，停止转发这些 link
+    assert await sync_as("w1", monkeypatch) == LINK_KEYS - taken
+    holders = await lease_holders()
+    assert {key for key, (worker, _) in holders.items() if worker == "w2"} == taken
+
+
+async def test_keep_relaying_until_taken(
+    leases: FakeClock, monkeypatch: pytest.MonkeyPatch
+):
+    await sync_as("w1", monkeypatch)
+    async with get_session() as session:
+        session.add(Worker(worker_id="w2", heartbeat_at=leases.now))
+        await session.commit()
+    # w2 已加入但还没有接管，w1 继续持有全部 link
+    leases.now += 1
+    assert await sync_as("w1", monkeypatch) == LINK_KEYS
+
+
+async def test_take_over_expired_worker(
+    leases: FakeClock, monkeypatch: pytest.MonkeyPatch
+):
+    await sync_as("w1", monkeypatch)
+    await sync_as("w2", monkeypatch)
+    # w1 停止心跳，超过 lease_ttl 后不再在环上
+    leases.now += cluster.lease_ttl + 1
+    assert await sync_as("w2", monkeypatch) == LINK_KEYS
+    holders = await lease_holders()
+    assert {worker for worker, _ in holders.values()} == {"w2"}
+
+
+async def test_release_removed_links(
+    leases: FakeClock, monkeypatch: pytest.MonkeyPatch
+):
+    await sync_as("w1", monkeypatch)
+    monkeypatch.setattr(utils, "with_webhook_links", LINKS[1:])
+    leases.now += 1
+    assert await sync_as("w1", monkeypatch) == LINK_KEYS - {link_key(LINKS[0])}
+    assert link_key(LINKS[0]) not in await lease_holders()
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from nonebot_plugin_dcqg_relay import coalesce
+
+KEY = ("dc_to_qq", "qq:dc", "author")
+
+
+@pytest.fixture(autouse=True)
+def window(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(coalesce, "coalesce_window", 50)
+
+
+def merge_short(first: str, second: str):
+    """合并后不超过 5 个字符"""
+    text = first + second
+    return text if len(text) <= 5 else None
+
+
+async def test_merge_within_window():
+    sent: list[str] = []
+
+    async def flush(text: str):
+        sent.append(text)
+
+    await coalesce.coalesce(KEY, "a", merge_short, flush)
+    await coalesce.coalesce(KEY, "b", merge_short, flush)
+    assert sent == []
+    await asyncio.sleep(0.1)
+    assert sent == ["ab"]
+    assert KEY not in coalesce.pending_bursts
+
+
+async def test_flush_before_unmergeable():
+    sent: list[str] = []
+
+    async def flush(text: str):
+        sent.append(text)
+
+    await coalesce.coalesce(KEY, "abc", merge_short, flush)
+    await coalesce.coalesce(KEY, "def", merge_short, flush)
+    assert sent == ["abc"]
+    await asyncio.sleep(0.1)
+    assert sent == ["abc", "def"]
+
+
+async def test_send_now_after_pending():
+    sent: list[str] = []
+
+    async def flush(text: str):
+        await asyncio.sleep(0.01)
+        sent.append(text)
+
+    async def send_image():
+        sent.append("image")
+
+    await coalesce.coalesce(KEY, "a", merge_short, flush)
+    await coalesce.send_now(KEY, send_image)
+    assert sent == ["a", "image"]
+    assert KEY not in coalesce.pending_bursts
+
+
+async def test_send_now_waits_for_flushing_burst():
+    sent: list[str] = []
+
+    async def flush(text: str):
+        await asyncio.sleep(0.05)
+        sent.append(text)
+
+    async def send_image():
+        sent.append("image")
+
+    await coalesce.coalesce(KEY, "a", merge_short, flush)
+    # 定时发送已经开始，但还没有发送完成
+    await asyncio.sleep(0.07)
+    assert KEY not in coalesce.pending_bursts
+    await coalesce.send_now(KEY, send_image)
+    assert sent == ["a", "image"]
+
+
+async def test_max_hold_from_first_message():
+    sent: list[str] = []
+
+    async def flush(text: str):
+        sent.append(text)
+
+    def merge(first: str, second: str):
+        return first + second
+
+    for _ in range(10):
+        await coalesce.coalesce(KEY, "a", merge, flush)
+        await asyncio.sleep(0.03)
+    # 间隔小于窗口，但最多等待 4 个窗口（200ms）
+    assert sent
+    assert len(sent[0]) < 10
+    await asyncio.sleep(0.1)
+    assert "".join(sent) == "a" * 10
+
+
+async def test_flush_all_bursts():
+    sent: list[str] = []
+
+    async def flush(text: str):
+        sent.append(text)
+
+    other = ("dc_to_qq", "other", "author")
+    await coalesce.coalesce(KEY, "a", merge_short, flush)
+    await coalesce.coalesce(other, "b", merge_short, flush)
+    await coalesce.flush_all_bursts({"qq:dc"})
+    assert sent == ["a"]
+    assert list(coalesce.pending_bursts) == [other]
+    await coalesce.flush_all_bursts()
+    assert sent == ["a", "b"]
@@ -0,0 +1,15 @@
+from pydantic import ValidationError
+import pytest
+
+from nonebot_plugin_dcqg_relay.config import Config
+
+
+@pytest.mark.parametrize("rate", [0, 0.05, 1])
+def test_profile_rate(rate: float):
+    assert Config(dcqg_relay_profile_rate=rate).dcqg_relay_profile_rate == rate
+
+
+@pytest.mark.parametrize("rate", [-0.1, 1.5])
+def test_invalid_profile_rate(rate: float):
+    with pytest.raises(ValidationError):
+        Config(dcqg_relay_profile_rate=rate)
@@ -0,0 +1,138 @@
+import io
+from types import SimpleNamespace
+from typing import Optional
+
+from nonebot.adapters.discord.api import UNSET
+from nonebot.adapters.qq import Message as qq_Message
+from PIL import Image
+from nonebot_plugin_orm import get_session
+import pytest
+from sqlalchemy import select
+
+from nonebot_plugin_dcqg_relay import bots, dc_to_qq
+from nonebot_plugin_dcqg_relay.config import LinkWithWebhook
+from nonebot_plugin_dcqg_relay.dc_to_qq import DCToQQPayload, send_dc_to_qq
+from nonebot_plugin_dcqg_relay.model import MsgID
+
+LINK = LinkWithWebhook(
+    qq_guild_id="1",
+    dc_guild_id=2,
+    qq_channel_id="3",
+    dc_channel_id=4,
+    webhook_id=5,
+    webhook_token="token",
+)
+
+
+class FakeQQBot:
+    self_id = "qq"
+
+    def __init__(self, fail_at: int):
+        self.fail_at = fail_at
+        self.images: list[bytes] = []
+
+    async def send_to_channel(self, channel_id: str, message: qq_Message):
+        if len(self.images) == self.fail_at:
+            self.fail_at = -1
+            raise RuntimeError("send failed")
+        self.images.extend(
+            seg.data["content"] for seg in message if seg.type == "file_image"
+        )
+        return SimpleNamespace(id=f"qq-{len(self.images)}")
+
+
+async def test_resume_after_partial_send(orm: None, monkeypatch: pytest.MonkeyPatch):
+    async def get_qq_img(url: str, proxy: Optional[str]) -> bytes:
+        return url.encode()
+
+    bot = FakeQQBot(fail_at=1)
+    monkeypatch.setitem(bots.qq_bots, bot.self_id, bot)
+    monkeypatch.setattr(dc_to_qq, "get_qq_img", get_qq_img)
+    payload = DCToQQPayload(
+        dc_message_ids=[100],
+        header="user:\n",
+        text="hello",
+        emoji_list=[],
+        img_list=["a", "b", "c"],
+    )
+
+    with pytest.raises(RuntimeError):
+        await send_dc_to_qq(payload, LINK)
+    assert payload.sent == 1
+
+    await send_dc_to_qq(payload, LINK)
+    assert bot.images == [b"a", b"b", b"c"]
+    async with get_session() as session:
+        qqids = set(await session.scalars(select(MsgID.qqid).where(MsgID.dcid == 100)))
+    assert qqids == {"qq-1", "qq-2", "qq-3"}
+
+
+async def test_composite_falls_back_to_names(
+    orm: None, monkeypatch: pytest.MonkeyPatch
+):
+    async def get_dc_emoji_bytes(url: str, proxy: Optional[str]) -> bytes:
+        raise RuntimeError("download failed")
+
+    bot = FakeQQBot(fail_at=-1)
+    sent: list[qq_Message] = []
+    send_to_channel = bot.send_to_channel
+
+    async def record(channel_id: str, message: qq_Message):
+        sent.append(message)
+        return await send_to_channel(channel_id, message)
+
+    monkeypatch.setattr(bot, "send_to_channel", record)
+    monkeypatch.setitem(bots.qq_bots, bot.self_id, bot)
+    monkeypatch.setattr(dc_to_qq, "get_dc_emoji_bytes", get_dc_emoji_bytes)
+    monkeypatch.setattr(dc_to_qq, "emoji_composite", True)
+    payload = DCToQQPayload(
+        dc_message_ids=[101],
+        header="user:\n",
+        text="hi",
+        emoji_list=["https://cdn/1.webp", "https://cdn/2.webp"],
+        emoji_names=["wave", "smile"],
+        img_list=[],
+    )
+
+    await send_dc_to_qq(payload, LINK)
+    (message,) = sent
+    assert not [seg for seg in message if seg.type == "file_image"]
+    assert message.extract_plain_text().endswith(":wave: :smile:")
+
+
+async def test_composite_skips_failed_download(monkeypatch: pytest.MonkeyPatch):
+    output = io.BytesIO()
+    Image.new("RGBA", (32, 32)).save(output, format="PNG")
+
+    async def get_dc_emoji_bytes(url: str, proxy: Optional[str]) -> bytes:
+        if url.endswith("2.webp"):
+            raise RuntimeError("download failed")
+        return output.getvalue()
+
+    monkeypatch.setattr(dc_to_qq, "get_dc_emoji_bytes", get_dc_emoji_bytes)
+    img_bytes = await dc_to_qq.get_qq_emoji_composite(
+        ["https://cdn/1.webp", "https://cdn/2.webp", "https://cdn/3.webp"], None
+    )
+    assert img_bytes is not None
+    width, height = Image.open(io.BytesIO(img_bytes)).size
+    assert height == dc_to_qq.EMOJI_TILE_SIZE
+    assert width == dc_to_qq.EMOJI_TILE_SIZE * 2 + dc_to_qq.EMOJI_TILE_GAP
+
+
+async def test_custom_emoji_not_matched_by_name():
+    event = SimpleNamespace(
+        member=UNSET,
+        author=SimpleNamespace(global_name="user", username="user"),
+        content="😮<:微笑:123>",
+        guild_id=2,
+        mention_everyone=False,
+        attachments=[],
+    )
+    message, emoji_list, emoji_names, _ = await dc_to_qq.build_qq_message(
+        None,  # type: ignore
+        event,  # type: ignore
+    )
+    # 自定义表情只按图片发送，unicode 表情仍转换为 QQ 表情
+    assert emoji_names == ["微笑"]
+    assert len(emoji_list) == 1
+    assert [seg.type for seg in message] == ["text", "emoji"]
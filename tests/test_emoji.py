@@ -0,0 +1,47 @@
+import pytest
+
+from nonebot_plugin_dcqg_relay.dc_to_qq import build_qq_text
+
+
+def segments(text: str) -> list[tuple[str, str]]:
+    return [
+        (seg.type, seg.data["id"] if seg.type == "emoji" else seg.data["text"])
+        for seg in build_qq_text(text)
+    ]
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("❤", [("emoji", "66")]),
+        ("❤️", [("emoji", "66")]),
+        ("👍🏽", [("emoji", "76")]),
+        ("a👍b", [("text", "a"), ("emoji", "76"), ("text", "b")]),
+        ("👍👍", [("emoji", "76"), ("emoji", "76")]),
+    ],
+)
+def test_convert_emoji(text: str, expected: list[tuple[str, str]]):
+    assert segments(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        # ZWJ 组合表情
+        "❤️‍🔥",
+        "❤‍🔥",
+        "👍🏽‍❤️",
+        "🔥‍❤️",
+        "👨‍❤️‍👨",
+        # 键帽表情
+        "1️⃣",
+        "#⃣",
+        "❤️⃣",
+    ],
+)
+def test_keep_emoji_sequence(text: str):
+    assert segments(text) == [("text", text)]
+
+
+def test_sequence_next_to_emoji():
+    assert segments("👍❤️‍🔥") == [("emoji", "76"), ("text", "❤️‍🔥")]
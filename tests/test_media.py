@@ -0,0 +1,76 @@
+import io
+
+from PIL import Image
+
+from nonebot_plugin_dcqg_relay.media import (
+    DC_IMAGE_FORMATS,
+    QQ_IMAGE_FORMATS,
+    composite_images,
+    optimize_image,
+)
+
+
+def make_image(size: tuple[int, int], format: str, mode: str = "RGB") -> bytes:
+    output = io.BytesIO()
+    Image.new(mode, size, (200, 100, 50, 255)[: len(mode)]).save(output, format=format)
+    return output.getvalue()
+
+
+def make_animation(format: str) -> bytes:
+    frames = [Image.new("RGBA", (16, 16), (i * 60, 0, 0, 255)) for i in range(3)]
+    output = io.BytesIO()
+    frames[0].save(output, format=format, save_all=True, append_images=frames[1:])
+    return output.getvalue()
+
+
+def test_keep_small_supported_image():
+    img_bytes = make_image((32, 32), "PNG")
+    assert optimize_image(img_bytes, QQ_IMAGE_FORMATS, 1024 * 1024) == (
+        img_bytes,
+        "png",
+    )
+
+
+def test_convert_unsupported_format():
+    output, kind = optimize_image(
+        make_image((32, 32), "WEBP"), QQ_IMAGE_FORMATS, 1024 * 1024
+    )
+    assert kind == "jpg"
+    assert Image.open(io.BytesIO(output)).format == "JPEG"
+
+
+def test_keep_alpha_when_converting():
+    _, kind = optimize_image(
+        make_image((32, 32), "TIFF", "RGBA"), DC_IMAGE_FORMATS, 1024 * 1024
+    )
+    assert kind == "webp"
+
+
+def test_keep_animation():
+    output, kind = optimize_image(make_animation("WEBP"), QQ_IMAGE_FORMATS, 1024 * 1024)
+    assert kind == "gif"
+    assert Image.open(io.BytesIO(output)).n_frames == 3
+
+
+def test_downscale_large_image():
+    output, _ = optimize_image(
+        make_image((4096, 16), "PNG"), QQ_IMAGE_FORMATS, 1024 * 1024
+    )
+    assert Image.open(io.BytesIO(output)).size == (2048, 8)
+
+
+def test_skip_non_image():
+    data = b"not an image"
+    assert optimize_image(data, QQ_IMAGE_FORMATS, 1024) == (data, "dat")
+
+
+def test_composite_skips_broken_images():
+    tile = make_image((32, 32), "PNG")
+    output = composite_images([tile, b"broken", tile], 16, 4)
+    assert output is not None
+    assert Image.open(io.BytesIO(output)).size == (16 * 2 + 4, 16)
+
+
+def test_composite_without_images():
+    assert composite_images([b"broken"], 16, 4) is None
+    assert composite_images([], 16, 4) is None
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from typing import Optional
+
+from nonebot_plugin_orm import get_session
+from pydantic import BaseModel
+import pytest
+from sqlalchemy import select
+
+from nonebot_plugin_dcqg_relay import deadline, outbox, utils
+from nonebot_plugin_dcqg_relay.cluster import link_key
+from nonebot_plugin_dcqg_relay.config import LinkWithWebhook
+from nonebot_plugin_dcqg_relay.model import Outbox
+
+LINK = LinkWithWebhook(
+    qq_guild_id="1",
+    dc_guild_id=2,
+    qq_channel_id="3",
+    dc_channel_id=4,
+    webhook_id=5,
+    webhook_token="token",
+)
+KEY = link_key(LINK)
+
+
+class TextPayload(BaseModel):
+    text: str
+
+
+@pytest.fixture
+def sent(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    sent: list[str] = []
+
+    async def handler(payload: TextPayload, link: LinkWithWebhook):
+        sent.append(payload.text)
+
+    monkeypatch.setitem(outbox.outbox_handlers, "test", (TextPayload, handler))
+    return sent
+
+
+async def add_entry(
+    text: str, next_attempt_at: float, created_at: Optional[float] = None
+):
+    async with get_session() as session:
+        session.add(
+            Outbox(
+                link_key=KEY,
+                direction="test",
+                payload=outbox.dump_payload(TextPayload(text=text)),
+                created_at=time.time() if created_at is None else created_at,
+                attempts=1,
+                next_attempt_at=next_attempt_at,
+            )
+        )
+        await session.commit()
+
+
+async def count_entries() -> int:
+    async with get_session() as session:
+        return len(list(await session.scalars(select(Outbox.id))))
+
+
+async def test_keep_entries_of_missing_link(
+    orm: None, sent: list[str], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(utils, "with_webhook_links", [])
+    await add_entry("a", time.time())
+    await outbox.drain_link(KEY)
+    assert sent == []
+    assert await count_entries() == 1
+
+    monkeypatch.setattr(utils, "with_webhook_links", [LINK])
+    await outbox.drain_link(KEY)
+    assert sent == ["a"]
+    assert await count_entries() == 0
+
+
+async def test_drain_links_retries_now(
+    orm: None, sent: list[str], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(utils, "with_webhook_links", [LINK])
+    await add_entry("a", time.time() + 60)
+    await add_entry("b", time.time())
+    await outbox.drain_link(KEY)
+    assert sent == []
+
+    await outbox.drain_links({KEY})
+    assert sent == ["a", "b"]
+    assert await count_entries() == 0
+
+
+async def test_drain_links_waits_for_busy_link(
+    orm: None, sent: list[str], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(utils, "with_webhook_links", [LINK])
+    await add_entry("a", time.time())
+    busy = outbox.busy_links[KEY] = asyncio.Event()
+    task = asyncio.create_task(outbox.drain_links({KEY}))
+    await asyncio.sleep(0.01)
+    assert not task.done()
+
+    del outbox.busy_links[KEY]
+    busy.set()
+    await task
+    assert sent == ["a"]
+
+
+async def test_replay_ignores_message_deadline(
+    orm: None, sent: list[str], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(utils, "with_webhook_links", [LINK])
+    monkeypatch.setattr(deadline, "relay_deadline", 60)
+    monkeypatch.setattr(outbox, "outbox_ttl", 3600)
+    await add_entry("old", time.time(), created_at=time.time() - 600)
+    await add_entry("expired", time.time(), created_at=time.time() - 7200)
+    await outbox.drain_link(KEY)
+    assert sent == ["old"]
+    assert await count_entries() == 0
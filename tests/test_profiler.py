@@ -0,0 +1,51 @@
+import asyncio
+from pathlib import Path
+import time
+
+import pytest
+
+from nonebot_plugin_dcqg_relay import profiler
+
+
+def busy(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def sampled_work():
+    with profiler.profile_sample():
+        for _ in range(5):
+            busy(0.03)
+            await asyncio.sleep(0)
+
+
+async def other_work():
+    for _ in range(5):
+        busy(0.03)
+        await asyncio.sleep(0)
+
+
+async def test_only_sample_handler_task(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+):
+    monkeypatch.setattr(profiler, "profile_rate", 1)
+    monkeypatch.setattr(profiler, "PROFILE_INTERVAL", 0.001)
+    monkeypatch.setattr(profiler, "get_profile_dir", lambda: tmp_path)
+    await asyncio.gather(sampled_work(), other_work())
+    await profiler.stop_profile()
+
+    (path,) = tmp_path.glob("*.collapsed")  # noqa: ASYNC240
+    stacks = path.read_text(encoding="utf-8").splitlines()
+    assert stacks
+    assert all("sampled_work" in stack for stack in stacks)
+    assert not any("other_work" in stack for stack in stacks)
+    assert any(f"busy ({__file__}" in stack for stack in stacks)
+
+
+async def test_skip_when_not_sampled(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    monkeypatch.setattr(profiler, "profile_rate", 0)
+    monkeypatch.setattr(profiler, "get_profile_dir", lambda: tmp_path)
+    await sampled_work()
+    await profiler.save_profile()
+    assert not list(tmp_path.glob("*.collapsed"))  # noqa: ASYNC240
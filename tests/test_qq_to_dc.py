@@ -0,0 +1,202 @@
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+import io
+from types import SimpleNamespace
+from typing import Any, Optional
+
+from nonebot.adapters.discord.exception import NetworkError
+from nonebot_plugin_orm import get_session
+from PIL import Image
+import pytest
+
+from nonebot_plugin_dcqg_relay import bots, qq_to_dc
+from nonebot_plugin_dcqg_relay.bots import BotUnavailable
+from nonebot_plugin_dcqg_relay.config import LinkWithWebhook
+from nonebot_plugin_dcqg_relay.model import MsgID
+from nonebot_plugin_dcqg_relay.qq_to_dc import (
+    SENT_MESSAGE,
+    QQReply,
+    build_dc_embeds,
+    send_to_discord,
+)
+from nonebot_plugin_dcqg_relay.stream import MediaSource, format_size
+
+
+@pytest.mark.parametrize(
+    ("size", "expected"),
+    [
+        (None, "未知大小"),
+        (0, "0 B"),
+        (1023, "1023 B"),
+        (1024, "1.0 KB"),
+        (1536, "1.5 KB"),
+        (5 * 1024 * 1024, "5.0 MB"),
+        (3 * 1024**3, "3.0 GB"),
+        (2048 * 1024**3, "2048.0 GB"),
+    ],
+)
+def test_format_size(size: Optional[int], expected: str):
+    assert format_size(size) == expected
+
+
+def make_png() -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(output, format="PNG")
+    return output.getvalue()
+
+
+CONTENT_TYPES = {
+    "https://cdn/a.png": "image/png",
+    "https://cdn/b.mp4": "video/mp4",
+    "https://cdn/c.zip": "application/zip",
+}
+
+
+class FakeDCBot:
+    def __init__(self):
+        self.messages: list[dict[str, Any]] = []
+
+    async def execute_webhook(self, **kwargs: Any):
+        self.messages.append(kwargs)
+        return SimpleNamespace(id=len(self.messages))
+
+
+@pytest.fixture
+def streamed(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    png = make_png()
+
+    @asynccontextmanager
+    async def open_media(url: str) -> AsyncIterator[MediaSource]:
+        async def read() -> bytes:
+            return png
+
+        yield MediaSource(
+            url,
+            SimpleNamespace(  # type: ignore
+                content_type=CONTENT_TYPES[url], content_length=len(png), read=read
+            ),
+        )
+
+    streamed: list[str] = []
+
+    async def stream_to_discord(bot, webhook_id, token, source: MediaSource, *_):
+        if source.url.endswith(".zip") and ".zip" not in streamed:
+            streamed.append(".zip")
+            raise RuntimeError("upload failed")
+        streamed.append(source.url)
+        return SimpleNamespace(id=100 + len(streamed))
+
+    monkeypatch.setattr(qq_to_dc, "open_media", open_media)
+    monkeypatch.setattr(qq_to_dc, "stream_to_discord", stream_to_discord)
+    return streamed
+
+
+async def test_resume_after_partial_send(streamed: list[str]):
+    bot = FakeDCBot()
+    img_list = list(CONTENT_TYPES)
+    sent: list[str] = []
+    sends: list[Any] = []
+
+    with pytest.raises(RuntimeError):
+        await send_to_discord(
+            bot, 1, "token", "hi", img_list, None, "user", None, sent, sends
+        )
+    # 失败前发出的消息仍然返回，以便记录与撤回
+    assert [send.id for send in sends] == [1, 101]
+    assert sent == [SENT_MESSAGE, "https://cdn/a.png", "https://cdn/b.mp4"]
+    assert len(bot.messages[0]["files"]) == 1
+
+    sends.clear()
+    await send_to_discord(
+        bot, 1, "token", "hi", img_list, None, "user", None, sent, sends
+    )
+    assert len(bot.messages) == 1
+    assert streamed == ["https://cdn/b.mp4", ".zip", "https://cdn/c.zip"]
+    assert [send.id for send in sends] == [103]
+
+
+async def test_passthrough_only_images(
+    streamed: list[str], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(qq_to_dc, "image_passthrough", True)
+    bot = FakeDCBot()
+    sends: list[Any] = []
+
+    await send_to_discord(
+        bot,
+        1,
+        "token",
+        "hi",
+        ["cdn/a.png", "https://cdn/b.mp4"],
+        None,
+        "user",
+        None,
+        [],
+        sends,
+    )
+    (message,) = bot.messages
+    assert message["files"] is None
+    assert [embed.image.url for embed in message["embeds"]] == ["https://cdn/a.png"]
+    assert streamed == ["https://cdn/b.mp4"]
+
+
+class FailingDCBot:
+    def __init__(self, self_id: str, fail: bool):
+        self.self_id = self_id
+        self.fail = fail
+
+    async def get_channel_message(self, channel_id: int, message_id: int):
+        if self.fail:
+            raise NetworkError("discord down")
+        return SimpleNamespace(id=message_id, content="original")
+
+
+class FakeQQBot:
+    self_id = "qq"
+
+    async def me(self):
+        return SimpleNamespace(id="qq-bot")
+
+    async def get_member(self, guild_id: str, user_id: str):
+        return SimpleNamespace(
+            nick="nick", user=SimpleNamespace(username="user", avatar="avatar")
+        )
+
+
+async def test_discord_failure_in_reply_lookup(
+    orm: None, monkeypatch: pytest.MonkeyPatch
+):
+    link = LinkWithWebhook(
+        qq_guild_id="1",
+        dc_guild_id=2,
+        qq_channel_id="3",
+        dc_channel_id=4,
+        webhook_id=5,
+        webhook_token="token",
+    )
+    monkeypatch.setattr(bots, "bot_failed_at", {})
+    monkeypatch.setattr(
+        bots,
+        "dc_bots",
+        {"broken": FailingDCBot("broken", True), "ok": FailingDCBot("ok", False)},
+    )
+    monkeypatch.setattr(bots, "qq_bots", {"qq": FakeQQBot()})
+    monkeypatch.setattr(qq_to_dc, "qq_bot_users", {})
+    async with get_session() as session:
+        session.add(MsgID(dcid=200, qqid="qq-reply"))
+        await session.commit()
+    reply = QQReply(
+        message_id="qq-reply", author_id="someone", guild_id="1", content="original"
+    )
+
+    with pytest.raises(BotUnavailable):
+        async with bots.use_dc_bot(link.dc_guild_id) as dc_bot:
+            await build_dc_embeds(dc_bot, reply, link)
+    # 只有 discord bot 算作失败，QQ bot 不受影响
+    assert set(bots.bot_failed_at) == {"broken"}
+
+    async with bots.use_dc_bot(link.dc_guild_id) as dc_bot:
+        assert dc_bot.self_id == "ok"
+        (embed,) = await build_dc_embeds(dc_bot, reply, link)
+    assert embed.description.startswith("original")
+    assert embed.author.name == "nick[ID:someone]"
@@ -0,0 +1,38 @@
+from typing import Optional
+
+from nonebot.drivers import Request
+import pytest
+
+from nonebot_plugin_dcqg_relay import stats
+
+
+@pytest.mark.parametrize(
+    ("token", "authorization", "expected"),
+    [
+        ("secret", "Bearer secret", True),
+        ("secret", "Bearer wrong", False),
+        ("secret", None, False),
+        (None, "Bearer ", False),
+    ],
+)
+def test_is_authorized(
+    monkeypatch: pytest.MonkeyPatch,
+    token: Optional[str],
+    authorization: Optional[str],
+    expected: bool,
+):
+    monkeypatch.setattr(stats, "status_token", token)
+    headers = {} if authorization is None else {"Authorization": authorization}
+    request = Request("GET", "http://localhost/status", headers=headers)
+    assert stats.is_authorized(request) is expected
+
+
+async def test_msgid_count_is_cached(orm: None, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(stats, "msgid_count", None)
+    count = await stats.count_msgids()
+    monkeypatch.setattr(stats, "msgid_count", (42, stats.time.time()))
+    assert await stats.count_msgids() == 42
+    monkeypatch.setattr(
+        stats, "msgid_count", (42, stats.time.time() - stats.MSGID_COUNT_TTL - 1)
+    )
+    assert await stats.count_msgids() == count
@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+from nonebot_plugin_dcqg_relay.utils import delete_relayed_messages
+
+
+async def test_delete_relayed_messages():
+    async def delete(message_id: int):
+        if message_id == 20:
+            raise RuntimeError("failed")
+
+    just_delete: list = []
+    deleted = await delete_relayed_messages(
+        [(1, 10), (2, 20), (3, 30)], delete, just_delete
+    )
+    assert deleted == [1, 3]
+    assert just_delete == [10, 30]
+
+
+async def test_delete_relayed_messages_cancelled():
+    async def delete(message_id: int):
+        if message_id == 20:
+            raise asyncio.CancelledError
+
+    just_delete: list = []
+    with pytest.raises(asyncio.CancelledError):
+        await delete_relayed_messages([(1, 10), (2, 20)], delete, just_delete)
+    assert just_delete == [10]